@@ -0,0 +1,353 @@
+# Member 1
+# Batched datagram I/O: recvmmsg/sendmmsg through ctypes on Linux, one call per datagram elsewhere
+
+import collections
+import ctypes
+import ctypes.util
+import errno
+import os
+import socket
+import struct
+import sys
+import threading
+
+from vars import *
+
+MSG_WAITFORONE = 0x10000  # recvmmsg: block for the first datagram only
+
+class iovec(ctypes.Structure):
+    _fields_ = [("iov_base", ctypes.c_void_p), ("iov_len", ctypes.c_size_t)]
+
+class msghdr(ctypes.Structure):
+    _fields_ = [
+        ("msg_name", ctypes.c_void_p),
+        ("msg_namelen", ctypes.c_uint32),
+        ("msg_iov", ctypes.POINTER(iovec)),
+        ("msg_iovlen", ctypes.c_size_t),
+        ("msg_control", ctypes.c_void_p),
+        ("msg_controllen", ctypes.c_size_t),
+        ("msg_flags", ctypes.c_int)
+    ]
+
+class mmsghdr(ctypes.Structure):
+    _fields_ = [("msg_hdr", msghdr), ("msg_len", ctypes.c_uint)]
+
+class sockaddr_in(ctypes.Structure):
+    _fields_ = [
+        ("sin_family", ctypes.c_ushort),
+        ("sin_port", ctypes.c_uint16),  # Network byte order
+        ("sin_addr", ctypes.c_uint8 * 4),
+        ("sin_zero", ctypes.c_uint8 * 8)
+    ]
+
+IOVEC_BASE = struct.Struct("@P")  # iovec.iov_base
+SOCKADDR_IN = struct.Struct("=H2s4s8x")  # family (host order), port and address (network order)
+
+def _load_libc():
+    """Load libc if it provides recvmmsg/sendmmsg (Linux only)."""
+    if not sys.platform.startswith("linux"):
+        return None
+    try:
+        libc = ctypes.CDLL(ctypes.util.find_library("c") or "libc.so.6", use_errno=True)
+        libc.recvmmsg.argtypes = [ctypes.c_int, ctypes.POINTER(mmsghdr), ctypes.c_uint, ctypes.c_int, ctypes.c_void_p]
+        libc.sendmmsg.argtypes = [ctypes.c_int, ctypes.POINTER(mmsghdr), ctypes.c_uint, ctypes.c_int]
+        return libc
+    except (OSError, AttributeError):
+        return None
+
+libc = _load_libc()
+NATIVE_BATCH_IO = libc is not None
+
+class bufferRing:
+    """Pool of reusable receive buffers that are lent to handlers and returned when they are done.
+
+    A datagram is read straight into a pooled bytearray and handed on as a memoryview,
+    so nothing is copied between the socket and the parser. When the pool runs dry a
+    fresh buffer is allocated; buffers beyond the pool size are dropped on release.
+    """
+    def __init__(self, size=RECV_RING_SIZE, buffer_size=MAX_DATAGRAM_SIZE):
+        self.size = size
+        self.buffer_size = buffer_size
+        self.free = collections.deque(bytearray(buffer_size) for _ in range(size))
+        self.c_buffers = {}  # id(buffer) -> ctypes view, kept alive while recvmmsg may write into it
+        self.lock = threading.Lock()
+        self.acquired = 0
+        self.released = 0
+        self.exhausted = 0
+
+    def acquire(self):
+        """Take a free buffer from the pool (or allocate one if the pool is empty)."""
+        with self.lock:
+            self.acquired += 1
+            if self.free:
+                return self.free.popleft()
+            self.exhausted += 1
+        return bytearray(self.buffer_size)
+
+    def release(self, buffer):
+        """Return a buffer to the pool once nothing references its contents anymore."""
+        with self.lock:
+            self.released += 1
+            if len(self.free) < self.size:
+                self.free.append(buffer)
+            else:
+                self.c_buffers.pop(id(buffer), None)
+
+    def owns(self, data):
+        """Check whether data is a view into one of this pool's buffers."""
+        return isinstance(data, memoryview) and isinstance(data.obj, bytearray) and len(data.obj) == self.buffer_size
+
+    def address(self, buffer):
+        """Get the memory address of a pooled buffer for use in an iovec."""
+        c_buffer = self.c_buffers.get(id(buffer))
+        if c_buffer is None:
+            c_buffer = (ctypes.c_char * self.buffer_size).from_buffer(buffer)
+            self.c_buffers[id(buffer)] = c_buffer
+        return ctypes.addressof(c_buffer)
+
+    def get_stats(self):
+        """Get pool usage counters."""
+        with self.lock:
+            return {
+                "size": self.size,
+                "free": len(self.free),
+                "in_use": self.acquired - self.released,
+                "exhausted": self.exhausted
+            }
+
+class batchSocketIO:
+    """Receive and send many datagrams per system call on one socket.
+
+    With a bufferRing, received datagrams are returned as views into buffers taken
+    from the ring, and the caller releases each buffer back to the ring when done.
+    Without one, a fixed set of buffers is reused and callers must copy what they keep.
+    """
+    def __init__(self, sock, batch_size=IO_BATCH_SIZE, buffer_size=MAX_DATAGRAM_SIZE, native=NATIVE_BATCH_IO, ring=None):
+        self.sock = sock
+        self.batch_size = batch_size
+        self.ring = ring
+        self.buffer_size = ring.buffer_size if ring else buffer_size
+        self.native = native and NATIVE_BATCH_IO
+        self.lock = threading.Lock()  # Preallocated structures are shared per socket
+
+        # Counters for syscalls-per-message reporting
+        self.recv_syscalls = 0
+        self.send_syscalls = 0
+        self.datagrams_received = 0
+        self.datagrams_sent = 0
+        self.send_failures = 0
+        self.last_send_error = None
+
+        # Receive buffers: one slot per datagram in a batch
+        if ring:
+            self.buffers = [ring.acquire() for _ in range(batch_size)]
+        else:
+            self.buffers = [bytearray(self.buffer_size) for _ in range(batch_size)]
+        self.views = [memoryview(buffer) for buffer in self.buffers]
+
+        if self.native:
+            self._prepare_native()
+
+    def _prepare_native(self):
+        """Point one mmsghdr per receive buffer at that buffer and an address slot."""
+        self.recv_msgs = (mmsghdr * self.batch_size)()
+        self.recv_iovecs = (iovec * self.batch_size)()
+        self.recv_names = (sockaddr_in * self.batch_size)()
+        self.c_buffers = None if self.ring else [(ctypes.c_char * self.buffer_size).from_buffer(buffer) for buffer in self.buffers]
+        for i in range(self.batch_size):
+            if self.ring:
+                self.recv_iovecs[i].iov_base = self.ring.address(self.buffers[i])
+            else:
+                self.recv_iovecs[i].iov_base = ctypes.addressof(self.c_buffers[i])
+            self.recv_iovecs[i].iov_len = self.buffer_size
+            header = self.recv_msgs[i].msg_hdr
+            header.msg_iov = ctypes.pointer(self.recv_iovecs[i])
+            header.msg_iovlen = 1
+            header.msg_name = ctypes.addressof(self.recv_names[i])
+
+        # Addresses and lengths are rewritten through memoryviews, which is far cheaper than ctypes attributes
+        self.recv_iovecs_view = memoryview(self.recv_iovecs).cast("B")
+        self.recv_names_view = memoryview(self.recv_names).cast("B")
+        self.recv_addr_cache = {}
+
+        # Outgoing payloads are copied into preallocated send buffers so the iovecs never move
+        self.send_buffers = [bytearray(self.buffer_size) for _ in range(self.batch_size)]
+        self.send_buffer_views = [memoryview(buffer) for buffer in self.send_buffers]
+        self.c_send_buffers = [(ctypes.c_char * self.buffer_size).from_buffer(buffer) for buffer in self.send_buffers]
+        self.send_msgs = (mmsghdr * self.batch_size)()
+        self.send_iovecs = (iovec * self.batch_size)()
+        self.send_names = (sockaddr_in * self.batch_size)()
+        for i in range(self.batch_size):
+            self.send_iovecs[i].iov_base = ctypes.addressof(self.c_send_buffers[i])
+            header = self.send_msgs[i].msg_hdr
+            header.msg_iov = ctypes.pointer(self.send_iovecs[i])
+            header.msg_iovlen = 1
+            header.msg_name = ctypes.addressof(self.send_names[i])
+            header.msg_namelen = ctypes.sizeof(sockaddr_in)
+        self.send_iovecs_view = memoryview(self.send_iovecs).cast("B")
+        self.send_names_view = memoryview(self.send_names).cast("B")
+        self.send_addr_cache = {}
+
+    def recv_batch(self):
+        """Block until a datagram arrives, then drain up to batch_size without blocking.
+
+        Returns a list of (memoryview, addr). The views point into buffers that are
+        reused by the next call, so callers must copy what they keep.
+        """
+        with self.lock:
+            if self.native:
+                return self._recv_native()
+            return self._recv_fallback()
+
+    def _recv_native(self):
+        for i in range(self.batch_size):
+            self.recv_msgs[i].msg_hdr.msg_namelen = ctypes.sizeof(sockaddr_in)
+
+        while True:
+            count = libc.recvmmsg(self.sock.fileno(), self.recv_msgs, self.batch_size, MSG_WAITFORONE, None)
+            self.recv_syscalls += 1
+            if count >= 0:
+                break
+            err = ctypes.get_errno()
+            if err != errno.EINTR:
+                raise OSError(err, os.strerror(err))
+
+        datagrams = []
+        name_size = SOCKADDR_IN.size
+        for i in range(count):
+            raw_name = bytes(self.recv_names_view[i * name_size:(i + 1) * name_size])
+            addr = self.recv_addr_cache.get(raw_name)
+            if addr is None:
+                _, port, ip = SOCKADDR_IN.unpack(raw_name)
+                addr = (socket.inet_ntoa(ip), int.from_bytes(port, "big"))
+                if len(self.recv_addr_cache) < 1024:
+                    self.recv_addr_cache[raw_name] = addr
+            datagrams.append((self.views[i][:self.recv_msgs[i].msg_len], addr))
+            if self.ring:
+                self._refill_slot(i)
+        self.datagrams_received += count
+        return datagrams
+
+    def _refill_slot(self, i):
+        """Hand slot i's buffer to the caller and point the slot at a fresh one from the ring."""
+        buffer = self.ring.acquire()
+        self.buffers[i] = buffer
+        self.views[i] = memoryview(buffer)
+        if self.native:
+            IOVEC_BASE.pack_into(self.recv_iovecs_view, i * ctypes.sizeof(iovec), self.ring.address(buffer))
+
+    def _recv_fallback(self):
+        nbytes, addr = self.sock.recvfrom_into(self.buffers[0])
+        self.recv_syscalls += 1
+        datagrams = [(self.views[0][:nbytes], addr)]
+        if self.ring:
+            self._refill_slot(0)
+
+        # Drain whatever else is already queued without blocking (not possible on Windows)
+        dontwait = getattr(socket, "MSG_DONTWAIT", 0)
+        if dontwait:
+            for i in range(1, self.batch_size):
+                try:
+                    nbytes, addr = self.sock.recvfrom_into(self.buffers[i], 0, dontwait)
+                except (BlockingIOError, InterruptedError):
+                    self.recv_syscalls += 1
+                    break
+                self.recv_syscalls += 1
+                datagrams.append((self.views[i][:nbytes], addr))
+                if self.ring:
+                    self._refill_slot(i)
+        self.datagrams_received += len(datagrams)
+        return datagrams
+
+    def send_batch(self, datagrams):
+        """Send a list of (data, (ip, port)) datagrams. Returns the number sent.
+
+        A datagram that fails (e.g. unreachable network) is skipped and counted
+        in send_failures so the rest of the batch still goes out.
+        """
+        with self.lock:
+            if self.native:
+                return self._send_native(datagrams)
+            return self._send_fallback(datagrams)
+
+    def _pack_address(self, addr):
+        """Get addr as a packed sockaddr_in, or None if it isn't a numeric IPv4 address and port."""
+        raw_name = self.send_addr_cache.get(addr)
+        if raw_name is None:
+            try:
+                raw_name = SOCKADDR_IN.pack(socket.AF_INET, addr[1].to_bytes(2, "big"), socket.inet_aton(addr[0]))
+            except (OSError, TypeError, ValueError, OverflowError, AttributeError):
+                return None
+            if len(self.send_addr_cache) < 1024:
+                self.send_addr_cache[addr] = raw_name
+        return raw_name
+
+    def _send_native(self, datagrams):
+        # Anything too large for the preallocated buffers, or addressed by hostname (or malformed),
+        # goes out one call at a time, so it can't fail the rest of the batch
+        packed = []
+        fallback = []
+        for data, addr in datagrams:
+            raw_name = self._pack_address(addr) if len(data) <= self.buffer_size else None
+            if raw_name is None:
+                fallback.append((data, addr))
+            else:
+                packed.append((data, raw_name))
+        datagrams = packed
+
+        sent = 0
+        name_size = SOCKADDR_IN.size
+        iovec_size = ctypes.sizeof(iovec)
+        length_offset = iovec_size - ctypes.sizeof(ctypes.c_size_t)
+        for start in range(0, len(datagrams), self.batch_size):
+            batch = datagrams[start:start + self.batch_size]
+            for i, (data, raw_name) in enumerate(batch):
+                size = len(data)
+                self.send_buffer_views[i][:size] = data
+                struct.pack_into("N", self.send_iovecs_view, i * iovec_size + length_offset, size)
+                self.send_names_view[i * name_size:(i + 1) * name_size] = raw_name
+
+            offset = 0
+            while offset < len(batch):
+                count = libc.sendmmsg(self.sock.fileno(), ctypes.byref(self.send_msgs[offset]), len(batch) - offset, 0)
+                self.send_syscalls += 1
+                if count >= 0:
+                    offset += count
+                    sent += count
+                    continue
+                err = ctypes.get_errno()
+                if err == errno.EINTR:
+                    continue
+                # The datagram at offset failed; skip it and keep sending the rest
+                self.send_failures += 1
+                self.last_send_error = OSError(err, os.strerror(err))
+                offset += 1
+        self.datagrams_sent += sent
+
+        if fallback:
+            sent += self._send_fallback(fallback)
+        return sent
+
+    def _send_fallback(self, datagrams):
+        sent = 0
+        for data, addr in datagrams:
+            self.send_syscalls += 1
+            try:
+                self.sock.sendto(data, addr)
+                sent += 1
+            except (OSError, OverflowError, TypeError, ValueError) as e:  # Unreachable, or a malformed address
+                self.send_failures += 1
+                self.last_send_error = e
+        self.datagrams_sent += sent
+        return sent
+
+    def get_stats(self):
+        """Get syscall and datagram counters for this socket."""
+        return {
+            "native": self.native,
+            "recv_syscalls": self.recv_syscalls,
+            "send_syscalls": self.send_syscalls,
+            "datagrams_received": self.datagrams_received,
+            "datagrams_sent": self.datagrams_sent,
+            "send_failures": self.send_failures
+        }
@@ -0,0 +1,244 @@
+# Benchmarks for the LSNP networking stack
+# Usage: python benchmark.py transport [--duration 3]
+#        python benchmark.py batch [--count 20000]
+#        python benchmark.py codec [--duration 0.5]
+
+import argparse
+import base64
+import multiprocessing
+import os
+import socket
+import threading
+import time
+
+import lsnp_codec
+from batch_io import batchSocketIO, NATIVE_BATCH_IO
+from network_System import networkSystem, TRANSPORT_THREAD, TRANSPORT_ASYNCIO
+from vars import *
+
+class countingMsgSystem:
+    """Stand-in for msgSystem that only counts routed messages."""
+    def __init__(self):
+        self.user_id = "bench@127.0.0.1"
+        self.handled = 0
+        self.lock = threading.Lock()  # Handlers may run on several workers
+
+    def process_incoming_message(self, message):
+        with self.lock:
+            self.handled += 1
+
+def get_free_port():
+    """Ask the OS for a free UDP port."""
+    with socket.socket(socket.AF_INET, socket.SOCK_DGRAM) as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+def sample_post(index):
+    """Build a typical POST datagram."""
+    timestamp = int(time.time())
+    return (
+        f"TYPE: {MSG_POST}\nUSER_ID: blaster@127.0.0.1\nCONTENT: benchmark post {index}\n"
+        f"TTL: 3600\nMESSAGE_ID: {index:016x}\nTOKEN: blaster@127.0.0.1|{timestamp + 3600}|{SCOPE_BROADCAST}\n"
+        f"TIMESTAMP: {timestamp}\n\n"
+    ).encode()
+
+def blast(port, duration, result_queue):
+    """Send POST datagrams to port as fast as possible for duration seconds."""
+    payloads = [sample_post(i) for i in range(1024)]
+    sent = 0
+    with socket.socket(socket.AF_INET, socket.SOCK_DGRAM) as s:
+        deadline = time.monotonic() + duration
+        while time.monotonic() < deadline:
+            for payload in payloads[:64]:
+                try:
+                    s.sendto(payload, ("127.0.0.1", port))
+                    sent += 1
+                except OSError:
+                    pass
+            payloads.append(payloads.pop(0))
+    result_queue.put(sent)
+
+def bench_transport(mode, duration, workers=INGRESS_WORKERS):
+    """Measure sustained datagrams handled per second for one transport."""
+    port = get_free_port()
+    net = networkSystem(port, transport=mode, workers=workers)
+    stub = countingMsgSystem()
+    net.set_msg_system(stub)
+    net.register_handler(MSG_POST, stub.process_incoming_message)
+    time.sleep(0.3)  # Let the listener bind
+
+    results = multiprocessing.Queue()
+    sender = multiprocessing.Process(target=blast, args=(port, duration, results))
+    started = time.monotonic()
+    sender.start()
+    sender.join()
+    sent = results.get()
+
+    # Let the receiver drain whatever is still queued in the socket buffer
+    last = -1
+    while stub.handled != last:
+        last = stub.handled
+        time.sleep(0.2)
+    elapsed = time.monotonic() - started
+
+    return {
+        "transport": mode,
+        "sent": sent,
+        "handled": stub.handled,
+        "handled_per_second": round(stub.handled / elapsed),
+        "loss_percent": round(100 * (sent - stub.handled) / sent, 1) if sent else 0
+    }
+
+def run_transport_benchmark(args):
+    print(f"Sustained receive rate over {args.duration}s of loopback POST traffic ({args.workers} workers):")
+    for mode in (TRANSPORT_THREAD, TRANSPORT_ASYNCIO):
+        result = bench_transport(mode, args.duration, args.workers)
+        print(f"  {result['transport']:8} sent={result['sent']:>8} handled={result['handled']:>8} "
+              f"rate={result['handled_per_second']:>7}/s loss={result['loss_percent']}%")
+
+def bench_batch_io(native, count):
+    """Send and receive count datagrams over loopback, per datagram or batched."""
+    receiver = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    receiver.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, RECV_BUFFER_SIZE)
+    receiver.bind(("127.0.0.1", 0))
+    target = receiver.getsockname()
+    sender = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    recv_io = batchSocketIO(receiver, native=native)
+    send_io = batchSocketIO(sender, native=native)
+
+    payloads = [sample_post(i) for i in range(IO_BATCH_SIZE)]
+    sent = received = 0
+    started = time.perf_counter()
+    # Alternate one fan-out burst with draining it, so the socket buffer never overflows
+    while sent < count:
+        burst = [(payload, target) for payload in payloads[:count - sent]]
+        sent += send_io.send_batch(burst)
+        while received < sent:
+            received += len(recv_io.recv_batch())
+    elapsed = time.perf_counter() - started
+
+    receiver.close()
+    sender.close()
+    recv_stats = recv_io.get_stats()
+    send_stats = send_io.get_stats()
+    return {
+        "mode": "batched" if native else "per-datagram",
+        "datagrams": received,
+        "send_syscalls_per_datagram": send_stats["send_syscalls"] / send_stats["datagrams_sent"],
+        "recv_syscalls_per_datagram": recv_stats["recv_syscalls"] / recv_stats["datagrams_received"],
+        "datagrams_per_second": round(received / elapsed)
+    }
+
+def run_batch_benchmark(args):
+    if not NATIVE_BATCH_IO:
+        print("recvmmsg/sendmmsg are not available on this platform; only the per-datagram path can run.")
+    print(f"Loopback round of {args.count} POST datagrams in bursts of {IO_BATCH_SIZE}:")
+    for native in ((False, True) if NATIVE_BATCH_IO else (False,)):
+        result = bench_batch_io(native, args.count)
+        print(f"  {result['mode']:12} send syscalls/msg={result['send_syscalls_per_datagram']:.3f} "
+              f"recv syscalls/msg={result['recv_syscalls_per_datagram']:.3f} "
+              f"rate={result['datagrams_per_second']:>7}/s")
+
+def legacy_encode(message_dict):
+    """The string-based encoder the codec replaced, kept as a baseline."""
+    lines = []
+    for key, value in message_dict.items():
+        if key != "BROADCAST":
+            str_value = str(value) if value is not None else ""
+            lines.append(f"{key}: {str_value}")
+    return ("\n".join(lines) + "\n\n").encode()
+
+def legacy_decode(data):
+    """The string-based decoder the codec replaced, kept as a baseline."""
+    message_dict = {}
+    for line in data.decode().strip().split('\n'):
+        if ':' in line:
+            key, value = line.split(':', 1)
+            key = key.strip()
+            value = value.strip()
+            if value.isdigit():
+                value = int(value)
+            message_dict[key] = value
+    return message_dict
+
+def sample_messages():
+    """One representative message per common type."""
+    timestamp = int(time.time())
+    user = "alice@192.168.1.11"
+    peer = "bob@192.168.1.12"
+    return {
+        MSG_PROFILE: {"TYPE": MSG_PROFILE, "USER_ID": user, "DISPLAY_NAME": "Alice", "STATUS": "Exploring LSNP!",
+                      "LISTEN_PORT": LSNP_PORT, "AVATAR_TYPE": "image/png", "AVATAR_ENCODING": "base64",
+                      "AVATAR_DATA": base64.b64encode(os.urandom(1500))},
+        MSG_POST: {"TYPE": MSG_POST, "USER_ID": user, "CONTENT": "Hello from LSNP!", "TTL": 3600,
+                   "MESSAGE_ID": "f83d2b1c", "TOKEN": f"{user}|{timestamp + 3600}|{SCOPE_BROADCAST}", "TIMESTAMP": timestamp},
+        MSG_DM: {"TYPE": MSG_DM, "FROM": user, "TO": peer, "CONTENT": "Hi Bob!", "TIMESTAMP": timestamp,
+                 "MESSAGE_ID": "f83d2b1d", "TOKEN": f"{user}|{timestamp + 3600}|{SCOPE_CHAT}"},
+        MSG_ACK: {"TYPE": MSG_ACK, "MESSAGE_ID": "f83d2b1d", "STATUS": "RECEIVED"},
+        MSG_TICTACTOE_MOVE: {"TYPE": MSG_TICTACTOE_MOVE, "FROM": user, "TO": peer, "GAMEID": "g123", "MESSAGE_ID": "f83d2b2d",
+                             "POSITION": 4, "SYMBOL": "X", "TURN": 2, "TOKEN": f"{user}|{timestamp + 3600}|{SCOPE_GAME}"},
+        MSG_FILE_CHUNK: {"TYPE": MSG_FILE_CHUNK, "FROM": user, "TO": peer, "FILEID": "a1b2c3d4", "CHUNK_INDEX": 0,
+                         "TOTAL_CHUNKS": 5, "CHUNK_SIZE": MAX_CHUNK_SIZE, "TOKEN": f"{user}|{timestamp + 3600}|{SCOPE_FILE}",
+                         "DATA": base64.b64encode(os.urandom(MAX_CHUNK_SIZE))}
+    }
+
+def measure_rate(func, arg, duration):
+    """Call func(arg) repeatedly for about duration seconds and return calls per second."""
+    calls = 0
+    started = time.perf_counter()
+    deadline = started + duration
+    while time.perf_counter() < deadline:
+        for _ in range(200):
+            func(arg)
+        calls += 200
+    return calls / (time.perf_counter() - started)
+
+def run_codec_benchmark(args):
+    print("Messages per second per type (legacy str codec -> lsnp_codec):")
+    print(f"  {'type':20} {'encode':>25} {'decode':>25}")
+    for message_type, message in sample_messages().items():
+        # The legacy path only ever saw str values
+        legacy_message = {key: value.decode() if isinstance(value, bytes) else value for key, value in message.items()}
+        wire = lsnp_codec.encode(message)
+        old_encode = measure_rate(legacy_encode, legacy_message, args.duration)
+        new_encode = measure_rate(lsnp_codec.encode, message, args.duration)
+        old_decode = measure_rate(legacy_decode, wire, args.duration)
+        new_decode = measure_rate(lsnp_codec.decode, wire, args.duration)
+        print(f"  {message_type:20} {old_encode:>9.0f} -> {new_encode:>9.0f}/s   {old_decode:>9.0f} -> {new_decode:>9.0f}/s")
+
+    print("\nRejected messages per second (duplicate / unaccepted check: decode() -> LSNPMessage):")
+    for message_type, message in sample_messages().items():
+        wire = lsnp_codec.encode(message)
+        eager = measure_rate(reject_eager, wire, args.duration)
+        lazy = measure_rate(reject_lazy, wire, args.duration)
+        print(f"  {message_type:20} {eager:>9.0f} -> {lazy:>9.0f}/s")
+
+def reject_eager(wire):
+    """Full decode, then read what a duplicate/unaccepted check needs."""
+    message = lsnp_codec.decode(wire)
+    return message.get("TYPE"), message.get("MESSAGE_ID"), message.get("FILEID")
+
+def reject_lazy(wire):
+    """Lazy view, reading only what a duplicate/unaccepted check needs."""
+    message = lsnp_codec.LSNPMessage(wire)
+    return message.get("TYPE"), message.get("MESSAGE_ID"), message.get("FILEID")
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='LSNP benchmarks')
+    subparsers = parser.add_subparsers(dest='benchmark', required=True)
+
+    transport_parser = subparsers.add_parser('transport', help='Threaded vs asyncio receive throughput')
+    transport_parser.add_argument('--duration', type=float, default=3.0, help='Seconds of traffic to send')
+    transport_parser.add_argument('--workers', type=int, default=INGRESS_WORKERS, help='Handler worker threads')
+    transport_parser.set_defaults(func=run_transport_benchmark)
+
+    batch_parser = subparsers.add_parser('batch', help='Syscalls per datagram with and without recvmmsg/sendmmsg')
+    batch_parser.add_argument('--count', type=int, default=20000, help='Datagrams to send and receive')
+    batch_parser.set_defaults(func=run_batch_benchmark)
+
+    codec_parser = subparsers.add_parser('codec', help='LSNP encode/decode throughput per message type')
+    codec_parser.add_argument('--duration', type=float, default=0.5, help='Seconds to run each measurement')
+    codec_parser.set_defaults(func=run_codec_benchmark)
+
+    args = parser.parse_args()
+    args.func(args)
@@ -4,9 +4,16 @@ import mimetypes
 import time
 import random
 import base64
+import binascii
+import mmap
 import os
+import queue
+import threading
 import uuid
+from collections import deque
 from vars import *
+from lsnp_structs import chunkBitmap, rttEstimator
+import lsnp_codec
 class fileGameSystem:
     def __init__(self, netSystem):
         self.netSystem = netSystem
@@ -21,6 +28,29 @@ class fileGameSystem:
         self.pending_file_offers = {}   # {file_id: offer_data}
         self.incoming_files = {}        # {file_id: {chunks, metadata}}
         self.outgoing_files = {}        # {file_id: file_info}
+        self.completed_files = {}       # {file_id: from_user} for files already saved, to re-confirm them
+        
+        # Outgoing transfers are pumped by background workers; a file_id is queued at most once
+        self.transfer_queue = queue.Queue()
+        self.pumps_queued = set()
+        self.pumps_lock = threading.Lock()
+        for i in range(FILE_TRANSFER_WORKERS):
+            threading.Thread(target=self.transfer_worker, name=f"lsnp-file-{i}", daemon=True).start()
+        
+        for msg_type, handler in (
+            (MSG_TICTACTOE_INVITE, self.handle_game_invite),
+            (MSG_TICTACTOE_ACCEPT, self.handle_game_accept),
+            (MSG_TICTACTOE_MOVE, self.handle_game_move),
+            (MSG_TICTACTOE_RESULT, self.handle_game_result),
+            (MSG_FILE_OFFER, self.handle_file_offer),
+            (MSG_FILE_CHUNK, self.handle_file_chunk),
+            (MSG_FILE_RECEIVED, self.handle_file_received),
+            ("FILE_ACCEPTED", self.handle_file_accepted)
+        ):
+            self.netSystem.register_handler(msg_type, handler)
+        
+        # Inactive games are timed out on every expiry sweep
+        self.netSystem.expiry.add_sweeper("games_timed_out", self.timeout_inactive_games)
 
     def get_user_id(self):
         """Get current user ID from message system."""
@@ -87,6 +117,15 @@ class fileGameSystem:
         user_id = self.get_user_id()
         token = f"{user_id}|{timestamp + ttl}|{SCOPE_FILE}"
         
+        # Send the offer to the address the peer directory has for the user
+        target = self.resolve_user_address(to_user)
+        if target is None:
+            raise LookupError(f"No address for {to_user}; wait until they have been seen on the network")
+        target_ip, target_port = target
+        
+        # Largest chunk that fits one unfragmented packet on our side; the receiver may lower it
+        chunk_size_offered = self.get_max_chunk_size(file_id, user_id, to_user, target_ip)
+        
         # Create FILE_OFFER message according to LSNP specs
         file_offer_message = {
             "TYPE": MSG_FILE_OFFER,
@@ -97,6 +136,7 @@ class fileGameSystem:
             "FILETYPE": filetype,
             "FILEID": file_id,
             "DESCRIPTION": description,
+            "CHUNK_SIZE": str(chunk_size_offered),  # Not in specs, older clients ignore it
             "TIMESTAMP": str(timestamp),  # String as per specs
             "TOKEN": token
         }
@@ -112,20 +152,11 @@ class fileGameSystem:
             "status": "OFFERED",
             "timestamp": timestamp,
             "chunks_sent": 0,
-            "total_chunks": 0
+            "total_chunks": 0,
+            "chunk_size_offered": chunk_size_offered,
+            "chunk_size": MAX_CHUNK_SIZE  # Until the receiver agrees to a size in FILE_ACCEPTED
         }
         
-        # Send the offer - resolve target IP from user_id
-        target_ip = to_user.split("@")[1] if "@" in to_user else "127.0.0.1"
-        target_port = LSNP_PORT
-        
-        # Try to get more specific peer info if available
-        if hasattr(self.netSystem, 'msg_system') and self.netSystem.msg_system:
-            peer_info = self.netSystem.msg_system.known_peers.get(to_user)
-            if peer_info:
-                target_ip = peer_info.get('ip', target_ip)
-                target_port = peer_info.get('port', target_port)
-        
         self.netSystem.send_message(file_offer_message, target_ip=target_ip, target_port=target_port)
         
         if hasattr(self.netSystem, 'verbose') and self.netSystem.verbose:
@@ -144,9 +175,10 @@ class fileGameSystem:
         filesize = message.get("FILESIZE")
         filetype = message.get("FILETYPE")
         description = message.get("DESCRIPTION", "")
+        chunk_size = message.get("CHUNK_SIZE")
         
         # Store the pending offer
-        self.pending_file_offers[file_id] = {
+        offer = {
             "from_user": from_user,
             "filename": filename,
             "filesize": int(filesize) if filesize else 0,
@@ -154,8 +186,11 @@ class fileGameSystem:
             "description": description,
             "timestamp": message.get("TIMESTAMP"),
             "token": message.get("TOKEN"),
+            "chunk_size": chunk_size if isinstance(chunk_size, int) and chunk_size > 0 else None,  # None: sender doesn't negotiate
             "status": "PENDING"
         }
+        self.pending_file_offers[file_id] = offer
+        self.expire_later("file_offers", self.pending_file_offers, file_id, offer, FILE_OFFER_TTL)
         
         # Get display name
         display_name = from_user
@@ -186,23 +221,53 @@ class fileGameSystem:
             print(f"No pending file offer with ID: {file_id}")
             return False
         
+        if file_id in self.incoming_files:
+            print(f"File {file_id} is already being received")
+            return False
+        
         offer = self.pending_file_offers[file_id]
         offer["status"] = "ACCEPTED"
         
+        # Agree to the sender's chunk size, lowered to what fits one packet and a receive buffer here
+        chunk_size = offer.get("chunk_size")
+        if chunk_size:
+            sender_address = self.resolve_user_address(offer["from_user"])
+            if sender_address:
+                chunk_size = min(chunk_size, self.get_max_chunk_size(file_id, offer["from_user"], self.get_user_id(), sender_address[0]))
+        
+        # Chunks are written straight into a sparse .part file of the full size, renamed when complete
+        os.makedirs("downloads", exist_ok=True)
+        output_path = os.path.join("downloads", offer["filename"])
+        part_path = f"{output_path}.{file_id}.part"
+        try:
+            part_fd = os.open(part_path, os.O_RDWR | os.O_CREAT | os.O_TRUNC | getattr(os, "O_BINARY", 0), 0o644)
+            os.ftruncate(part_fd, offer["filesize"])
+        except OSError as e:
+            print(f"Cannot create {part_path}: {e}")
+            return False
+        
         # Initialize incoming file tracking
         self.incoming_files[file_id] = {
             "filename": offer["filename"],
             "filesize": offer["filesize"],
             "filetype": offer["filetype"],
             "from_user": offer["from_user"],
-            "chunks": {},
+            "chunk_size": chunk_size or MAX_CHUNK_SIZE,
+            "output_path": output_path,
+            "part_path": part_path,
+            "part_fd": part_fd,
             "total_chunks": 0,
-            "received_chunks": 0
+            "received_chunks": 0,
+            "received": None,  # chunkBitmap, created with the first chunk
+            "received_bytes": 0,
+            "first_chunk_at": None,
+            "last_chunk_at": None,  # Once started, idle transfers expire FILE_INCOMING_IDLE_TTL after this
+            "unreported": 0,  # Chunks since the last progress report
+            "quiet_reports": 0,  # Reports in a row without new chunks
+            "report_timer": None,
+            "report_generation": 0,
+            "lock": threading.Lock()
         }
-        
-        # Ensure downloads directory exists
-        os.makedirs("downloads", exist_ok=True)
-
         # Always show acceptance message (both verbose and non-verbose)
         print(f"✅ File offer accepted! Ready to receive {offer['filename']} from {offer['from_user']}")
         
@@ -212,30 +277,18 @@ class fileGameSystem:
         
         # Send notification to sender that file was accepted
         # Even though LSNP specs don't require FILE_ACCEPT, we'll send a simple notification
-        self.send_file_acceptance_notification(file_id, offer['from_user'])
+        self.send_file_acceptance_notification(file_id, offer['from_user'], chunk_size)
         
         # According to LSNP specs, there's no FILE_ACCEPT message
         # The receiver just starts accepting chunks when they arrive
         return True
 
-    def send_file_acceptance_notification(self, file_id, sender_user):
-        """Send a notification to the sender that the file offer was accepted."""
-        # Extract target IP
-        target_ip = None
-        target_port = 50999
-        
-        if '@' in sender_user:
-            target_ip = sender_user.split('@')[-1]
-        else:
-            # Look up the user's IP from known peers/clients
-            if hasattr(self.netSystem, 'msg_system') and self.netSystem.msg_system:
-                for peer_id, peer_info in getattr(self.netSystem.msg_system, 'peers', {}).items():
-                    if peer_id.startswith(sender_user + '@') or peer_id == sender_user:
-                        if '@' in peer_id:
-                            target_ip = peer_id.split('@')[-1]
-                        break
+    def send_file_acceptance_notification(self, file_id, sender_user, chunk_size=None):
+        """Send a notification to the sender that the file offer was accepted (with the agreed chunk size, if negotiated)."""
+        target = self.resolve_user_address(sender_user)
         
-        if target_ip:
+        if target:
+            target_ip, target_port = target
             user_id = self.get_user_id()
             
             # Create a simple notification message (not part of official LSNP spec)
@@ -247,6 +300,8 @@ class fileGameSystem:
                 "MESSAGE": "File offer accepted, you can start sending",
                 "TIMESTAMP": str(int(time.time()))
             }
+            if chunk_size:
+                notification_message["CHUNK_SIZE"] = str(chunk_size)
             
             self.netSystem.send_message(notification_message, target_ip=target_ip, target_port=target_port)
             
@@ -259,12 +314,20 @@ class fileGameSystem:
         from_user = message.get("FROM")
         
         if file_id in self.outgoing_files:
+            file_info = self.outgoing_files[file_id]
+            
+            # Larger chunks only once the receiver has agreed (never above what we offered)
+            chunk_size = message.get("CHUNK_SIZE")
+            if (isinstance(chunk_size, int) and 0 < chunk_size <= file_info.get("chunk_size_offered", 0)
+                    and file_info["status"] == "OFFERED"):
+                file_info["chunk_size"] = chunk_size
+            
             # Always show the message (both verbose and non-verbose)
-            filename = self.outgoing_files[file_id].get("filename", "unknown")
+            filename = file_info.get("filename", "unknown")
             print(f"📤 File offer accepted by {from_user}! You can now send {filename}")
             
             if hasattr(self.netSystem, 'verbose') and self.netSystem.verbose:
-                print(f"[FILE] File {file_id} accepted by {from_user}, ready to send chunks")
+                print(f"[FILE] File {file_id} accepted by {from_user}, ready to send chunks of {file_info['chunk_size']} bytes")
     
     def reject_file_offer(self, file_id):
         """Reject a file offer."""
@@ -281,7 +344,22 @@ class fileGameSystem:
         return True
     
     def send_file_chunks(self, file_id):
-        """Send file in chunks after offer is accepted."""
+        """Start sending a file after its offer is accepted; returns right away.
+
+        The source file is memory-mapped and chunks are sliced out of it by index, so a
+        resend reads nothing again. All sending happens on the transfer workers, which
+        serve every outgoing transfer at once; this call, the report handlers and the
+        timers only queue a transfer for them (request_pump).
+
+        The receiver's FILE_RECEIVED PARTIAL reports carry a bitmap of the chunks it has:
+        each report opens the window again, and chunks missing from it that were sent
+        before one that arrived are resent. The window (chunks in flight) is AIMD
+        controlled: it grows by one chunk per round trip (doubling while below the slow
+        start threshold) and halves when chunks are lost, so the send rate follows what
+        the path and receiver keep up with. Whatever is still unacknowledged after the
+        retransmission timeout (from the measured RTT) is resent, with the window reset.
+        A receiver that never reports (an older client) gets the rest in paced bursts.
+        """
         if file_id not in self.outgoing_files:
             print(f"No outgoing file with ID: {file_id}")
             return False
@@ -290,97 +368,369 @@ class fileGameSystem:
         file_path = file_info["file_path"]
         to_user = file_info["to_user"]
         
+        if file_info["status"] == "SENDING":
+            print(f"File {file_info['filename']} is already being sent")
+            return False
+        
         if not os.path.exists(file_path):
             print(f"File not found: {file_path}")
             return False
         
-        # Read file and split into chunks
-        chunk_size = 1024  # 1KB chunks (can be adjusted)
-        filesize = file_info["filesize"]
-        total_chunks = (filesize + chunk_size - 1) // chunk_size
+        target = self.resolve_user_address(to_user)
+        if target is None:
+            print(f"No address for {to_user}, file {file_info['filename']} not sent")
+            return False
         
-        file_info["total_chunks"] = total_chunks
+        # Split into chunks of the size agreed with the receiver
+        chunk_size = file_info.get("chunk_size") or MAX_CHUNK_SIZE
+        filesize = file_info["filesize"]
+        total_chunks = max(1, (filesize + chunk_size - 1) // chunk_size)  # An empty file goes out as one empty chunk
         
         timestamp = int(time.time())
         ttl = 3600
         user_id = self.get_user_id()
-        token = f"{user_id}|{timestamp + ttl}|{SCOPE_FILE}"
         
-        with open(file_path, "rb") as f:
-            for chunk_index in range(total_chunks):
-                chunk_data = f.read(chunk_size)
-                if not chunk_data:
+        try:
+            with open(file_path, "rb") as f:
+                # An empty file can't be mapped, and has no chunks to slice anyway
+                file_map = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) if os.fstat(f.fileno()).st_size else None
+        except (OSError, ValueError) as e:
+            print(f"Cannot read {file_path}: {e}")
+            return False
+        
+        file_info.update({
+            "status": "SENDING",
+            "chunk_size": chunk_size,
+            "total_chunks": total_chunks,
+            "chunks_sent": 0,  # Distinct chunks sent at least once
+            "retransmitted": 0,
+            "from_user": user_id,
+            "token": f"{user_id}|{timestamp + ttl}|{SCOPE_FILE}",
+            "target": target,  # The receiver's address from the peer directory
+            "file_map": file_map,
+            "source": memoryview(file_map) if file_map is not None else memoryview(b""),
+            "acked": chunkBitmap(total_chunks),  # Chunks the receiver has reported
+            "in_flight": {},  # {chunk_index: (send sequence number, send time)}, sent but not reported yet
+            "resent": set(),  # Chunks in flight that were sent more than once
+            "resend": deque(),  # Chunk indices found missing, sent again before new ones
+            "next_chunk": 0,
+            "send_seq": 0,
+            "highest_acked_seq": -1,
+            "window": float(FILE_WINDOW_INITIAL),  # Congestion window, in chunks
+            "ssthresh": float(FILE_WINDOW_SIZE),  # Slow start threshold
+            "recovery_seq": -1,  # No further decrease until a chunk sent after the last one is acked
+            "rtt": rttEstimator(initial_rto=FILE_RETRANSMIT_TIMEOUT),
+            "lost": 0,  # Chunks found missing (or timed out)
+            "started": time.time(),
+            "finished": None,
+            "peer_reports": False,  # Set by the first PARTIAL report
+            "legacy": False,  # No reports: send the rest paced, without retransmission
+            "stalls": 0,
+            "timer": None,
+            "lock": threading.Lock()
+        })
+        
+        self.request_pump(file_id)
+        return True
+    
+    def request_pump(self, file_id):
+        """Queue an outgoing transfer for the transfer workers to fill its window."""
+        with self.pumps_lock:
+            if file_id in self.pumps_queued:
+                return
+            self.pumps_queued.add(file_id)
+        self.transfer_queue.put(file_id)
+    
+    def transfer_worker(self):
+        """Pump queued transfers; each pump sends what the window allows and returns, so transfers interleave."""
+        while True:
+            file_id = self.transfer_queue.get()
+            with self.pumps_lock:
+                self.pumps_queued.discard(file_id)  # A request arriving from now on queues it again
+            try:
+                self.pump_file_chunks(file_id)
+            except Exception as e:
+                print(f"[ERROR] Sending file {file_id} failed: {e}")
+    
+    def get_max_chunk_size(self, file_id, from_user, to_user, ip):
+        """Largest chunk whose FILE_CHUNK datagram reaches ip in one unfragmented packet.
+
+        The headers are measured on a chunk with empty DATA and numeric fields as wide
+        as they can get; base64 then turns every 3 bytes of the rest into 4.
+        """
+        widest = str(MAX_FILE_SIZE)
+        headers = lsnp_codec.encode({
+            "TYPE": MSG_FILE_CHUNK,
+            "FROM": from_user,
+            "TO": to_user,
+            "FILEID": file_id,
+            "CHUNK_INDEX": widest,
+            "TOTAL_CHUNKS": widest,
+            "CHUNK_SIZE": widest,
+            "TOKEN": f"{from_user}|{int(time.time()) + 3600}|{SCOPE_FILE}",
+            "DATA": b""
+        })
+        return (self.netSystem.get_max_payload(ip) - len(headers)) // 4 * 3
+    
+    def next_chunk_to_send(self, file_info):
+        """Get the next chunk index to send (resends first), or None when there is nothing to send."""
+        resend = file_info["resend"]
+        while resend:
+            chunk_index = resend.popleft()
+            if chunk_index not in file_info["acked"] and chunk_index not in file_info["in_flight"]:
+                file_info["retransmitted"] += 1
+                file_info["resent"].add(chunk_index)
+                return chunk_index
+        if file_info["next_chunk"] < file_info["total_chunks"]:
+            chunk_index = file_info["next_chunk"]
+            file_info["next_chunk"] += 1
+            file_info["chunks_sent"] += 1
+            return chunk_index
+        return None
+    
+    def build_file_chunk(self, file_id, file_info, chunk_index):
+        """Slice one chunk out of the mapped source file and build its FILE_CHUNK message."""
+        chunk_size = file_info["chunk_size"]
+        start = chunk_index * chunk_size
+        with file_info["source"][start:start + chunk_size] as chunk_data:
+            # Create FILE_CHUNK message according to LSNP specs
+            return {
+                "TYPE": MSG_FILE_CHUNK,
+                "FROM": file_info["from_user"],
+                "TO": file_info["to_user"],
+                "FILEID": file_id,
+                "CHUNK_INDEX": str(chunk_index),  # String as per specs
+                "TOTAL_CHUNKS": str(file_info["total_chunks"]),  # String as per specs
+                "CHUNK_SIZE": str(len(chunk_data)),  # String as per specs
+                "TOKEN": file_info["token"],
+                # Encode chunk data in base64 (kept as bytes, the codec writes it to the wire as-is)
+                "DATA": base64.b64encode(chunk_data)
+            }
+    
+    def pump_file_chunks(self, file_id):
+        """Fill a transfer's window with chunks, sent in batches, then arm its retransmit timeout."""
+        file_info = self.outgoing_files.get(file_id)
+        if not file_info or file_info.get("status") != "SENDING":
+            return
+        
+        with file_info["lock"]:
+            if file_info["status"] != "SENDING":
+                return
+            legacy = file_info["legacy"]
+            in_flight = file_info["in_flight"]
+            budget = FILE_CHUNK_BURST if legacy else int(file_info["window"]) - len(in_flight)
+            
+            burst = []
+            target_ip, target_port = file_info["target"]
+            while len(burst) < budget:
+                chunk_index = self.next_chunk_to_send(file_info)
+                if chunk_index is None:
                     break
-                
-                # Encode chunk data in base64
-                encoded_data = base64.b64encode(chunk_data).decode('ascii')
-                
-                # Create FILE_CHUNK message according to LSNP specs
-                chunk_message = {
-                    "TYPE": MSG_FILE_CHUNK,
-                    "FROM": user_id,
-                    "TO": to_user,
-                    "FILEID": file_id,
-                    "CHUNK_INDEX": str(chunk_index),  # String as per specs
-                    "TOTAL_CHUNKS": str(total_chunks),  # String as per specs
-                    "CHUNK_SIZE": str(len(chunk_data)),  # String as per specs
-                    "TOKEN": token,
-                    "DATA": encoded_data
-                }
-                
-                # Send the chunk - resolve target IP from user_id
-                target_ip = to_user.split("@")[1] if "@" in to_user else "127.0.0.1"
-                target_port = LSNP_PORT
-                
-                # Try to get more specific peer info if available
-                if hasattr(self.netSystem, 'msg_system') and self.netSystem.msg_system:
-                    peer_info = self.netSystem.msg_system.known_peers.get(to_user)
-                    if peer_info:
-                        target_ip = peer_info.get('ip', target_ip)
-                        target_port = peer_info.get('port', target_port)
-                
-                self.netSystem.send_message(chunk_message, target_ip=target_ip, target_port=target_port)
-                file_info["chunks_sent"] += 1
-                
-                # Small delay to prevent overwhelming the network
-                time.sleep(0.01)
+                in_flight[chunk_index] = (file_info["send_seq"], time.monotonic())
+                file_info["send_seq"] += 1
+                burst.append((self.build_file_chunk(file_id, file_info, chunk_index), target_ip, target_port))
+            
+            for start in range(0, len(burst), FILE_CHUNK_BURST):
+                self.netSystem.send_messages(burst[start:start + FILE_CHUNK_BURST])
+            
+            if file_info["timer"]:
+                file_info["timer"].cancel()
+                file_info["timer"] = None
+            
+            if legacy:
+                if file_info["next_chunk"] < file_info["total_chunks"]:
+                    file_info["timer"] = self.netSystem.call_later(FILE_LEGACY_BURST_GAP, lambda: self.request_pump(file_id))
+                else:
+                    self.finish_file_transfer(file_info, "SENT")
+                    if hasattr(self.netSystem, 'verbose') and self.netSystem.verbose:
+                        print(f"[FILE] Sent {file_info['total_chunks']} chunks for file {file_id} to {file_info['to_user']}")
+            elif in_flight:
+                # Reports come at least every FILE_STATUS_INTERVAL while chunks are missing; leave room for one
+                timeout = max(file_info["rtt"].rto, 2 * FILE_STATUS_INTERVAL)
+                file_info["timer"] = self.netSystem.call_later(timeout, lambda: self.on_file_transfer_timeout(file_id))
+    
+    def on_file_transfer_timeout(self, file_id):
+        """No report within the retransmission timeout: resend what is in flight.
+
+        After FILE_MAX_STALLS timeouts without any report the transfer falls back to legacy sending.
+        """
+        file_info = self.outgoing_files.get(file_id)
+        if not file_info or file_info.get("status") != "SENDING":
+            return
         
-        file_info["status"] = "SENT"
+        with file_info["lock"]:
+            file_info["timer"] = None
+            file_info["stalls"] += 1
+            if not file_info["peer_reports"] and file_info["stalls"] >= FILE_MAX_STALLS:
+                # Still no report at all: the receiver doesn't send them (an older client), so send it
+                # the rest as before. A report arriving later switches the transfer back.
+                file_info["legacy"] = True
+                file_info["stalls"] = 0
+                if hasattr(self.netSystem, 'verbose') and self.netSystem.verbose:
+                    print(f"[FILE] No progress reports for {file_id}, sending the rest without retransmission")
+            else:
+                if file_info["stalls"] > FILE_MAX_STALLS:
+                    self.finish_file_transfer(file_info, "FAILED")
+                    print(f"❌ File transfer of {file_info['filename']} to {file_info['to_user']} failed: receiver stopped responding")
+                    return
+                # Everything in flight is presumed lost: start over from the smallest window
+                file_info["lost"] += len(file_info["in_flight"])
+                file_info["ssthresh"] = max(FILE_WINDOW_MIN, file_info["window"] / 2)
+                file_info["window"] = float(FILE_WINDOW_MIN)
+                file_info["recovery_seq"] = file_info["send_seq"]
+                file_info["resend"].extend(sorted(file_info["in_flight"]))
+                file_info["in_flight"].clear()
+        
+        self.request_pump(file_id)
+    
+    def handle_file_progress(self, file_id, message):
+        """Apply a PARTIAL report: acknowledge the chunks the receiver has and queue the gaps for resending."""
+        file_info = self.outgoing_files.get(file_id)
+        if not file_info or file_info.get("status") != "SENDING":
+            return
         
-        if hasattr(self.netSystem, 'verbose') and self.netSystem.verbose:
-            print(f"[FILE] Sent {total_chunks} chunks for file {file_id} to {to_user}")
+        try:
+            base = int(message.get("BASE", 0))
+            bitmap = binascii.a2b_base64(message.get("BITMAP") or b"")
+        except (ValueError, binascii.Error):
+            return
         
-        return True
+        with file_info["lock"]:
+            file_info["peer_reports"] = True
+            if file_info["legacy"]:
+                # Its reports were only late: go back to windowed sending, starting small
+                file_info["legacy"] = False
+                file_info["window"] = float(FILE_WINDOW_MIN)
+                file_info["recovery_seq"] = file_info["send_seq"]
+                if hasattr(self.netSystem, 'verbose') and self.netSystem.verbose:
+                    print(f"[FILE] Progress report for {file_id}, resuming windowed sending")
+            in_flight = file_info["in_flight"]
+            newly_acked = file_info["acked"].merge(base, bitmap)
+            if newly_acked:
+                file_info["stalls"] = 0
+            
+            # Only chunks sent once show how far the receiver got: for a resent chunk it's
+            # unknown which copy arrived, and crediting the latest would flag chunks still on the way
+            highest = file_info["highest_acked_seq"]
+            highest_sent_at = None
+            resent = file_info["resent"]
+            for chunk_index in newly_acked:
+                entry = in_flight.pop(chunk_index, None)
+                if chunk_index in resent:
+                    resent.discard(chunk_index)
+                elif entry is not None and entry[0] > highest:
+                    highest, highest_sent_at = entry
+            file_info["highest_acked_seq"] = highest
+            if highest_sent_at is not None:
+                file_info["rtt"].add_sample(time.monotonic() - highest_sent_at)
+            
+            # A chunk sent before one that has arrived was lost, not delayed; so was one sent
+            # more than a round trip (plus the receiver's report delay) before this report.
+            # in_flight is in send order, so the lost chunks are a prefix of it.
+            srtt = file_info["rtt"].srtt
+            sent_before = time.monotonic() - (srtt * 1.25 + FILE_STATUS_INTERVAL) if srtt is not None else 0
+            lost = []
+            for chunk_index, (seq, sent_at) in in_flight.items():
+                if seq >= highest and sent_at >= sent_before:
+                    break
+                lost.append(chunk_index)
+            for chunk_index in lost:
+                del in_flight[chunk_index]
+            file_info["resend"].extend(sorted(lost))
+            file_info["lost"] += len(lost)
+            
+            # AIMD: halve the window once per round trip with losses, otherwise grow it
+            if lost and highest >= file_info["recovery_seq"]:
+                file_info["window"] = file_info["ssthresh"] = max(FILE_WINDOW_MIN, file_info["window"] / 2)
+                file_info["recovery_seq"] = file_info["send_seq"]
+            elif newly_acked and not lost:
+                if file_info["window"] < file_info["ssthresh"]:
+                    file_info["window"] += len(newly_acked)
+                else:
+                    file_info["window"] += len(newly_acked) / file_info["window"]
+                file_info["window"] = min(file_info["window"], FILE_WINDOW_SIZE)
+        
+        self.request_pump(file_id)
+    
+    def finish_file_transfer(self, file_info, status):
+        """End an outgoing transfer: stop its timer and unmap the source file (holding file_info's lock)."""
+        file_info["status"] = status
+        file_info["finished"] = time.time()
+        timer = file_info.get("timer")
+        if timer:
+            timer.cancel()
+            file_info["timer"] = None
+        source = file_info.get("source")
+        if source is not None:
+            source.release()
+            file_info["source"] = None
+        file_map = file_info.get("file_map")
+        if file_map is not None:
+            file_map.close()
+            file_info["file_map"] = None
     
     def handle_file_chunk(self, message):
         """Handle incoming FILE_CHUNK message according to LSNP specs."""
         file_id = message.get("FILEID")
-        chunk_index = int(message.get("CHUNK_INDEX", 0))
-        total_chunks = int(message.get("TOTAL_CHUNKS", 0))
-        chunk_size = int(message.get("CHUNK_SIZE", 0))
-        encoded_data = message.get("DATA", "")
         
-        # Check if we have accepted this file
+        # Check if we have accepted this file (before touching the rest of the chunk)
         if file_id not in self.incoming_files:
+            if file_id in self.completed_files:
+                # Already saved: the sender missed our confirmation
+                self.send_file_received(file_id, self.completed_files[file_id], "COMPLETE")
+                return
             # File not accepted, ignore chunks as per specs
             if hasattr(self.netSystem, 'verbose') and self.netSystem.verbose:
                 print(f"[FILE] Ignoring chunk for unaccepted file {file_id}")
             return
         
+        chunk_index = int(message.get("CHUNK_INDEX", 0))
+        total_chunks = int(message.get("TOTAL_CHUNKS", 0))
+        chunk_size = int(message.get("CHUNK_SIZE", 0))
+        encoded_data = message.get("DATA", "")
+        
         file_info = self.incoming_files[file_id]
         
-        # Decode chunk data
+        # Decode chunk data (DATA arrives as ASCII bytes, decoded without an intermediate str)
         try:
-            chunk_data = base64.b64decode(encoded_data)
+            chunk_data = binascii.a2b_base64(encoded_data)
         except Exception as e:
             if hasattr(self.netSystem, 'verbose') and self.netSystem.verbose:
                 print(f"[FILE] Failed to decode chunk {chunk_index} for file {file_id}: {e}")
             return
         
-        # Store chunk
-        file_info["chunks"][chunk_index] = chunk_data
-        file_info["total_chunks"] = total_chunks
-        file_info["received_chunks"] = len(file_info["chunks"])
+        # Every chunk but the last is full size, so the chunk itself says where it goes in the file
+        if chunk_index == total_chunks - 1:
+            offset = file_info["filesize"] - len(chunk_data)
+        else:
+            offset = chunk_index * len(chunk_data)
+        if not 0 <= chunk_index < total_chunks or offset < 0 or offset + len(chunk_data) > file_info["filesize"]:
+            if hasattr(self.netSystem, 'verbose') and self.netSystem.verbose:
+                print(f"[FILE] Chunk {chunk_index} for file {file_id} does not fit the offered size, ignoring")
+            return
+        
+        # Write the chunk to disk (a resent chunk that already arrived just counts towards the next report).
+        # Under the lock, so an expiring transfer can't close the .part file in between.
+        with file_info["lock"]:
+            if file_info["part_fd"] is None:
+                return  # Expired or saved while this chunk was on its way
+            if file_info["received"] is None:
+                file_info["received"] = chunkBitmap(total_chunks)
+                file_info["first_chunk_at"] = file_info["last_chunk_at"] = time.time()
+                # Accepted offers stay until the sender starts; from here an idle transfer is dropped
+                self.expire_later("incoming_files", self.incoming_files, file_id, file_info,
+                                  FILE_INCOMING_IDLE_TTL, idle_key="last_chunk_at", on_expire=self.discard_incoming_file)
+            if chunk_index not in file_info["received"]:
+                try:
+                    self.write_file_chunk(file_info, offset, chunk_data)
+                except OSError as e:
+                    print(f"[ERROR] Cannot write chunk {chunk_index} of {file_info['filename']}: {e}")
+                    return
+                file_info["received"].add(chunk_index)
+                file_info["received_bytes"] += len(chunk_data)
+            file_info["last_chunk_at"] = time.time()
+            file_info["total_chunks"] = total_chunks
+            file_info["received_chunks"] = len(file_info["received"])
         
         if hasattr(self.netSystem, 'verbose') and self.netSystem.verbose:
             print(f"[FILE] Received chunk {chunk_index}/{total_chunks-1} for {file_info['filename']}")
@@ -388,35 +738,113 @@ class fileGameSystem:
         # Check if all chunks are received
         if file_info["received_chunks"] == total_chunks:
             self.reconstruct_file(file_id)
+            return
+        
+        # Report progress every FILE_STATUS_EVERY chunks, or after FILE_STATUS_INTERVAL if fewer arrive.
+        # While chunks arrive past a gap, report sooner so the sender resends it within a round trip.
+        with file_info["lock"]:
+            file_info["unreported"] += 1
+            file_info["quiet_reports"] = 0
+            past_gap = chunk_index > file_info["received"].first_missing
+            if file_info["unreported"] >= (FILE_STATUS_GAP_EVERY if past_gap else FILE_STATUS_EVERY):
+                self.send_file_progress(file_id, file_info)
+            elif file_info["report_timer"] is None:
+                self.schedule_file_report(file_id, file_info, FILE_STATUS_INTERVAL)
+    
+    def write_file_chunk(self, file_info, offset, chunk_data):
+        """Write a chunk at its offset in the transfer's .part file (holding file_info's lock)."""
+        fd = file_info["part_fd"]
+        if hasattr(os, "pwrite"):
+            while chunk_data:
+                written = os.pwrite(fd, chunk_data, offset)
+                chunk_data = chunk_data[written:]
+                offset += written
+        else:
+            # No pwrite on Windows; the lock keeps seek and write together
+            os.lseek(fd, offset, os.SEEK_SET)
+            while chunk_data:
+                chunk_data = chunk_data[os.write(fd, chunk_data):]
+    
+    def discard_incoming_file(self, file_info):
+        """Drop an expired incoming transfer: stop its reports, close and delete its .part file."""
+        with file_info["lock"]:
+            file_info["report_generation"] += 1
+            if file_info["report_timer"]:
+                file_info["report_timer"].cancel()
+                file_info["report_timer"] = None
+            if file_info["part_fd"] is not None:
+                os.close(file_info["part_fd"])
+                file_info["part_fd"] = None
+        try:
+            os.unlink(file_info["part_path"])
+        except OSError:
+            pass
+        print(f"❌ File transfer of {file_info['filename']} from {file_info['from_user']} timed out "
+              f"({file_info['received_chunks']}/{file_info['total_chunks']} chunks received)")
+    
+    def send_file_progress(self, file_id, file_info):
+        """Send a FILE_RECEIVED PARTIAL report with the bitmap of chunks received so far (holding file_info's lock).
+
+        Another report is scheduled in case this one is lost: FILE_STATUS_INTERVAL later,
+        doubling for every report in a row without new chunks, up to FILE_MAX_STALLS of them.
+        """
+        file_info["unreported"] = 0
+        received = file_info["received"]
+        base, bitmap = received.encode(FILE_STATUS_MAX_CHUNKS)
+        self.send_file_received(file_id, file_info["from_user"], "PARTIAL", base, bitmap, len(received))
+        
+        if file_info["quiet_reports"] < FILE_MAX_STALLS:
+            self.schedule_file_report(file_id, file_info, FILE_STATUS_INTERVAL * 2 ** file_info["quiet_reports"])
+        elif file_info["report_timer"]:
+            file_info["report_timer"].cancel()
+            file_info["report_timer"] = None
+    
+    def schedule_file_report(self, file_id, file_info, delay):
+        """(Re)arm the receiver's report timer; an earlier one no longer fires."""
+        if file_info["report_timer"]:
+            file_info["report_timer"].cancel()
+        file_info["report_generation"] += 1
+        generation = file_info["report_generation"]
+        file_info["report_timer"] = self.netSystem.call_later(delay, lambda: self.on_file_report_timer(file_id, generation))
+    
+    def on_file_report_timer(self, file_id, generation):
+        """No report for a while (few or no chunks arriving): send one now."""
+        file_info = self.incoming_files.get(file_id)
+        if not file_info:
+            return
+        with file_info["lock"]:
+            if file_info["report_generation"] != generation:
+                return
+            file_info["report_timer"] = None
+            if file_info["unreported"] == 0:
+                file_info["quiet_reports"] += 1
+            self.send_file_progress(file_id, file_info)
     
     def reconstruct_file(self, file_id):
-        """Reconstruct file from received chunks."""
+        """Move the completed .part file into downloads/ under its own name."""
         if file_id not in self.incoming_files:
             return False
         
         file_info = self.incoming_files[file_id]
         filename = file_info["filename"]
         total_chunks = file_info["total_chunks"]
-        chunks = file_info["chunks"]
         from_user = file_info["from_user"]
         
         # Check if all chunks are present
-        missing_chunks = [i for i in range(total_chunks) if i not in chunks]
+        missing_chunks = file_info["received"].missing() if file_info["received"] else list(range(total_chunks))
         if missing_chunks:
             if hasattr(self.netSystem, 'verbose') and self.netSystem.verbose:
                 print(f"[FILE] Missing chunks for {filename}: {missing_chunks}")
             return False
         
-        # Create downloads directory if it doesn't exist
-        downloads_dir = "downloads"
-        os.makedirs(downloads_dir, exist_ok=True)
-        
-        # Reconstruct file
-        output_path = os.path.join(downloads_dir, filename)
+        # Every chunk is already on disk: close the .part file and rename it in one step
+        output_path = file_info["output_path"]
         try:
-            with open(output_path, "wb") as f:
-                for i in range(total_chunks):
-                    f.write(chunks[i])
+            with file_info["lock"]:
+                if file_info["part_fd"] is not None:
+                    os.close(file_info["part_fd"])
+                    file_info["part_fd"] = None
+            os.replace(file_info["part_path"], output_path)
             
             # Non-verbose printing as per specs: "File transfer of filename is complete"
             print(f"File transfer of {filename} is complete")
@@ -428,10 +856,16 @@ class fileGameSystem:
             # Send FILE_RECEIVED confirmation
             self.send_file_received(file_id, from_user, "COMPLETE")
             
-            # Clean up
+            # Clean up, remembering the file in case the sender missed the confirmation
+            with file_info["lock"]:
+                file_info["report_generation"] += 1
+                if file_info["report_timer"]:
+                    file_info["report_timer"].cancel()
             del self.incoming_files[file_id]
             if file_id in self.pending_file_offers:
                 del self.pending_file_offers[file_id]
+            self.completed_files[file_id] = from_user
+            self.expire_later("completed_files", self.completed_files, file_id, from_user, FILE_OFFER_TTL)
             
             return True
             
@@ -440,8 +874,12 @@ class fileGameSystem:
                 print(f"[FILE] Failed to reconstruct file {filename}: {e}")
             return False
     
-    def send_file_received(self, file_id, to_user, status):
-        """Send FILE_RECEIVED confirmation according to LSNP specs."""
+    def send_file_received(self, file_id, to_user, status, base=None, bitmap=None, received=None):
+        """Send FILE_RECEIVED confirmation according to LSNP specs.
+
+        PARTIAL progress reports also carry BASE (the first chunk the bitmap covers),
+        BITMAP (base64, one bit per chunk from BASE) and RECEIVED (chunks so far).
+        """
         timestamp = int(time.time())
         user_id = self.get_user_id()
         
@@ -454,22 +892,23 @@ class fileGameSystem:
             "STATUS": status,
             "TIMESTAMP": str(timestamp)  # String as per specs
         }
-        
-        # Send the confirmation - resolve target IP from user_id
-        target_ip = to_user.split("@")[1] if "@" in to_user else "127.0.0.1"
-        target_port = LSNP_PORT
-        
-        # Try to get more specific peer info if available
-        if hasattr(self.netSystem, 'msg_system') and self.netSystem.msg_system:
-            peer_info = self.netSystem.msg_system.known_peers.get(to_user)
-            if peer_info:
-                target_ip = peer_info.get('ip', target_ip)
-                target_port = peer_info.get('port', target_port)
+        if bitmap is not None:
+            received_message["BASE"] = str(base)
+            received_message["BITMAP"] = base64.b64encode(bitmap)
+            received_message["RECEIVED"] = str(received)
+        
+        # Send the confirmation to the address the peer directory has for the user
+        target = self.resolve_user_address(to_user)
+        if target is None:
+            if hasattr(self.netSystem, 'verbose') and self.netSystem.verbose:
+                print(f"[WARN] No address for {to_user}, FILE_RECEIVED for {file_id} not sent")
+            return
+        target_ip, target_port = target
         
         self.netSystem.send_message(received_message, target_ip=target_ip, target_port=target_port)
         
         # No printing for FILE_RECEIVED as per specs
-        if hasattr(self.netSystem, 'verbose') and self.netSystem.verbose:
+        if hasattr(self.netSystem, 'verbose') and self.netSystem.verbose and status != "PARTIAL":
             print(f"[FILE] Sent FILE_RECEIVED confirmation for {file_id} to {to_user}")
             print(f"[FILE] Target: {target_ip}:{target_port}")
     
@@ -480,7 +919,16 @@ class fileGameSystem:
         from_user = message.get("FROM")
         
         if file_id in self.outgoing_files:
-            self.outgoing_files[file_id]["status"] = f"RECEIVED_{status}"
+            if status == "PARTIAL":
+                self.handle_file_progress(file_id, message)
+                return
+            
+            file_info = self.outgoing_files[file_id]
+            if "lock" in file_info:
+                with file_info["lock"]:
+                    self.finish_file_transfer(file_info, f"RECEIVED_{status}")
+            else:
+                file_info["status"] = f"RECEIVED_{status}"
             
             # No printing for FILE_RECEIVED as per specs
             if hasattr(self.netSystem, 'verbose') and self.netSystem.verbose:
@@ -501,26 +949,47 @@ class fileGameSystem:
         transfers = []
         
         # Outgoing files
-        for file_id, info in self.outgoing_files.items():
-            transfers.append({
+        for file_id, info in list(self.outgoing_files.items()):
+            transfer = {
                 "file_id": file_id,
                 "direction": "outgoing",
                 "filename": info["filename"],
                 "to_user": info["to_user"],
                 "status": info["status"],
                 "progress": f"{info['chunks_sent']}/{info['total_chunks']}" if info['total_chunks'] > 0 else "0/0"
-            })
+            }
+            if "acked" in info:
+                # Windowed transfer: progress is what the receiver has reported
+                acked = len(info["acked"])
+                elapsed = (info["finished"] or time.time()) - info["started"]
+                if info["status"] == "RECEIVED_COMPLETE":
+                    acked = info["total_chunks"]
+                sent_total = info["chunks_sent"] + info["retransmitted"]
+                transfer.update({
+                    "progress": f"{acked}/{info['total_chunks']}",
+                    "throughput_kib_s": round(min(acked * info["chunk_size"], info["filesize"]) / 1024 / elapsed, 1) if elapsed > 0 else 0.0,
+                    "loss_percent": round(100 * info["lost"] / sent_total, 1) if sent_total else 0.0,
+                    "retransmitted": info["retransmitted"],
+                    "window": int(info["window"]),
+                    "chunk_size": info["chunk_size"],
+                    "rtt_ms": info["rtt"].get_stats()["srtt_ms"]
+                })
+            transfers.append(transfer)
         
         # Incoming files
-        for file_id, info in self.incoming_files.items():
-            transfers.append({
+        for file_id, info in list(self.incoming_files.items()):
+            transfer = {
                 "file_id": file_id,
                 "direction": "incoming", 
                 "filename": info["filename"],
                 "from_user": info["from_user"],
                 "status": "receiving",
                 "progress": f"{info['received_chunks']}/{info['total_chunks']}" if info['total_chunks'] > 0 else "0/0"
-            })
+            }
+            if info.get("first_chunk_at"):
+                elapsed = time.time() - info["first_chunk_at"]
+                transfer["throughput_kib_s"] = round(info["received_bytes"] / 1024 / elapsed, 1) if elapsed > 0 else 0.0
+            transfers.append(transfer)
         
         return transfers
 
@@ -577,55 +1046,31 @@ class fileGameSystem:
         }
         
         # Store invite locally
-        self.game_invites[game_id] = {
+        invite = {
             'from': user_id,
             'to': to_user,
             'symbol': symbol,
             'timestamp': timestamp,
             'message_id': message_id
         }
+        self.game_invites[game_id] = invite
+        self.expire_later("game_invites", self.game_invites, game_id, invite, GAME_INVITE_TTL)
         
         # Send invitation to specific user
-        # Look up user's IP from known peers instead of extracting from username
-        target_ip = None
-        target_port = 50999
-        
-        # Check if to_user contains an IP (format: user@ip)
-        if '@' in to_user:
-            target_ip = to_user.split('@')[-1]
-        else:
-            # Look up the user's IP from known peers/clients
-            if hasattr(self.netSystem, 'msg_system') and self.netSystem.msg_system:
-                # Check peers from message system
-                for peer_id, peer_info in getattr(self.netSystem.msg_system, 'peers', {}).items():
-                    if peer_id.startswith(to_user + '@') or peer_id == to_user:
-                        if '@' in peer_id:
-                            target_ip = peer_id.split('@')[-1]
-                        break
-                
-                # If not found in peers, check known clients
-                if not target_ip:
-                    # For now, default to broadcast if we can't find the specific IP
-                    print(f"[WARN] Could not find IP for user {to_user}, broadcasting invitation")
-                    invite_message["BROADCAST"] = True
-                    self.netSystem.send_message(invite_message)
-                    return game_id
-        
-        if target_ip:
-            self.netSystem.send_message(invite_message, target_ip=target_ip, target_port=target_port)
-        else:
-            # Fallback to broadcast
+        # Resolve the user's address from the peer directory
+        target = self.resolve_user_address(to_user)
+        if target is None:
+            # Unknown bare name: broadcast instead
+            print(f"[WARN] Could not find IP for user {to_user}, broadcasting invitation")
             invite_message["BROADCAST"] = True
             self.netSystem.send_message(invite_message)
+            return game_id
+        target_ip, target_port = target
+        self.netSystem.send_message(invite_message, target_ip=target_ip, target_port=target_port)
         
         # Add to pending ACKs if msg_system exists
         if hasattr(self.netSystem, 'msg_system') and self.netSystem.msg_system:
-            self.netSystem.msg_system.pending_acks[message_id] = {
-                'timestamp': timestamp,
-                'retries': 0,
-                'message': invite_message,
-                'target_user': to_user
-            }
+            self.netSystem.msg_system.track_ack(message_id, invite_message, to_user)
         
         print(f"🎮 Sent Tic-Tac-Toe invitation to {to_user} (Game: {game_id}, Symbol: {symbol})")
         return game_id
@@ -672,42 +1117,21 @@ class fileGameSystem:
         }
         
         # Send the acceptance message to specific user
-        # Look up user's IP from known peers instead of extracting from username
+        # Resolve the user's address from the peer directory
         target_user = invite['from']
-        target_ip = None
-        target_port = 50999
-        
-        # Check if target_user contains an IP (format: user@ip)
-        if '@' in target_user:
-            target_ip = target_user.split('@')[-1]
-        else:
-            # Look up the user's IP from known peers/clients
-            if hasattr(self.netSystem, 'msg_system') and self.netSystem.msg_system:
-                # Check peers from message system
-                for peer_id, peer_info in getattr(self.netSystem.msg_system, 'peers', {}).items():
-                    if peer_id.startswith(target_user + '@') or peer_id == target_user:
-                        if '@' in peer_id:
-                            target_ip = peer_id.split('@')[-1]
-                        break
-                
-                # If not found in peers, check known clients
-                if not target_ip:
-                    # For now, default to broadcast if we can't find the specific IP
-                    print(f"[WARN] Could not find IP for user {target_user}, broadcasting acceptance")
-                    accept_message["BROADCAST"] = True
-                    self.netSystem.send_message(accept_message)
-                    print(f"📤 Sent game acceptance to {invite['from']}")
-                    # Remove from invites
-                    del self.game_invites[game_id]
-                    return True
-        
-        if target_ip:
-            self.netSystem.send_message(accept_message, target_ip=target_ip, target_port=target_port)
-        else:
-            # Fallback to broadcast
+        target = self.resolve_user_address(target_user)
+        if target is None:
+            # Unknown bare name: broadcast instead
+            print(f"[WARN] Could not find IP for user {target_user}, broadcasting acceptance")
             accept_message["BROADCAST"] = True
             self.netSystem.send_message(accept_message)
-            
+            print(f"📤 Sent game acceptance to {invite['from']}")
+            # Remove from invites
+            del self.game_invites[game_id]
+            return True
+        target_ip, target_port = target
+        self.netSystem.send_message(accept_message, target_ip=target_ip, target_port=target_port)
+        
         print(f"📤 Sent game acceptance to {invite['from']}")
         
         # Remove from invites
@@ -786,54 +1210,20 @@ class fileGameSystem:
         }
         
         # Send move to specific opponent
-        # Look up opponent's IP from known peers
-        target_ip = None
-        target_port = 50999
-        
-        # Check if opponent contains an IP (format: user@ip)
-        if '@' in opponent:
-            target_ip = opponent.split('@')[-1]
-        else:
-            # Look up the user's IP from known peers/clients
-            if hasattr(self.netSystem, 'msg_system') and self.netSystem.msg_system:
-                # Check peers from message system
-                for peer_id, peer_info in getattr(self.netSystem.msg_system, 'peers', {}).items():
-                    if peer_id.startswith(opponent + '@') or peer_id == opponent:
-                        if '@' in peer_id:
-                            target_ip = peer_id.split('@')[-1]
-                        break
-                
-                # If not found in peers, check known clients
-                if not target_ip:
-                    # For now, default to broadcast if we can't find the specific IP
-                    print(f"[WARN] Could not find IP for opponent {opponent}, broadcasting move")
-                    move_message["BROADCAST"] = True
-                    self.netSystem.send_message(move_message)
-                    # Continue with ACK handling
-                    if hasattr(self.netSystem, 'msg_system') and self.netSystem.msg_system:
-                        self.netSystem.msg_system.pending_acks[message_id] = {
-                            'timestamp': timestamp,
-                            'retries': 0,
-                            'message': move_message,
-                            'target_user': opponent
-                        }
-                    return True
-        
-        if target_ip:
-            self.netSystem.send_message(move_message, target_ip=target_ip, target_port=target_port)
-        else:
-            # Fallback to broadcast
+        # Resolve the opponent's address from the peer directory
+        target = self.resolve_user_address(opponent)
+        if target is None:
+            # Unknown bare name: broadcast instead (ACK retries keep the BROADCAST flag)
+            print(f"[WARN] Could not find IP for opponent {opponent}, broadcasting move")
             move_message["BROADCAST"] = True
             self.netSystem.send_message(move_message)
+        else:
+            target_ip, target_port = target
+            self.netSystem.send_message(move_message, target_ip=target_ip, target_port=target_port)
         
         # Add to pending ACKs
         if hasattr(self.netSystem, 'msg_system') and self.netSystem.msg_system:
-            self.netSystem.msg_system.pending_acks[message_id] = {
-                'timestamp': timestamp,
-                'retries': 0,
-                'message': move_message,
-                'target_user': opponent
-            }
+            self.netSystem.msg_system.track_ack(message_id, move_message, opponent)
         
         # Display updated board
         self.display_game_board(game_id)
@@ -949,9 +1339,6 @@ class fileGameSystem:
     def get_active_games(self):
         pass
 
-    def get_file_transfers(self):
-        pass
-
     def handle_game_invite(self, message):
         """Handle incoming game invitation."""
         game_id = message.get('GAMEID')
@@ -963,13 +1350,15 @@ class fileGameSystem:
             return
         
         # Store the invitation
-        self.game_invites[game_id] = {
+        invite = {
             'from': from_user,
             'to': message.get('TO'),
             'symbol': symbol,
             'timestamp': message.get('TIMESTAMP', int(time.time())),
             'message_id': message.get('MESSAGE_ID')
         }
+        self.game_invites[game_id] = invite
+        self.expire_later("game_invites", self.game_invites, game_id, invite, GAME_INVITE_TTL)
         
         # Get display name
         display_name = from_user
@@ -1193,38 +1582,17 @@ class fileGameSystem:
             result_message["WINNING_LINE"] = ','.join(map(str, result_info['winning_line']))
         
         # Send result to specific opponent
-        # Look up opponent's IP from known peers
-        target_ip = None
-        target_port = 50999
-        
-        # Check if opponent contains an IP (format: user@ip)
-        if '@' in opponent:
-            target_ip = opponent.split('@')[-1]
-        else:
-            # Look up the user's IP from known peers/clients
-            if hasattr(self.netSystem, 'msg_system') and self.netSystem.msg_system:
-                # Check peers from message system
-                for peer_id, peer_info in getattr(self.netSystem.msg_system, 'peers', {}).items():
-                    if peer_id.startswith(opponent + '@') or peer_id == opponent:
-                        if '@' in peer_id:
-                            target_ip = peer_id.split('@')[-1]
-                        break
-                
-                # If not found in peers, check known clients
-                if not target_ip:
-                    # For now, default to broadcast if we can't find the specific IP
-                    print(f"[WARN] Could not find IP for opponent {opponent}, broadcasting result")
-                    result_message["BROADCAST"] = True
-                    self.netSystem.send_message(result_message)
-                    return
-        
-        if target_ip:
-            self.netSystem.send_message(result_message, target_ip=target_ip, target_port=target_port)
-        else:
-            # Fallback to broadcast
+        # Resolve the opponent's address from the peer directory
+        target = self.resolve_user_address(opponent)
+        if target is None:
+            # Unknown bare name: broadcast instead
+            print(f"[WARN] Could not find IP for opponent {opponent}, broadcasting result")
             result_message["BROADCAST"] = True
             self.netSystem.send_message(result_message)
-    
+            return
+        target_ip, target_port = target
+        self.netSystem.send_message(result_message, target_ip=target_ip, target_port=target_port)
+        
     def display_game_result(self, game_id, result_info):
         """Display the final game result."""
         if game_id not in self.active_games:
@@ -1270,10 +1638,10 @@ class fileGameSystem:
         active = []
         current_time = time.time()
         
-        for game_id, game in self.active_games.items():
+        for game_id, game in list(self.active_games.items()):
             if game['status'] == 'active':
                 # Check for timeout (15 minutes)
-                if current_time - game['last_move'] > 900:  # 15 minutes
+                if current_time - game['last_move'] > GAME_INACTIVITY_TIMEOUT:
                     game['status'] = 'timeout'
                     continue
                 
@@ -1293,14 +1661,38 @@ class fileGameSystem:
         return list(self.game_invites.items())
     
     def timeout_inactive_games(self):
-        """Mark inactive games as timed out."""
+        """Mark inactive games as timed out; returns how many timed out (runs on every expiry sweep)."""
         current_time = time.time()
-        timeout_threshold = 900  # 15 minutes
+        timed_out = 0
         
-        for game_id, game in self.active_games.items():
-            if game['status'] == 'active' and current_time - game['last_move'] > timeout_threshold:
+        for game_id, game in list(self.active_games.items()):
+            if game['status'] == 'active' and current_time - game['last_move'] > GAME_INACTIVITY_TIMEOUT:
                 game['status'] = 'timeout'
+                timed_out += 1
                 print(f"⏰ Game {game_id} timed out due to inactivity")
+        return timed_out
+
+    def resolve_user_address(self, user_id):
+        """Get the (ip, port) to unicast to a user from the peer directory, or None for an unknown bare name."""
+        return self.netSystem.peers.resolve(user_id)
+
+    def expire_later(self, category, table, key, entry, ttl, idle_key=None, on_expire=None):
+        """Remove table[key] after ttl seconds, unless it has been removed or replaced by then.
+
+        With idle_key, ttl counts from the time.time() stamp in entry[idle_key], so the
+        entry stays while it is in use. on_expire(entry) runs once it has been removed.
+        """
+        def expire():
+            if table.get(key) is not entry:
+                return False
+            if idle_key is not None and time.time() < entry[idle_key] + ttl:
+                self.netSystem.expiry.track(category, entry[idle_key] + ttl, expire)
+                return False
+            table.pop(key, None)
+            if on_expire:
+                on_expire(entry)
+            return True
+        self.netSystem.expiry.track(category, time.time() + ttl, expire)
     
     def get_game_state(self, game_id):
         """Get complete game state."""
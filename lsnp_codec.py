@@ -0,0 +1,308 @@
+# Member 1
+# LSNP wire codec: schema-aware encoding and decoding of KEY: VALUE messages
+
+from collections.abc import MutableMapping
+
+from vars import *
+
+INTERNAL_FIELDS = frozenset(["BROADCAST"])  # Local flags that never go on the wire
+
+# Every key this client sends or reads. Decoded messages share these str objects instead of
+# each holding its own copies, which adds up in stored posts, DMs and message logs.
+KNOWN_FIELDS = [
+    "TYPE", "USER_ID", "FROM", "TO", "DISPLAY_NAME", "STATUS", "CONTENT", "TTL", "MESSAGE_ID", "TOKEN",
+    "TIMESTAMP", "LISTEN_PORT", "AVATAR_TYPE", "AVATAR_ENCODING", "AVATAR_DATA", "ACTION", "POST_TIMESTAMP",
+    "FILEID", "FILE_ID", "FILENAME", "FILESIZE", "FILETYPE", "DESCRIPTION", "CHUNK_INDEX", "TOTAL_CHUNKS",
+    "CHUNK_SIZE", "DATA", "GAMEID", "GAME_ID", "SYMBOL", "POSITION", "TURN", "RESULT", "WINNING_LINE",
+    "GROUP_ID", "GROUP_NAME", "MEMBERS", "ADD", "REMOVE", "REVOKED_TOKEN", "REASON", "MESSAGE", "ACK_MESSAGE_ID", "BASE", "BITMAP", "RECEIVED"
+]
+_interned_keys = {key: key for key in KNOWN_FIELDS}
+_interned_raw_keys = {key.encode(): key for key in KNOWN_FIELDS}
+_line_markers = {key: f"\n{key}:".encode() for key in KNOWN_FIELDS}  # What a field's line starts with
+_MISSING = object()
+
+class messageSchema:
+    """Which fields of a message type are integers and which are base64 payloads."""
+    def __init__(self, numeric=(), binary=()):
+        self.numeric = tuple(numeric) + ("TIMESTAMP",)
+        self.binary = tuple(binary)
+        # Line prefixes used to cut binary fields out of the raw datagram
+        self.binary_markers = tuple((key, f"\n{key}:".encode()) for key in self.binary)
+
+MESSAGE_SCHEMAS = {
+    MSG_PROFILE: messageSchema(numeric=["LISTEN_PORT"], binary=["AVATAR_DATA"]),
+    MSG_POST: messageSchema(numeric=["TTL"]),
+    MSG_DM: messageSchema(),
+    MSG_PING: messageSchema(numeric=["LISTEN_PORT"]),
+    MSG_ACK: messageSchema(),
+    MSG_FOLLOW: messageSchema(),
+    MSG_UNFOLLOW: messageSchema(),
+    MSG_FILE_OFFER: messageSchema(numeric=["FILESIZE", "CHUNK_SIZE"]),
+    MSG_FILE_CHUNK: messageSchema(numeric=["CHUNK_INDEX", "TOTAL_CHUNKS", "CHUNK_SIZE"], binary=["DATA"]),
+    MSG_FILE_RECEIVED: messageSchema(numeric=["BASE", "RECEIVED"], binary=["BITMAP"]),
+    MSG_REVOKE: messageSchema(),
+    MSG_TICTACTOE_INVITE: messageSchema(),
+    MSG_TICTACTOE_ACCEPT: messageSchema(),
+    MSG_TICTACTOE_MOVE: messageSchema(numeric=["POSITION", "TURN"]),
+    MSG_TICTACTOE_RESULT: messageSchema(),
+    MSG_LIKE: messageSchema(numeric=["POST_TIMESTAMP"]),
+    MSG_GROUP_CREATE: messageSchema(),
+    MSG_GROUP_UPDATE: messageSchema(),
+    MSG_GROUP_MESSAGE: messageSchema(),
+    # Not in the specs, but sent by this client
+    "HELLO": messageSchema(numeric=["LISTEN_PORT"]),
+    "FILE_ACCEPTED": messageSchema(numeric=["CHUNK_SIZE"])
+}
+
+# Unknown types: any field that is numeric for some known type is treated as numeric
+DEFAULT_SCHEMA = messageSchema(numeric=sorted({key for schema in MESSAGE_SCHEMAS.values() for key in schema.numeric} - {"TIMESTAMP"}))
+
+BINARY_VALUE_CLASSES = frozenset([bytes, bytearray, memoryview])
+
+# TYPE values (as wire bytes) whose messages carry base64 payloads
+BINARY_TYPES = {message_type.encode(): schema for message_type, schema in MESSAGE_SCHEMAS.items() if schema.binary}
+
+def get_schema(message_type):
+    """Get the schema for a message type (DEFAULT_SCHEMA if the type is unknown)."""
+    return MESSAGE_SCHEMAS.get(message_type, DEFAULT_SCHEMA)
+
+def encode(message):
+    """Encode a message dictionary to LSNP wire bytes (KEY: VALUE lines ending in a blank line).
+
+    bytes values (e.g. base64 DATA) are written as-is without a str round trip.
+    """
+    if not get_schema(message.get("TYPE")).binary:
+        lines = [f"{key}: {'' if value is None else value}" for key, value in message.items() if key not in INTERNAL_FIELDS]
+        lines.append("\n")
+        return "\n".join(lines).encode()
+
+    # Text fields are encoded in runs; binary payloads are spliced in between them
+    parts = []
+    text = []
+    for key, value in message.items():
+        if key in INTERNAL_FIELDS:
+            continue
+        if value.__class__ in BINARY_VALUE_CLASSES:
+            text.append(f"{key}: ")
+            parts.append("".join(text).encode())
+            parts.append(value)
+            text = ["\n"]
+        else:
+            text.append(f"{key}: {'' if value is None else value}\n")
+    text.append("\n")
+    parts.append("".join(text).encode())
+    return b"".join(parts)
+
+def encode_text(message):
+    """Encode a message dictionary to LSNP text (for display)."""
+    return encode(message).decode()
+
+def decode(data):
+    """Decode LSNP wire data (bytes, memoryview or str) into a message dictionary.
+
+    Numeric fields of the message's TYPE become ints; every other field stays a str,
+    so e.g. a CONTENT of "123" is not mangled. Binary fields (FILE_CHUNK DATA, PROFILE
+    AVATAR_DATA) are cut out of the raw bytes and returned as ASCII bytes, ready for
+    binascii.a2b_base64, without ever being decoded to str. A bytes-like data is copied
+    to bytes once up front; the result holds no reference to data, so a receive buffer
+    can be reused as soon as this returns.
+    A key that appears more than once keeps its first value, as in LSNPMessage.
+    """
+    message = {}
+    if data.__class__ is not str:
+        if data.__class__ is not bytes:
+            data = bytes(data)
+
+        # Binary-heavy types put TYPE first; slice their payloads off before decoding the rest
+        if data.startswith(b"TYPE:"):
+            schema = BINARY_TYPES.get(data[5:data.find(b"\n")].strip())
+            if schema:
+                for key, marker in schema.binary_markers:
+                    start = data.find(marker)
+                    if start < 0:
+                        continue
+                    end = data.find(b"\n", start + 1)
+                    if end < 0:
+                        end = len(data)
+                    message[key] = data[start + len(marker):end].strip()
+                    data = data[:start] + data[end:]
+        data = data.decode()
+
+    for line in data.split("\n"):
+        key, sep, value = line.partition(":")
+        if sep:
+            key = _interned_keys.get(key) or key.strip()
+            if key not in message:
+                message[key] = value.strip()
+
+    for key in get_schema(message.get("TYPE")).numeric:
+        value = message.get(key)
+        if value is not None and value.isdecimal():
+            message[key] = int(value)
+    return message
+
+class LSNPMessage:
+    """Received LSNP message that finds and converts each field only when it is read.
+
+    Construction keeps the datagram as one bytes object that the message owns: a
+    memoryview over a receive buffer is copied once here (a single memcpy of the
+    datagram), because messages outlive their handler (stored posts, pending ACKs)
+    while the buffer goes back to the receive ring as soon as the message exists.
+    Nothing else on the receive path copies the datagram.
+
+    Reading a field searches for its line with bytes.find and converts only that
+    value, so a handler that reads TYPE and MESSAGE_ID and rejects a duplicate never
+    touches the rest. A full line index
+    is built only when the message is iterated or a key is deleted, or up front when
+    the layout is not canonical (a canonical message starts with "TYPE:"). Both ways,
+    a key that appears more than once reads as its first value.
+
+    Registered as a MutableMapping and dict-compatible for the handlers: get, [], in,
+    keys/items/values, update, pop, setdefault, copy (a plain dict) and == all work.
+    Not derived from MutableMapping, which would make construction noticeably slower.
+    """
+    __slots__ = ("_data", "_raw", "_values", "_schema")
+
+    def __init__(self, data):
+        if data.__class__ is str:
+            data = data.encode()
+        elif data.__class__ is not bytes:
+            data = bytes(data)  # The message owns a copy; the receive buffer is released after this
+        self._data = data
+        self._raw = None  # KEY -> raw value bytes, once indexed
+        self._values = {}  # Converted (or assigned) values
+        self._schema = None
+
+        # Other layouts (e.g. whitespace around keys) can't be searched reliably
+        if not data.startswith(b"TYPE:"):
+            self._index()
+
+    def _index(self):
+        """Split every line into KEY -> raw value bytes."""
+        if self._raw is None:
+            raw = {}
+            for line in self._data.split(b"\n"):
+                raw_key, sep, raw_value = line.partition(b":")
+                if sep:
+                    key = _interned_raw_keys.get(raw_key) or raw_key.decode().strip()
+                    if key not in raw:  # The first occurrence wins, as in _find
+                        raw[key] = raw_value
+            self._raw = raw
+        return self._raw
+
+    def _find(self, key):
+        """Get a field's raw value bytes, or None if the message doesn't have it."""
+        if self._raw is not None:
+            return self._raw.get(key)
+
+        data = self._data
+        marker = _line_markers.get(key)
+        if marker is None:
+            marker = b"\n" + key.encode() + b":"
+        if data.startswith(marker[1:]):
+            start = len(marker) - 1
+        else:
+            # Search forward: headers come before any large payload, so hits stop early
+            start = data.find(marker)
+            if start < 0:
+                return None
+            start += len(marker)
+        end = data.find(b"\n", start)
+        return data[start:end] if end >= 0 else data[start:]
+
+    def _convert(self, key, raw_value):
+        schema = self._schema
+        if schema is None:
+            raw_type = self._find("TYPE")
+            schema = self._schema = get_schema(raw_type.strip().decode() if raw_type is not None else None)
+
+        value = raw_value.strip()
+        if key in schema.binary:
+            return value
+        value = value.decode()
+        if key in schema.numeric and value.isdecimal():
+            value = int(value)
+        return value
+
+    def __getitem__(self, key):
+        values = self._values
+        if key in values:
+            return values[key]
+        raw_value = self._find(key)
+        if raw_value is None:
+            raise KeyError(key)
+        value = values[key] = self._convert(key, raw_value)
+        return value
+
+    def get(self, key, default=None):
+        values = self._values
+        if key in values:
+            return values[key]
+        raw_value = self._find(key)
+        if raw_value is None:
+            return default
+        value = values[key] = self._convert(key, raw_value)
+        return value
+
+    def __setitem__(self, key, value):
+        self._values[key] = value
+
+    def __delitem__(self, key):
+        in_raw = self._index().pop(key, _MISSING) is not _MISSING
+        in_values = self._values.pop(key, _MISSING) is not _MISSING
+        if not (in_raw or in_values):
+            raise KeyError(key)
+
+    def __contains__(self, key):
+        return key in self._values or self._find(key) is not None
+
+    def __iter__(self):
+        raw = self._index()
+        yield from raw
+        for key in self._values:
+            if key not in raw:
+                yield key
+
+    def __len__(self):
+        raw = self._index()
+        return len(raw) + sum(1 for key in self._values if key not in raw)
+
+    def keys(self):
+        return self.copy().keys()
+
+    def items(self):
+        return self.copy().items()
+
+    def values(self):
+        return self.copy().values()
+
+    def update(self, *args, **kwargs):
+        self._values.update(*args, **kwargs)
+
+    def pop(self, key, default=_MISSING):
+        try:
+            value = self[key]
+        except KeyError:
+            if default is _MISSING:
+                raise
+            return default
+        del self[key]
+        return value
+
+    def setdefault(self, key, default=None):
+        if key not in self:
+            self[key] = default
+        return self[key]
+
+    def copy(self):
+        return {key: self[key] for key in self}
+
+    def __eq__(self, other):
+        if isinstance(other, (dict, LSNPMessage)):
+            return self.copy() == dict(other)
+        return NotImplemented
+
+    def __repr__(self):
+        return repr(self.copy())
+
+MutableMapping.register(LSNPMessage)
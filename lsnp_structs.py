@@ -0,0 +1,877 @@
+# Member 2
+# Bounded data structures for long-running peers
+
+import bisect
+import heapq
+import itertools
+import json
+import math
+import os
+import random
+import threading
+import time
+from collections import OrderedDict
+from collections.abc import Mapping
+
+from vars import *
+
+class expiringSet:
+    """Set of recently seen keys (e.g. MESSAGE_IDs) that forgets them after a TTL.
+
+    Keys live in a small ring of generations. New keys go into the newest one, and
+    once it is older than ttl / (generations - 1) (or holds its share of max_entries)
+    the oldest generation is dropped as a whole. A key is therefore remembered for at
+    least ttl seconds unless the memory cap forces an early rotation, and the set
+    never holds more than max_entries keys. Membership checks and adds are O(1).
+    """
+    def __init__(self, ttl=DEDUP_TTL, generations=DEDUP_GENERATIONS, max_entries=DEDUP_MAX_ENTRIES):
+        self.ttl = ttl
+        self.generations = max(2, generations)
+        self.max_entries = max_entries
+        self.generation_span = ttl / (self.generations - 1)
+        self.generation_cap = max(1, max_entries // self.generations)
+        self.ring = [set()]  # Oldest first; the last set takes new keys
+        self.current_started = time.monotonic()
+        self.lock = threading.Lock()  # Handlers run on several workers
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0  # Keys forgotten by dropping a generation
+        self.early_rotations = 0  # Rotations forced by the memory cap rather than time
+
+    def _rotate(self, now):
+        """Start a new generation, dropping the oldest ones beyond the ring size."""
+        self.ring.append(set())
+        self.current_started = now
+        while len(self.ring) > self.generations:
+            self.evictions += len(self.ring.pop(0))
+
+    def _expire(self, now):
+        elapsed = now - self.current_started
+        if elapsed >= self.generation_span:
+            # After a long idle period several generations are stale at once
+            for _ in range(min(self.generations, int(elapsed // self.generation_span))):
+                self._rotate(now)
+
+    def __contains__(self, key):
+        with self.lock:
+            self._expire(time.monotonic())
+            for generation in reversed(self.ring):
+                if key in generation:
+                    self.hits += 1
+                    return True
+            self.misses += 1
+            return False
+
+    def add(self, key):
+        with self.lock:
+            now = time.monotonic()
+            self._expire(now)
+            current = self.ring[-1]
+            if len(current) >= self.generation_cap:
+                self.early_rotations += 1
+                self._rotate(now)
+                current = self.ring[-1]
+            current.add(key)
+
+    def discard(self, key):
+        with self.lock:
+            for generation in self.ring:
+                generation.discard(key)
+
+    def __len__(self):
+        with self.lock:
+            return sum(len(generation) for generation in self.ring)
+
+    def get_stats(self):
+        """Get size, limits and hit/miss/eviction counters."""
+        with self.lock:
+            return {
+                "size": sum(len(generation) for generation in self.ring),
+                "max_entries": self.max_entries,
+                "ttl": self.ttl,
+                "generations": len(self.ring),
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "early_rotations": self.early_rotations
+            }
+
+class concurrentDict(dict):
+    """dict shared between the listener workers, timer thread and UI thread.
+
+    Writes take the dict's lock, and iteration (keys/values/items/iter) works on a
+    snapshot taken under it, so readers never see "dictionary changed size during
+    iteration". Plain reads (d[key], get, in, len) stay lock-free C dict operations.
+    Compound updates of a value (check-then-modify) should hold `lock`, which is
+    re-entrant so they can call the other methods.
+    """
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.lock = threading.RLock()
+
+    def __setitem__(self, key, value):
+        with self.lock:
+            super().__setitem__(key, value)
+
+    def __delitem__(self, key):
+        with self.lock:
+            super().__delitem__(key)
+
+    def pop(self, key, *default):
+        with self.lock:
+            return super().pop(key, *default)
+
+    def popitem(self):
+        with self.lock:
+            return super().popitem()
+
+    def setdefault(self, key, default=None):
+        with self.lock:
+            return super().setdefault(key, default)
+
+    def update(self, *args, **kwargs):
+        with self.lock:
+            super().update(*args, **kwargs)
+
+    def clear(self):
+        with self.lock:
+            super().clear()
+
+    def keys(self):
+        with self.lock:
+            return list(super().keys())
+
+    def values(self):
+        with self.lock:
+            return list(super().values())
+
+    def items(self):
+        with self.lock:
+            return list(super().items())
+
+    def __iter__(self):
+        return iter(self.keys())
+
+    def snapshot(self):
+        """Get a plain dict copy, consistent as of one moment."""
+        with self.lock:
+            return dict(super().items())
+
+    def copy(self):
+        return self.snapshot()
+
+class parsedToken:
+    """A token (user_id|expiry|scope) split and converted once."""
+    __slots__ = ("user_id", "expiry", "scope", "ip", "revoked")
+
+    def __init__(self, user_id, expiry, scope, revoked):
+        self.user_id = user_id
+        self.expiry = expiry
+        self.scope = scope
+        self.ip = user_id.split('@')[1] if '@' in user_id else None
+        self.revoked = revoked
+
+def parse_token(token, revoked_tokens=()):
+    """Parse a token into a parsedToken, or return the reason it is malformed (a str)."""
+    parts = token.split('|')
+    if len(parts) != 3:
+        return 'Invalid token format'
+    user_id, expiry_str, scope = parts
+    try:
+        expiry = int(expiry_str)
+    except ValueError:
+        return 'Invalid expiry timestamp'
+    return parsedToken(user_id, expiry, scope, token in revoked_tokens)
+
+class tokenCache:
+    """LRU cache of parsed tokens keyed by the token string.
+
+    Senders reuse a token for its whole lifetime, so validating a repeated token is
+    one dict hit. Malformed tokens are cached as their rejection reason. An entry
+    records whether the token was revoked when it was parsed; revoking (or
+    forgetting) a token must invalidate() it so the next lookup re-parses.
+    """
+    def __init__(self, maxsize=TOKEN_CACHE_SIZE):
+        self.maxsize = maxsize
+        self.entries = OrderedDict()
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, token, revoked_tokens=()):
+        """Get the parsedToken (or rejection reason) for token, parsing it on a miss."""
+        with self.lock:
+            entry = self.entries.get(token)
+            if entry is not None:
+                self.entries.move_to_end(token)
+                self.hits += 1
+                return entry
+            self.misses += 1
+
+            # Parsed under the lock so a concurrent invalidate() can't be overtaken by a stale entry
+            entry = self.entries[token] = parse_token(token, revoked_tokens)
+            if len(self.entries) > self.maxsize:
+                self.entries.popitem(last=False)
+                self.evictions += 1
+            return entry
+
+    def invalidate(self, token):
+        with self.lock:
+            self.entries.pop(token, None)
+
+    def get_stats(self):
+        with self.lock:
+            return {"size": len(self.entries), "maxsize": self.maxsize, "hits": self.hits,
+                    "misses": self.misses, "evictions": self.evictions}
+
+class peerEntry:
+    """Where a peer was last heard from."""
+    __slots__ = ("user_id", "ip", "port", "last_seen")
+
+    def __init__(self, user_id, ip, port, last_seen):
+        self.user_id = user_id
+        self.ip = ip
+        self.port = port
+        self.last_seen = last_seen
+
+class peerDirectory:
+    """Peers by user_id and by IP, kept current from every received datagram.
+
+    resolve() turns a user_id into the (ip, port) to unicast to with dict lookups only:
+    the address the user was last heard from, else the IP in the user_id with the
+    listen port that user last advertised from that IP, else LSNP_PORT. A port is only
+    taken from a LISTEN_PORT field, so a DM sent from an ephemeral socket doesn't
+    overwrite it, and is kept per user, so peers sharing a host keep their own ports.
+    A user is only placed at (or moved to) an IP other than the one in its user_id when
+    the datagram is verified, so one forged FROM can't redirect a peer's traffic.
+    """
+    def __init__(self):
+        self.peers = {}  # user_id -> peerEntry
+        self.by_ip = {}  # ip -> {user_id, ...}
+        self.by_name = {}  # username (part before @) -> user_id, for bare names
+        self.ports = {}  # (user_id, ip) -> last advertised listen port
+        self.lock = threading.Lock()
+        self.lookups = 0
+        self.misses = 0
+
+    def see(self, ip, port=None, user_id=None, verified=False):
+        """Record a datagram from ip; port is its advertised LISTEN_PORT, if it had one.
+
+        verified says the datagram carried a valid token of user_id.
+        """
+        now = time.time()
+        with self.lock:
+            if not user_id:
+                return
+            claimed_ip = user_id.rsplit('@', 1)[1] if '@' in user_id else None
+            trusted = verified or claimed_ip == ip
+            if port is not None and trusted:
+                self.ports[(user_id, ip)] = port
+            entry = self.peers.get(user_id)
+            if entry is None:
+                if not trusted and claimed_ip is not None:
+                    return  # resolve() keeps using the IP in the user_id
+                self.peers[user_id] = peerEntry(user_id, ip, port if port is not None else self.ports.get((user_id, ip), LSNP_PORT), now)
+                self.by_ip.setdefault(ip, set()).add(user_id)
+                self.by_name[user_id.split('@')[0]] = user_id
+                return
+            if entry.ip != ip:
+                if not trusted:
+                    return  # Not proven to come from user_id: keep its known address
+                users = self.by_ip.get(entry.ip)
+                if users:
+                    users.discard(user_id)
+                    if not users:
+                        del self.by_ip[entry.ip]
+                self.by_ip.setdefault(ip, set()).add(user_id)
+                entry.ip = ip
+                if port is None:
+                    port = self.ports.get((user_id, ip), LSNP_PORT)
+            if port is not None:
+                entry.port = port
+            entry.last_seen = now
+
+    def resolve(self, user_id, default_port=LSNP_PORT):
+        """Get the (ip, port) to unicast to user_id, or None for an unknown name without an IP."""
+        with self.lock:
+            self.lookups += 1
+            entry = self.peers.get(user_id)
+            if entry is None and '@' not in user_id:
+                full_id = self.by_name.get(user_id)
+                entry = self.peers.get(full_id) if full_id else None
+            if entry is not None:
+                return entry.ip, entry.port
+            self.misses += 1
+            if '@' not in user_id:
+                return None
+            ip = user_id.rsplit('@', 1)[1]
+            return ip, self.ports.get((user_id, ip), default_port)
+
+    def users_at(self, ip):
+        """Get the user_ids last heard from ip."""
+        with self.lock:
+            return list(self.by_ip.get(ip, ()))
+
+    def last_seen(self, user_id):
+        """Get when user_id was last heard from (epoch seconds), or None."""
+        entry = self.peers.get(user_id)
+        return entry.last_seen if entry else None
+
+    def snapshot(self):
+        """Get {user_id: {ip, port, last_seen}} for every known peer."""
+        with self.lock:
+            return {user_id: {"ip": entry.ip, "port": entry.port, "last_seen": entry.last_seen}
+                    for user_id, entry in self.peers.items()}
+
+    def __len__(self):
+        return len(self.peers)
+
+    def get_stats(self):
+        with self.lock:
+            return {"peers": len(self.peers), "addresses": len(self.ports), "lookups": self.lookups, "misses": self.misses}
+
+def _json_default(value):
+    """Make log entries JSON-safe: lazy messages become dicts, bytes (base64 payloads) become str."""
+    if isinstance(value, Mapping):
+        return dict(value.items())
+    if isinstance(value, (bytes, bytearray, memoryview)):
+        return bytes(value).decode("ascii", "replace")
+    if isinstance(value, (set, frozenset)):
+        return sorted(value)
+    return str(value)
+
+class ringBuffer:
+    """Fixed-capacity log: O(1) append, the oldest entry is overwritten once full.
+
+    Iterates oldest to newest and supports len() and indexing/slicing in that order
+    (e.g. log[-10:]). With spill_path, every entry that gets overwritten is first
+    appended to that file as a JSON line, so the full history is kept for auditing
+    while memory stays fixed.
+    """
+    def __init__(self, capacity, spill_path=None):
+        self.capacity = capacity
+        self.slots = [None] * capacity
+        self.start = 0  # Index of the oldest entry
+        self.count = 0
+        self.lock = threading.Lock()
+        self.spill_path = spill_path
+        self.spill_file = None
+        self.spilled = 0
+
+    def append(self, entry):
+        with self.lock:
+            if self.count < self.capacity:
+                self.slots[(self.start + self.count) % self.capacity] = entry
+                self.count += 1
+                return
+            if self.spill_path:
+                self._spill(self.slots[self.start])
+            self.slots[self.start] = entry
+            self.start = (self.start + 1) % self.capacity
+
+    def _spill(self, entry):
+        try:
+            if self.spill_file is None:
+                directory = os.path.dirname(self.spill_path)
+                if directory:
+                    os.makedirs(directory, exist_ok=True)
+                self.spill_file = open(self.spill_path, "a", encoding="utf-8")
+            self.spill_file.write(json.dumps(entry, default=_json_default) + "\n")
+            self.spilled += 1
+        except (OSError, TypeError, ValueError) as e:
+            print(f"[ERROR] Failed to spill log entry to {self.spill_path}: {e}")
+
+    def flush(self):
+        """Write buffered spilled entries to disk."""
+        with self.lock:
+            if self.spill_file:
+                self.spill_file.flush()
+
+    def _snapshot(self):
+        with self.lock:
+            end = self.start + self.count
+            if end <= self.capacity:
+                return self.slots[self.start:end]
+            return self.slots[self.start:] + self.slots[:end - self.capacity]
+
+    def __iter__(self):
+        return iter(self._snapshot())
+
+    def __len__(self):
+        return self.count
+
+    def __bool__(self):
+        return self.count > 0
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return self._snapshot()[index]
+        with self.lock:
+            if index < 0:
+                index += self.count
+            if not 0 <= index < self.count:
+                raise IndexError("ringBuffer index out of range")
+            return self.slots[(self.start + index) % self.capacity]
+
+    def get_stats(self):
+        return {"size": self.count, "capacity": self.capacity, "spilled": self.spilled, "spill_path": self.spill_path}
+
+class chunkBitmap:
+    """One bit per chunk of a file transfer: which chunks have arrived (or been acknowledged).
+
+    first_missing is the lowest chunk index not yet set. encode()/merge() move a window
+    of the bitmap starting at a byte boundary, which is what FILE_RECEIVED reports carry.
+    """
+    def __init__(self, total):
+        self.total = total
+        self.bits = bytearray((total + 7) // 8)
+        self.count = 0
+        self.first_missing = 0
+
+    def add(self, index):
+        """Set a chunk's bit; returns False if it was already set (or is out of range)."""
+        if not 0 <= index < self.total:
+            return False
+        byte, mask = index >> 3, 1 << (index & 7)
+        if self.bits[byte] & mask:
+            return False
+        self.bits[byte] |= mask
+        self.count += 1
+        if index == self.first_missing:
+            self._advance()
+        return True
+
+    def _advance(self):
+        bits, index, total = self.bits, self.first_missing, self.total
+        while index < total:
+            if index & 7 == 0 and bits[index >> 3] == 0xFF:
+                index += 8
+            elif bits[index >> 3] & (1 << (index & 7)):
+                index += 1
+            else:
+                break
+        self.first_missing = min(index, total)
+
+    def __contains__(self, index):
+        return 0 <= index < self.total and bool(self.bits[index >> 3] & (1 << (index & 7)))
+
+    def __len__(self):
+        return self.count
+
+    def is_complete(self):
+        return self.count == self.total
+
+    def missing(self, start=0, end=None):
+        """Get the indices in start..end (exclusive) whose bit is not set."""
+        end = self.total if end is None else min(end, self.total)
+        return [index for index in range(max(start, self.first_missing), end) if index not in self]
+
+    def encode(self, max_chunks):
+        """Get (base, bytes) covering up to max_chunks chunks from the byte holding first_missing."""
+        base = self.first_missing & ~7
+        return base, bytes(self.bits[base >> 3:(base + max_chunks + 7) >> 3])
+
+    def merge(self, base, data):
+        """Set every chunk below base and every bit set in data (which starts at chunk base).
+
+        Returns the indices that were newly set.
+        """
+        added = []
+        for index in range(self.first_missing, min(base, self.total)):
+            if self.add(index):
+                added.append(index)
+        # Bits in data that aren't set here yet, found with one big-int operation
+        offset = base >> 3
+        own = self.bits[offset:offset + len(data)]
+        new = int.from_bytes(data[:len(own)], "little") & ~int.from_bytes(own, "little")
+        first = offset << 3
+        while new:
+            low = new & -new
+            index = first + low.bit_length() - 1
+            if self.add(index):
+                added.append(index)
+            new ^= low
+        return added
+
+class bloomFilter:
+    """Compact probabilistic set: "no" answers are exact, "yes" may be a false positive.
+
+    Sized for capacity keys at error_rate. To stay bounded it keeps two generations
+    of bits: once the current one has taken capacity keys it becomes the previous one
+    and the old previous one is cleared, so memory is fixed at twice the bit array.
+    Callers must confirm a "yes" against an exact structure before acting on it.
+    """
+    def __init__(self, capacity=BLOOM_CAPACITY, error_rate=BLOOM_ERROR_RATE):
+        self.capacity = capacity
+        self.error_rate = error_rate
+        self.num_bits = max(8, math.ceil(-capacity * math.log(error_rate) / (math.log(2) ** 2)))
+        self.num_hashes = max(1, round(self.num_bits / capacity * math.log(2)))
+        self.num_bytes = (self.num_bits + 7) // 8
+        self.current = bytearray(self.num_bytes)
+        self.previous = bytearray(self.num_bytes)
+        self.current_count = 0
+        self.lock = threading.Lock()
+        self.lookups = 0
+        self.positives = 0
+        self.rotations = 0
+
+    def add(self, key):
+        # Double hashing: k bit positions from one 64-bit hash
+        h = hash(key)
+        position = h & 0xFFFFFFFF
+        step = ((h >> 32) & 0xFFFFFFFF) | 1
+        num_bits = self.num_bits
+        with self.lock:
+            if self.current_count >= self.capacity:
+                self.previous = self.current
+                self.current = bytearray(self.num_bytes)
+                self.current_count = 0
+                self.rotations += 1
+            bits = self.current
+            for _ in range(self.num_hashes):
+                bit = position % num_bits
+                bits[bit >> 3] |= 1 << (bit & 7)
+                position += step
+            self.current_count += 1
+
+    def __contains__(self, key):
+        # Same positions as add(); stop at the first clear bit, which is where most new keys end
+        h = hash(key)
+        start = h & 0xFFFFFFFF
+        step = ((h >> 32) & 0xFFFFFFFF) | 1
+        num_bits = self.num_bits
+        self.lookups += 1  # Counters are approximate under concurrent lookups; they are never locked
+        for bits in (self.current, self.previous):
+            position = start
+            for _ in range(self.num_hashes):
+                bit = position % num_bits
+                if not bits[bit >> 3] & (1 << (bit & 7)):
+                    break
+                position += step
+            else:
+                self.positives += 1
+                return True
+        return False
+
+    def get_stats(self):
+        """Get sizing and lookup counters."""
+        return {
+            "bits": self.num_bits,
+            "hashes": self.num_hashes,
+            "memory_bytes": 2 * self.num_bytes,
+            "capacity": self.capacity,
+            "error_rate": self.error_rate,
+            "current_keys": self.current_count,
+            "rotations": self.rotations,
+            "lookups": self.lookups,
+            "positives": self.positives
+        }
+
+class postStore:
+    """Posts indexed by MESSAGE_ID, by author and by timestamp, dropped when their TTL runs out.
+
+    The timeline and each author's posts are lists of (timestamp, sequence, key) kept
+    sorted with bisect, so time-range queries and feed pages are O(log n) to locate.
+    A min-heap of expiry times lets every call drop expired posts by looking only at
+    its top. A post whose MESSAGE_ID is already stored is ignored.
+    """
+    def __init__(self, default_ttl=POST_DEFAULT_TTL):
+        self.default_ttl = default_ttl
+        self.posts = {}  # key (MESSAGE_ID) -> post
+        self.entries = {}  # key -> (timestamp, sequence, key), the entry in the sorted indexes
+        self.timeline = []  # (timestamp, sequence, key), oldest first
+        self.by_author = {}  # USER_ID -> [(timestamp, sequence, key)], oldest first
+        self.expiry = []  # (expires_at, sequence, key)
+        self.sequence = itertools.count()
+        self.lock = threading.RLock()
+        self.evicted = 0
+
+    def add(self, post):
+        """Store a post; returns False if its MESSAGE_ID is already stored."""
+        sequence = next(self.sequence)
+        key = post.get("MESSAGE_ID") or f"local-{sequence}"  # Posts should always have one
+        timestamp = post.get("TIMESTAMP")
+        if not isinstance(timestamp, int):
+            timestamp = int(time.time())
+        ttl = post.get("TTL")
+        if not isinstance(ttl, int):
+            ttl = self.default_ttl
+        author = post.get("USER_ID")
+
+        with self.lock:
+            self._evict_expired()
+            if key in self.posts:
+                return False
+            entry = (timestamp, sequence, key)
+            self.posts[key] = post
+            self.entries[key] = (entry, author)
+            bisect.insort(self.timeline, entry)
+            bisect.insort(self.by_author.setdefault(author, []), entry)
+            heapq.heappush(self.expiry, (timestamp + ttl, sequence, key))
+            return True
+
+    def _remove(self, key):
+        entry, author = self.entries.pop(key)
+        del self.posts[key]
+        del self.timeline[bisect.bisect_left(self.timeline, entry)]
+        author_posts = self.by_author[author]
+        del author_posts[bisect.bisect_left(author_posts, entry)]
+        if not author_posts:
+            del self.by_author[author]
+
+    def _evict_expired(self, now=None):
+        now = time.time() if now is None else now
+        removed = 0
+        expiry = self.expiry
+        while expiry and expiry[0][0] <= now:
+            _, _, key = heapq.heappop(expiry)
+            if key in self.entries:
+                self._remove(key)
+                removed += 1
+        self.evicted += removed
+        return removed
+
+    def evict_expired(self, now=None):
+        """Drop every post whose TTL has run out; returns how many were dropped."""
+        with self.lock:
+            return self._evict_expired(now)
+
+    def get(self, message_id):
+        with self.lock:
+            self._evict_expired()
+            return self.posts.get(message_id)
+
+    def __contains__(self, message_id):
+        return self.get(message_id) is not None
+
+    def __len__(self):
+        with self.lock:
+            self._evict_expired()
+            return len(self.posts)
+
+    def range(self, start=None, end=None, author=None):
+        """Get posts with start <= TIMESTAMP <= end (either bound optional), oldest first."""
+        with self.lock:
+            self._evict_expired()
+            index = self.timeline if author is None else self.by_author.get(author, [])
+            low = 0 if start is None else bisect.bisect_left(index, (start,))
+            high = len(index) if end is None else bisect.bisect_left(index, (end + 1,))
+            return [self.posts[key] for _, _, key in index[low:high]]
+
+    def page(self, offset=0, limit=POST_PAGE_SIZE, authors=None, newest_first=True):
+        """Get one page of the feed, optionally only from the given authors."""
+        with self.lock:
+            self._evict_expired()
+            if authors is None:
+                index = self.timeline
+            else:
+                # Merge the (already sorted) per-author indexes instead of filtering everything
+                index = list(heapq.merge(*(self.by_author.get(author, []) for author in authors)))
+            if newest_first:
+                high = len(index) - offset
+                selected = index[max(0, high - limit):max(0, high)][::-1]
+            else:
+                selected = index[offset:offset + limit]
+            return [self.posts[key] for _, _, key in selected]
+
+    def all(self):
+        """Get every live post, oldest first."""
+        return self.range()
+
+    def get_stats(self):
+        with self.lock:
+            return {"posts": len(self.posts), "authors": len(self.by_author), "evicted": self.evicted}
+
+class expiryEngine:
+    """Central expiry of timestamped state across subsystems, driven by one min-heap.
+
+    track() files an entry under a category (e.g. "file_offers") with its wall-clock
+    expiry and a zero-argument on_expire callback, which removes the item if it still
+    exists and returns True when something was reclaimed. sweep() pops only the due
+    entries, so each item costs O(log n) once over its lifetime however often sweeps
+    run. Structures that keep their own expiry index (e.g. postStore) are added as
+    sweepers instead and report how many items they dropped.
+    """
+    def __init__(self):
+        self.heap = []  # (expires_at, sequence, category, on_expire)
+        self.sequence = itertools.count()
+        self.lock = threading.Lock()
+        self.sweepers = []  # (category, sweep)
+        self.reclaimed = {}  # category -> items reclaimed
+        self.sweeps = 0
+
+    def track(self, category, expires_at, on_expire):
+        """Call on_expire() once time.time() reaches expires_at."""
+        with self.lock:
+            heapq.heappush(self.heap, (expires_at, next(self.sequence), category, on_expire))
+            self.reclaimed.setdefault(category, 0)
+
+    def add_sweeper(self, category, sweep):
+        """Call sweep() on every sweep; it returns how many items it dropped."""
+        with self.lock:
+            self.sweepers.append((category, sweep))
+            self.reclaimed.setdefault(category, 0)
+
+    def sweep(self, now=None):
+        """Expire everything that is due; returns the number of items reclaimed."""
+        now = time.time() if now is None else now
+        due = []
+        with self.lock:
+            while self.heap and self.heap[0][0] <= now:
+                _, _, category, on_expire = heapq.heappop(self.heap)
+                due.append((category, on_expire))
+            sweepers = list(self.sweepers)
+            self.sweeps += 1
+
+        # Callbacks run outside the lock, so they may track new entries
+        counts = {}
+        for category, on_expire in due:
+            if on_expire():
+                counts[category] = counts.get(category, 0) + 1
+        for category, sweep in sweepers:
+            removed = sweep()
+            if removed:
+                counts[category] = counts.get(category, 0) + removed
+
+        with self.lock:
+            for category, count in counts.items():
+                self.reclaimed[category] = self.reclaimed.get(category, 0) + count
+        return sum(counts.values())
+
+    def get_stats(self):
+        """Get the number of tracked entries and items reclaimed per category."""
+        with self.lock:
+            return {"pending": len(self.heap), "sweeps": self.sweeps, "reclaimed": dict(self.reclaimed)}
+
+def backoff_delay(attempt, base=RETRY_TIMEOUT, cap=RETRY_BACKOFF_CAP, jitter=RETRY_JITTER):
+    """Exponential backoff for retry attempt (0 = first wait), capped and randomised.
+
+    The wait is base * 2**attempt (at most cap), scaled by a random factor in
+    [1 - jitter, 1] so peers that lost the same burst don't retry in lockstep.
+    """
+    delay = min(cap, base * (2 ** attempt))
+    return delay * random.uniform(1 - jitter, 1)
+
+class rttEstimator:
+    """Smoothed round-trip time of one peer and the retransmission timeout derived from it (RFC 6298).
+
+    SRTT and RTTVAR are exponentially weighted averages of the samples (alpha 1/8,
+    beta 1/4), and RTO = SRTT + 4 * RTTVAR, clamped to [min_rto, max_rto].
+    Samples must only come from messages that were not retransmitted (Karn's rule),
+    since an ACK for a resent message can't be matched to one transmission.
+    """
+    ALPHA = 0.125
+    BETA = 0.25
+
+    def __init__(self, initial_rto=RTO_INITIAL, min_rto=RTO_MIN, max_rto=RTO_MAX):
+        self.srtt = None
+        self.rttvar = None
+        self.rto = initial_rto
+        self.min_rto = min_rto
+        self.max_rto = max_rto
+        self.samples = 0
+        self.last_sample = None
+
+    def add_sample(self, rtt):
+        """Update the estimate with one measured round trip (seconds) and return the new RTO."""
+        if self.srtt is None:
+            self.srtt = rtt
+            self.rttvar = rtt / 2
+        else:
+            self.rttvar = (1 - self.BETA) * self.rttvar + self.BETA * abs(self.srtt - rtt)
+            self.srtt = (1 - self.ALPHA) * self.srtt + self.ALPHA * rtt
+        self.rto = min(self.max_rto, max(self.min_rto, self.srtt + 4 * self.rttvar))
+        self.samples += 1
+        self.last_sample = rtt
+        return self.rto
+
+    def get_stats(self):
+        """Get the estimate in milliseconds."""
+        return {
+            "srtt_ms": round(self.srtt * 1000, 2) if self.srtt is not None else None,
+            "rttvar_ms": round(self.rttvar * 1000, 2) if self.rttvar is not None else None,
+            "rto_ms": round(self.rto * 1000, 1),
+            "last_sample_ms": round(self.last_sample * 1000, 2) if self.last_sample is not None else None,
+            "samples": self.samples
+        }
+
+class timerHandle:
+    """A scheduled callback; cancel() stops it from running if it hasn't yet."""
+    __slots__ = ("when", "callback", "cancelled")
+
+    def __init__(self, when, callback):
+        self.when = when
+        self.callback = callback
+        self.cancelled = False
+
+    def cancel(self):
+        self.cancelled = True
+
+class timerScheduler:
+    """One thread running callbacks at their due time, kept in a min-heap.
+
+    Scheduling and cancelling are O(log n) / O(1); the thread sleeps until the
+    earliest deadline (millisecond resolution) and only ever touches entries that
+    are due, instead of periodically scanning everything that is pending.
+    Cancelled entries are discarded lazily when they reach the top of the heap.
+    """
+    def __init__(self, name="lsnp-timers"):
+        self.heap = []  # (when, sequence, handle)
+        self.sequence = itertools.count()  # Tie-breaker so handles are never compared
+        self.condition = threading.Condition()
+        self.scheduled = 0
+        self.fired = 0
+        self.cancelled = 0
+        self.max_lateness = 0.0  # seconds between a deadline and its callback starting
+        self.thread = threading.Thread(target=self.run, name=name, daemon=True)
+        self.thread.start()
+
+    def call_later(self, delay, callback):
+        """Run callback() after delay seconds; returns a timerHandle."""
+        handle = timerHandle(time.monotonic() + max(0, delay), callback)
+        with self.condition:
+            heapq.heappush(self.heap, (handle.when, next(self.sequence), handle))
+            self.scheduled += 1
+            # Only wake the thread when the new entry is the next one due
+            if self.heap[0][2] is handle:
+                self.condition.notify()
+        return handle
+
+    def run(self):
+        while True:
+            with self.condition:
+                while True:
+                    if not self.heap:
+                        self.condition.wait()
+                        continue
+                    when, _, handle = self.heap[0]
+                    if handle.cancelled:
+                        heapq.heappop(self.heap)
+                        self.cancelled += 1
+                        continue
+                    delay = when - time.monotonic()
+                    if delay > 0:
+                        self.condition.wait(delay)
+                        continue
+                    heapq.heappop(self.heap)
+                    self.fired += 1
+                    if -delay > self.max_lateness:
+                        self.max_lateness = -delay
+                    break
+            # Outside the lock, so callbacks can schedule further timers
+            try:
+                handle.callback()
+            except Exception as e:
+                print(f"[ERROR] Timer callback failed: {e}")
+
+    def get_stats(self):
+        """Get pending count and scheduled/fired/cancelled counters."""
+        with self.condition:
+            return {
+                "pending": len(self.heap),
+                "scheduled": self.scheduled,
+                "fired": self.fired,
+                "cancelled": self.cancelled,
+                "max_lateness_ms": round(self.max_lateness * 1000, 2)
+            }
@@ -6,16 +6,19 @@ from network_System import networkSystem
 from msg_System import msgSystem
 from file_game import fileGameSystem
 from grp_ui import groupUISystem
+import lsnp_codec
 from vars import *
 
 class LSNPClient:
-    def __init__(self, user_id, display_name, port, verbose=False):
+    def __init__(self, user_id, display_name, port, verbose=False, transport="thread", workers=INGRESS_WORKERS,
+                 rcvbuf=RECV_BUFFER_SIZE, sndbuf=SEND_BUFFER_SIZE):
         self.user_id = user_id
         self.display_name = display_name
         self.verbose = verbose
         self.listen_port = port
         
-        self.networkSystem = networkSystem(port, verbose=verbose)
+        self.networkSystem = networkSystem(port, verbose=verbose, transport=transport, workers=workers,
+                                           rcvbuf=rcvbuf, sndbuf=sndbuf)
         self.fileGameSystem = fileGameSystem(self.networkSystem)
         self.msgSystem = msgSystem(self.networkSystem, self.fileGameSystem)
         self.groupUISystem = groupUISystem(
@@ -69,7 +72,8 @@ class LSNPClient:
             print("24. 👥 Show My Groups")
             print("25. 👥 Show Group Members")
             print("26. 👥 Show Group Messages")
-            print("27. Quit")
+            print("27. Show network stats")
+            print("28. Quit")
 
             choice = input("Enter choice: ").strip()
 
@@ -168,6 +172,9 @@ class LSNPClient:
                 self.show_group_messages()
 
             elif choice == "27":
+                self.show_network_stats()
+
+            elif choice == "28":
                 print("Exiting...")
                 break
 
@@ -184,15 +191,16 @@ class LSNPClient:
             for user_id, info in peers.items():
                 display_name = info.get('display_name', user_id)
                 status = info.get('status', 'Unknown')
-                print(f"  - {display_name} ({user_id}) - {status}")
+                last_seen = self.networkSystem.peers.last_seen(user_id)
+                seen = f" - seen {int(time.time() - last_seen)}s ago" if last_seen else ""
+                print(f"  - {display_name} ({user_id}) - {status}{seen}")
         else:
             print("  No known peers yet")
 
     def show_all_posts(self):
         """Show all valid posts with like counts."""
         print("\n=== All Valid Posts ===")
-        # Clean up any duplicates first
-        post_count = self.msgSystem.clear_duplicate_posts()
+        # The post store drops duplicates on insert and expired posts as it goes
         posts = self.msgSystem.get_all_posts()
         
         if posts:
@@ -203,8 +211,7 @@ class LSNPClient:
                 display_name = self.msgSystem.get_display_name(user_id)
                 
                 # Get like count and likers for this post
-                like_count = self.msgSystem.get_like_count(user_id, timestamp)
-                likers = self.msgSystem.get_post_likers(user_id, timestamp)
+                like_count, likers = self.msgSystem.get_post_likes(user_id, timestamp)
                 
                 # Format like count display
                 if like_count == 0:
@@ -268,12 +275,12 @@ class LSNPClient:
             "STATUS": "Testing LSNP!",
             "BROADCAST": True
         }
-        lsnp_format = self.networkSystem._dict_to_lsnp(message)
+        lsnp_format = lsnp_codec.encode_text(message)
         print("LSNP PROFILE Message:")
         print(lsnp_format)
         
         # Test parsing back
-        parsed = self.networkSystem._lsnp_to_dict(lsnp_format)
+        parsed = lsnp_codec.decode(lsnp_format)
         print("Parsed back to dict:")
         print(parsed)
 
@@ -293,7 +300,7 @@ class LSNPClient:
             "TIMESTAMP": timestamp,
             "BROADCAST": True
         }
-        lsnp_format = self.networkSystem._dict_to_lsnp(message)
+        lsnp_format = lsnp_codec.encode_text(message)
         print("LSNP POST Message:")
         print(lsnp_format)
 
@@ -313,7 +320,7 @@ class LSNPClient:
             "MESSAGE_ID": message_id,
             "TOKEN": f"{self.user_id}|{timestamp + 3600}|{SCOPE_CHAT}"
         }
-        lsnp_format = self.networkSystem._dict_to_lsnp(message)
+        lsnp_format = lsnp_codec.encode_text(message)
         print("LSNP DM Message:")
         print(lsnp_format)
 
@@ -327,7 +334,7 @@ class LSNPClient:
             "LISTEN_PORT": self.listen_port,
             "BROADCAST": True
         }
-        lsnp_format = self.networkSystem._dict_to_lsnp(message)
+        lsnp_format = lsnp_codec.encode_text(message)
         print("LSNP HELLO Message:")
         print(lsnp_format)
 
@@ -736,10 +743,91 @@ class LSNPClient:
         print(f"Valid tokens: {stats['valid']}")
         print(f"Invalid tokens: {stats['invalid']}")
         print(f"Success rate: {stats['success_rate']}%")
+        cache = stats['cache']
+        print(f"Parsed-token cache: {cache['size']}/{cache['maxsize']} tokens, {cache['hits']} hits, {cache['misses']} misses")
         
         if stats['total'] > 0:
             print(f"\nRevoked tokens: {len(self.msgSystem.revoked_tokens)}")
             print(f"Valid messages stored: {len(self.msgSystem.valid_messages)}")
+        
+        dedup_stats = self.msgSystem.get_dedup_stats()
+        print(f"\nProcessed message IDs remembered: {dedup_stats['size']} (cap {dedup_stats['max_entries']}, "
+              f"TTL {dedup_stats['ttl']}s)")
+        print(f"Duplicates suppressed: {dedup_stats['hits']}, new messages: {dedup_stats['misses']}, "
+              f"IDs evicted: {dedup_stats['evictions']}")
+        print(f"Duplicate PROFILE/POST dropped before routing: {dedup_stats['prefilter_drops']}")
+        if dedup_stats['prefilter']:
+            bloom = dedup_stats['prefilter']
+            print(f"Bloom pre-filter: {bloom['memory_bytes']} bytes, {bloom['hashes']} hashes, "
+                  f"target false-positive rate {bloom['error_rate']}, "
+                  f"unconfirmed positives: {dedup_stats['prefilter_unconfirmed']}")
+
+    def show_network_stats(self):
+        """Show network send statistics."""
+        print("\n=== Network Statistics ===")
+        send_stats = self.networkSystem.get_send_stats()
+        
+        print(f"Sender sockets: {send_stats['sockets']}")
+        print(f"Datagrams sent: {send_stats['sends_total']}")
+        print(f"Send errors: {send_stats['send_errors']}")
+        print(f"Sends per second: {send_stats['sends_per_second']}")
+        print(f"Average sends per second: {send_stats['average_sends_per_second']}")
+        
+        ingress_stats = self.networkSystem.get_ingress_stats()
+        print(f"\nHandler workers: {ingress_stats['workers']}")
+        print(f"Queue depths: {ingress_stats['queue_depths']} (capacity {ingress_stats['queue_capacity']} each)")
+        print(f"Queue high-water mark: {ingress_stats['high_water']}")
+        print(f"Datagrams queued: {ingress_stats['enqueued']}")
+        print(f"Datagrams processed: {ingress_stats['processed']}")
+        print(f"Backpressure waits: {ingress_stats['backpressure_waits']}")
+        print(f"Datagrams dropped (queue full): {ingress_stats['dropped']}")
+        
+        io_stats = self.networkSystem.get_io_stats()
+        print(f"\nBatched I/O: {'recvmmsg/sendmmsg' if io_stats['native'] else 'one call per datagram'} "
+              f"(batch size {io_stats['batch_size']})")
+        if io_stats['recv_syscalls_per_datagram'] is not None:
+            print(f"Receive syscalls per datagram: {io_stats['recv_syscalls_per_datagram']}")
+        if io_stats['send_syscalls_per_datagram'] is not None:
+            print(f"Batched send syscalls per datagram: {io_stats['send_syscalls_per_datagram']}")
+        ring_stats = io_stats['recv_ring']
+        print(f"Receive buffers: {ring_stats['free']} free, {ring_stats['in_use']} in use "
+              f"(pool of {ring_stats['size']}, exhausted {ring_stats['exhausted']} times)")
+        
+        timer_stats = self.networkSystem.get_timer_stats()
+        if timer_stats:
+            print(f"\nTimers pending: {timer_stats['pending']} (fired {timer_stats['fired']}, "
+                  f"cancelled {timer_stats['cancelled']}, max lateness {timer_stats['max_lateness_ms']}ms)")
+        peer_stats = self.networkSystem.get_peer_stats()
+        print(f"Peer directory: {peer_stats['peers']} users, {peer_stats['addresses']} addresses "
+              f"({peer_stats['lookups']} lookups, {peer_stats['misses']} not found)")
+        print(f"Messages awaiting ACK: {len(self.msgSystem.pending_acks)}")
+        rtt_table = self.msgSystem.get_rtt_table()
+        if rtt_table:
+            print("\nPeer round-trip times (from ACKs):")
+            for user_id, rtt in sorted(rtt_table.items()):
+                print(f"  {self.msgSystem.get_display_name(user_id):20} srtt={rtt['srtt_ms']}ms rttvar={rtt['rttvar_ms']}ms "
+                      f"rto={rtt['rto_ms']}ms samples={rtt['samples']}")
+        
+        expiry_stats = self.networkSystem.get_expiry_stats()
+        print(f"Expiring items tracked: {expiry_stats['pending']} (swept {expiry_stats['sweeps']} times)")
+        for category, count in sorted(expiry_stats['reclaimed'].items()):
+            print(f"  {category}: {count} reclaimed")
+        
+        handler_stats = self.networkSystem.get_handler_stats()
+        if handler_stats:
+            print("\nHandler latency per message type:")
+            for msg_type, stats in sorted(handler_stats.items()):
+                print(f"  {msg_type:20} n={stats['count']:<7} mean={stats['mean_ms']}ms max={stats['max_ms']}ms")
+                print(f"  {'':20} {' '.join(f'{label}:{count}' for label, count in stats['histogram'].items() if count)}")
+        
+        kernel_stats = self.networkSystem.get_kernel_socket_stats()
+        print(f"\nReceive buffer: {kernel_stats['rcvbuf']} bytes")
+        print(f"Send buffer: {kernel_stats['sndbuf']} bytes")
+        if kernel_stats['kernel_drops'] is not None:
+            print(f"Receive queue: {kernel_stats['rx_queue_bytes']} bytes")
+            print(f"Datagrams dropped by kernel (buffer full): {kernel_stats['kernel_drops']}")
+        else:
+            print("Kernel drop counter: not available on this platform")
 
     def show_valid_messages_log(self):
         """Show log of all messages with valid tokens."""
@@ -1303,6 +1391,11 @@ class LSNPClient:
             
             print(f"   Status: {transfer['status']}")
             print(f"   Progress: {transfer['progress']}")
+            if "throughput_kib_s" in transfer:
+                print(f"   Throughput: {transfer['throughput_kib_s']} KiB/s")
+            if "loss_percent" in transfer:
+                print(f"   Loss: {transfer['loss_percent']}% ({transfer['retransmitted']} chunks resent), "
+                      f"window {transfer['window']} chunks of {transfer['chunk_size']} bytes, RTT {transfer['rtt_ms']}ms")
             print(f"   File ID: {transfer['file_id']}")
             print()
 
@@ -1315,7 +1408,9 @@ class LSNPClient:
             print("💡 Files will appear here after successful file transfers.")
             return
         
-        files = [f for f in os.listdir(downloads_dir) if os.path.isfile(os.path.join(downloads_dir, f))]
+        # Transfers still in progress are .part files
+        files = [f for f in os.listdir(downloads_dir)
+                 if os.path.isfile(os.path.join(downloads_dir, f)) and not f.endswith(".part")]
         
         if not files:
             print("📁 Downloads folder is empty.")
@@ -1841,8 +1936,17 @@ if __name__ == "__main__":
     parser.add_argument('--user-id', required=True, help='User ID (username@ip)')
     parser.add_argument('--display-name', required=True, help='Display name')
     parser.add_argument('--port', type=int, default=LSNP_PORT, help='Port to listen on')
+    parser.add_argument('--transport', choices=['thread', 'asyncio'], default='thread',
+                        help='Network transport: blocking listener thread or asyncio event loop')
+    parser.add_argument('--workers', type=int, default=INGRESS_WORKERS,
+                        help='Message handler worker threads (0 = handle on the listener thread)')
+    parser.add_argument('--rcvbuf', type=int, default=RECV_BUFFER_SIZE,
+                        help='Socket receive buffer size in bytes (0 = OS default)')
+    parser.add_argument('--sndbuf', type=int, default=SEND_BUFFER_SIZE,
+                        help='Socket send buffer size in bytes (0 = OS default)')
     
     args = parser.parse_args()
     
-    client = LSNPClient(args.user_id, args.display_name, args.port, args.verbose)
+    client = LSNPClient(args.user_id, args.display_name, args.port, args.verbose, args.transport, args.workers,
+                        args.rcvbuf, args.sndbuf)
     client.start()
\ No newline at end of file
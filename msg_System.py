@@ -1,36 +1,75 @@
 # Member 2
 
+import threading
 import time
+import os
 import random
 from vars import *
+from lsnp_structs import expiringSet, bloomFilter, backoff_delay, rttEstimator, concurrentDict, postStore, tokenCache, ringBuffer
 
 class msgSystem:
     def __init__(self, netSystem, fileGameSystem):
         self.netSystem = netSystem
         self.fileGameSystem = fileGameSystem
-        self.known_peers = {}  # Store peer information {user_id: {display_name, status, avatar}}
-        self.stored_posts = []  # Store valid posts
+        # Shared dicts are written by the handler workers, timer thread and UI thread (see concurrentDict)
+        self.known_peers = concurrentDict()  # Store peer information {user_id: {display_name, status, avatar}}
+        self.stored_posts = postStore()  # Valid posts, indexed by MESSAGE_ID, author and time; dropped after their TTL
         self.stored_dms = []    # Store DMs
         self.following = set()  # Users we're following
         self.followers = set()  # Users following us
-        self.processed_messages = set()  # Track processed message IDs to prevent duplicates
-        self.last_profile_received = {}  # Track last PROFILE message time per user to prevent spam
-        self.pending_acks = {}  # Track messages waiting for ACK {message_id: {timestamp, retries, message}}
-        self.ack_timeout = 5  # seconds to wait for ACK before retry
+        self.processed_messages = expiringSet()  # Recently processed message IDs (bounded, forgotten after DEDUP_TTL)
+        self.last_profile_received = concurrentDict()  # Track last PROFILE message time per user to prevent spam
+        self.pending_acks = concurrentDict()  # Track messages waiting for ACK {message_id: {timestamp, sent_at, retries, message, target_user, timeout, timer}}
+        self.ack_timeout = RTO_INITIAL  # seconds to wait for the first ACK from peers without RTT samples
+        self.peer_rtt = {}  # RTT estimate per peer, measured from ACK round trips {user_id: rttEstimator}
+        self.rtt_lock = threading.Lock()
         self.acks_sent = 0  # Counter for ACKs sent
         self.acks_received = 0  # Counter for ACKs received
         
         # Like tracking system
-        self.post_likes = {}  # Track likes per post {(user_id, timestamp): {likers: set(), count: int}}
+        self.post_likes = concurrentDict()  # Track likes per post {(user_id, timestamp): {likers: set(), count: int}}
         
         # Group Management
-        self.groups = {}  # Store groups {group_id: {name, members, creator, created_time}}
-        self.group_messages = {}  # Store group messages {group_id: [messages]}
+        self.groups = concurrentDict()  # Store groups {group_id: {name, members, creator, created_time}}
+        self.group_messages = concurrentDict()  # Store group messages {group_id: [messages]}
         
         # Enhanced token validation
         self.revoked_tokens = set()  # Store revoked tokens
-        self.valid_messages = []  # Store all messages with valid token structure
-        self.token_validation_log = []  # Log token validation attempts
+        # Fixed-size logs of messages with valid token structure and of token validation attempts
+        self.valid_messages = ringBuffer(VALID_MESSAGES_LOG_SIZE, self.audit_spill_path("valid_messages.jsonl"))
+        self.token_validation_log = ringBuffer(TOKEN_LOG_SIZE, self.audit_spill_path("token_validation.jsonl"))
+        self.token_cache = tokenCache()  # Parsed tokens; revoking a token invalidates its entry
+        
+        # Handler per message type; the network layer routes all of them to process_incoming_message
+        self.handlers = {
+            MSG_PROFILE: self.handle_profile_message,
+            MSG_POST: self.handle_post_message,
+            MSG_DM: self.handle_dm_message,
+            MSG_PING: self.handle_ping_message,
+            MSG_LIKE: self.handle_like_message,
+            MSG_FOLLOW: self.handle_follow_message,
+            MSG_UNFOLLOW: self.handle_unfollow_message,
+            MSG_ACK: self.handle_ack_message,
+            MSG_REVOKE: self.handle_revoke_message,
+            MSG_GROUP_CREATE: self.handle_group_create_message,
+            MSG_GROUP_UPDATE: self.handle_group_update_message,
+            MSG_GROUP_MESSAGE: self.handle_group_message
+        }
+        self.ack_required_types = frozenset([MSG_DM, MSG_FOLLOW, MSG_UNFOLLOW, MSG_LIKE, MSG_GROUP_CREATE, MSG_GROUP_UPDATE, MSG_GROUP_MESSAGE])
+        for msg_type in self.handlers:
+            self.netSystem.register_handler(msg_type, self.process_incoming_message)
+        
+        # Repeated PROFILE/POST deliveries (unicast + broadcast copies) are dropped on the receive path
+        # before routing. DM, LIKE and GROUP duplicates still reach their handlers to be ACKed again.
+        # An optional Bloom filter can sit in front of the exact set (DEDUP_BLOOM_PREFILTER).
+        self.broadcast_prefilter = bloomFilter() if DEDUP_BLOOM_PREFILTER else None
+        self.prefilter_drops = 0
+        self.prefilter_unconfirmed = 0  # Bloom positives not found in processed_messages
+        for msg_type in (MSG_PROFILE, MSG_POST):
+            self.netSystem.register_prefilter(msg_type, self.is_duplicate_broadcast)
+        
+        # Expired posts are dropped by the network layer's periodic expiry sweep
+        self.netSystem.expiry.add_sweeper("posts", self.stored_posts.evict_expired)
 
     def get_timestamp_str(self):
         """Get formatted timestamp string for logging."""
@@ -126,40 +165,29 @@ class msgSystem:
             message["BROADCAST"] = True
             self.netSystem.send_message(message)
             # Store our own post locally
-            self.stored_posts.append(message)
+            self.stored_posts.add(message)
             return
 
-        # Send to all followers individually (unicast)
-        sent_count = 0
-        failed_count = 0
-        
+        # Send to all followers individually (unicast), batched into as few syscalls as possible
+        targets = []
         for follower_user_id in followers_list:
-            try:
-                # Extract IP from user_id for unicast
-                ip_address = follower_user_id.rsplit('@', 1)[1] if '@' in follower_user_id else "127.0.0.1"
-                target_port = LSNP_PORT
-                
-                # Find the port for this user from known_clients
-                for known_ip, known_port in self.netSystem.known_clients:
-                    if known_ip == ip_address:
-                        target_port = known_port
-                        break
-                
-                self.netSystem.send_message(message, target_ip=ip_address, target_port=target_port)
-                sent_count += 1
-                
+            target = self.resolve_user_address(follower_user_id)
+            if target is None:
                 if self.netSystem.verbose:
-                    display_name = self.get_display_name(follower_user_id)
-                    print(f"{self.get_timestamp_str()} [DEBUG] Sent POST to follower: {display_name} ({follower_user_id})")
-                    
-            except Exception as e:
-                failed_count += 1
-                if self.netSystem.verbose:
-                    display_name = self.get_display_name(follower_user_id)
-                    print(f"{self.get_timestamp_str()} [ERROR] Failed to send POST to {display_name}: {e}")
+                    print(f"{self.get_timestamp_str()} [WARN] No address for follower {follower_user_id}, skipping")
+                continue
+            ip_address, target_port = target
+            targets.append((message, ip_address, target_port))
+            
+            if self.netSystem.verbose:
+                display_name = self.get_display_name(follower_user_id)
+                print(f"{self.get_timestamp_str()} [DEBUG] Sending POST to follower: {display_name} ({follower_user_id})")
+        
+        sent_count = self.netSystem.send_messages(targets)
+        failed_count = len(targets) - sent_count
         
         # Store our own post locally
-        self.stored_posts.append(message)
+        self.stored_posts.add(message)
         
         # Show summary
         print(f"{self.get_timestamp_str()} [POST] Sent to {sent_count}/{len(followers_list)} followers: '{content}'")
@@ -254,63 +282,65 @@ class msgSystem:
         # This helps show like counts locally before the recipient processes the message
         post_key = (to_user, post_timestamp)
         
-        # Initialize post like tracking if not exists
-        if post_key not in self.post_likes:
-            self.post_likes[post_key] = {'likers': set(), 'count': 0}
-        
-        # Handle LIKE/UNLIKE actions locally
-        if action == "LIKE":
-            if self.user_id not in self.post_likes[post_key]['likers']:
-                self.post_likes[post_key]['likers'].add(self.user_id)
-                self.post_likes[post_key]['count'] += 1
-        elif action == "UNLIKE":
-            if self.user_id in self.post_likes[post_key]['likers']:
-                self.post_likes[post_key]['likers'].remove(self.user_id)
-                self.post_likes[post_key]['count'] -= 1
-                # Ensure count doesn't go negative
-                if self.post_likes[post_key]['count'] < 0:
-                    self.post_likes[post_key]['count'] = 0
+        self.apply_like(post_key, self.user_id, action)
         
         display_name = self.get_display_name(to_user)
         print(f"{self.get_timestamp_str()} [LIKE] Sent {action.lower()} to {display_name}'s post")
 
+    def apply_like(self, post_key, liker, action):
+        """Record a LIKE or UNLIKE of a post (post_key: (author, timestamp)) by liker."""
+        with self.post_likes.lock:
+            # Initialize post like tracking if not exists
+            likes = self.post_likes.setdefault(post_key, {'likers': set(), 'count': 0})
+            
+            if action == "LIKE":
+                if liker not in likes['likers']:
+                    likes['likers'].add(liker)
+                    likes['count'] += 1
+            elif action == "UNLIKE":
+                if liker in likes['likers']:
+                    likes['likers'].remove(liker)
+                    # Ensure count doesn't go negative
+                    likes['count'] = max(0, likes['count'] - 1)
+
     def follow_user(self, user_id):
         pass
 
     def unfollow_user(self, user_id):
         pass
 
+    def mark_broadcast_processed(self, message_id):
+        """Remember a processed PROFILE/POST MESSAGE_ID in the exact set and the pre-filter."""
+        self.processed_messages.add(message_id)
+        if self.broadcast_prefilter:
+            self.broadcast_prefilter.add(message_id)
+
+    def is_duplicate_broadcast(self, message):
+        """Receive-path pre-filter: True if a PROFILE/POST was already processed and can be dropped."""
+        message_id = message.get("MESSAGE_ID")
+        if not message_id:
+            return False
+        prefilter = self.broadcast_prefilter
+        if prefilter is not None and message_id not in prefilter:
+            return False
+        # Bloom filters can give false positives; only drop what the exact set confirms
+        if message_id in self.processed_messages:
+            self.prefilter_drops += 1
+            return True
+        if prefilter is not None:
+            self.prefilter_unconfirmed += 1
+        return False
+
     def process_incoming_message(self, message):
         """Process incoming messages and store valid ones."""
         msg_type = message.get("TYPE")
         
-        if msg_type == MSG_PROFILE:
-            self.handle_profile_message(message)
-        elif msg_type == MSG_POST:
-            self.handle_post_message(message)
-        elif msg_type == MSG_DM:
-            self.handle_dm_message(message)
-        elif msg_type == MSG_PING:
-            self.handle_ping_message(message)
-        elif msg_type == MSG_LIKE:
-            self.handle_like_message(message)
-        elif msg_type == MSG_FOLLOW:
-            self.handle_follow_message(message)
-        elif msg_type == MSG_UNFOLLOW:
-            self.handle_unfollow_message(message)
-        elif msg_type == MSG_ACK:
-            self.handle_ack_message(message)
-        elif msg_type == MSG_REVOKE:
-            self.handle_revoke_message(message)
-        elif msg_type == MSG_GROUP_CREATE:
-            self.handle_group_create_message(message)
-        elif msg_type == MSG_GROUP_UPDATE:
-            self.handle_group_update_message(message)
-        elif msg_type == MSG_GROUP_MESSAGE:
-            self.handle_group_message(message)
+        handler = self.handlers.get(msg_type)
+        if handler:
+            handler(message)
         
         # Send ACK for messages that require acknowledgment
-        if msg_type in [MSG_DM, MSG_FOLLOW, MSG_UNFOLLOW, MSG_LIKE, MSG_GROUP_CREATE, MSG_GROUP_UPDATE, MSG_GROUP_MESSAGE] and message.get("MESSAGE_ID"):
+        if msg_type in self.ack_required_types and message.get("MESSAGE_ID"):
             self.send_ack(message)
 
     def handle_profile_message(self, message):
@@ -345,7 +375,7 @@ class msgSystem:
             
             # Mark message as processed
             if message_id:
-                self.processed_messages.add(message_id)
+                self.mark_broadcast_processed(message_id)
             
             # Update last received time for this user
             self.last_profile_received[user_id] = current_time
@@ -357,9 +387,7 @@ class msgSystem:
 
     def handle_post_message(self, message):
         """Handle incoming POST messages."""
-        user_id = message.get("USER_ID")
-        content = message.get("CONTENT")
-        token = message.get("TOKEN")
+        # Read only what the rejection checks need; the rest is decoded if the post is kept
         message_id = message.get("MESSAGE_ID")
         
         # Check for duplicate messages
@@ -369,21 +397,25 @@ class msgSystem:
             return
         
         # Only accept posts from users we're following (or our own posts)
+        user_id = message.get("USER_ID")
         if user_id != self.user_id and user_id not in self.following:
             if self.netSystem.verbose:
                 print(f"[DEBUG] Ignoring POST from non-followed user: {user_id}")
             return
         
+        content = message.get("CONTENT")
+        token = message.get("TOKEN")
+        
         # Enhanced token validation
         if token and self.validate_enhanced_token(token, SCOPE_BROADCAST, message_type="POST"):
-            self.stored_posts.append(message)
+            self.stored_posts.add(message)
             
             # Store as valid message
             self.store_valid_message(message, {'token_valid': True, 'scope': SCOPE_BROADCAST})
             
             # Mark message as processed
             if message_id:
-                self.processed_messages.add(message_id)
+                self.mark_broadcast_processed(message_id)
             
             # Get display name if known
             display_name = self.get_display_name(user_id)
@@ -397,10 +429,10 @@ class msgSystem:
 
     def handle_dm_message(self, message):
         """Handle incoming DM messages."""
+        message_id = message.get("MESSAGE_ID")
         from_user = message.get("FROM")
         to_user = message.get("TO")
         content = message.get("CONTENT")
-        message_id = message.get("MESSAGE_ID")
         token = message.get("TOKEN")
         
         # Check for duplicate messages
@@ -487,15 +519,10 @@ class msgSystem:
     def send_profile_response(self, requesting_user):
         """Send a PROFILE message in response to a PING."""
         try:
-            # Extract IP from user_id for unicast response
-            ip_address = requesting_user.rsplit('@', 1)[1] if '@' in requesting_user else "127.0.0.1"
-            target_port = LSNP_PORT
-            
-            # Find the port for this user from known_clients
-            for known_ip, known_port in self.netSystem.known_clients:
-                if known_ip == ip_address:
-                    target_port = known_port
-                    break
+            target = self.resolve_user_address(requesting_user)
+            if target is None:
+                return
+            ip_address, target_port = target
             
             message = {
                 "TYPE": MSG_PROFILE,
@@ -536,22 +563,7 @@ class msgSystem:
         if post_timestamp and to_user:
             post_key = (to_user, post_timestamp)
             
-            # Initialize post like tracking if not exists
-            if post_key not in self.post_likes:
-                self.post_likes[post_key] = {'likers': set(), 'count': 0}
-            
-            # Handle LIKE/UNLIKE actions
-            if action == "LIKE":
-                if from_user not in self.post_likes[post_key]['likers']:
-                    self.post_likes[post_key]['likers'].add(from_user)
-                    self.post_likes[post_key]['count'] += 1
-            elif action == "UNLIKE":
-                if from_user in self.post_likes[post_key]['likers']:
-                    self.post_likes[post_key]['likers'].remove(from_user)
-                    self.post_likes[post_key]['count'] -= 1
-                    # Ensure count doesn't go negative
-                    if self.post_likes[post_key]['count'] < 0:
-                        self.post_likes[post_key]['count'] = 0
+            self.apply_like(post_key, from_user, action)
         
         display_name = self.get_display_name(from_user)
         print(f"{self.get_timestamp_str()} [LIKE] {display_name} {action.lower()}d your post")
@@ -620,16 +632,12 @@ class msgSystem:
         }
         
         try:
-            # Extract IP from user_id for unicast
-            ip_address = from_user.rsplit('@', 1)[1] if '@' in from_user else "127.0.0.1"
-            target_port = LSNP_PORT
-            
-            # Find the port for this user from known_clients
-            for known_ip, known_port in self.netSystem.known_clients:
-                if known_ip == ip_address:
-                    target_port = known_port
-                    break
-            
+            target = self.resolve_user_address(from_user)
+            if target is None:
+                if self.netSystem.verbose:
+                    print(f"{self.get_timestamp_str()} [WARN] No address for {from_user}, ACK for {message_id} not sent")
+                return
+            ip_address, target_port = target
             self.netSystem.send_message(ack_message, target_ip=ip_address, target_port=target_port)
             
             self.acks_sent += 1  # Increment counter
@@ -646,9 +654,14 @@ class msgSystem:
         ack_message_id = message.get("ACK_MESSAGE_ID")
         from_user = message.get("FROM")
         
-        if ack_message_id and ack_message_id in self.pending_acks:
-            # Remove from pending ACKs
-            del self.pending_acks[ack_message_id]
+        # Remove from pending ACKs and stop its retry timer
+        ack_info = self.pending_acks.pop(ack_message_id, None) if ack_message_id else None
+        if ack_info:
+            ack_info['timer'].cancel()
+            
+            # Karn's rule: a retransmitted message's ACK can't be matched to one send, so it is no sample
+            if ack_info['retries'] == 0:
+                self.add_rtt_sample(ack_info['target_user'], time.monotonic() - ack_info['sent_at'])
             
             self.acks_received += 1  # Increment counter
             
@@ -656,30 +669,68 @@ class msgSystem:
                 display_name = self.get_display_name(from_user)
                 print(f"{self.get_timestamp_str()} [ACK] Received ACK from {display_name} for message {ack_message_id}")
 
+    def resolve_user_address(self, user_id):
+        """Get the (ip, port) to unicast to a user from the peer directory, or None for an unknown bare name."""
+        return self.netSystem.peers.resolve(user_id)
+
+    def add_rtt_sample(self, user_id, rtt):
+        """Fold one measured ACK round trip (seconds) into the peer's RTT estimate."""
+        with self.rtt_lock:
+            estimator = self.peer_rtt.get(user_id)
+            if estimator is None:
+                estimator = self.peer_rtt[user_id] = rttEstimator(initial_rto=self.ack_timeout)
+            estimator.add_sample(rtt)
+
+    def get_rto(self, user_id):
+        """Get the retransmission timeout for a peer: SRTT + 4 * RTTVAR, or ack_timeout before any sample."""
+        estimator = self.peer_rtt.get(user_id)
+        return estimator.rto if estimator else self.ack_timeout
+
+    def get_rtt_table(self):
+        """Get the RTT estimate and current retransmission timeout of every peer that has ACKed us."""
+        with self.rtt_lock:
+            return {user_id: estimator.get_stats() for user_id, estimator in self.peer_rtt.items()}
+
+    def track_ack(self, message_id, message, target_user_id, timeout=None):
+        """Wait for an ACK of message_id, resending message to target_user_id with backoff until it arrives.
+
+        The first retry happens after timeout seconds (default: the peer's RTT-based RTO); each later
+        wait doubles, with jitter, up to MAX_RETRIES retries. Used for DMs, follows, likes and game messages.
+        """
+        timeout = timeout or self.get_rto(target_user_id)
+        previous = self.pending_acks.get(message_id)
+        if previous:
+            previous['timer'].cancel()
+        self.pending_acks[message_id] = {
+            'timestamp': int(time.time()),
+            'sent_at': time.monotonic(),
+            'retries': 0,
+            'message': message.copy(),
+            'target_user': target_user_id,
+            'timeout': timeout,
+            'timer': self.netSystem.call_later(timeout, lambda: self.on_ack_timeout(message_id))
+        }
+
+    def cancel_ack(self, message_id):
+        """Stop waiting for an ACK of message_id."""
+        ack_info = self.pending_acks.pop(message_id, None)
+        if ack_info:
+            ack_info['timer'].cancel()
+
     def send_message_with_ack(self, message, target_user_id):
         """Send a message and track it for ACK."""
         message_id = message.get("MESSAGE_ID")
         
         # Store in pending ACKs
         if message_id:
-            self.pending_acks[message_id] = {
-                'timestamp': int(time.time()),
-                'retries': 0,
-                'message': message.copy(),
-                'target_user': target_user_id
-            }
+            self.track_ack(message_id, message, target_user_id)
         
         # Send the message normally
         try:
-            ip_address = target_user_id.rsplit('@', 1)[1] if '@' in target_user_id else "127.0.0.1"
-            target_port = LSNP_PORT
-            
-            # Find the port for this user from known_clients
-            for known_ip, known_port in self.netSystem.known_clients:
-                if known_ip == ip_address:
-                    target_port = known_port
-                    break
-            
+            target = self.resolve_user_address(target_user_id)
+            if target is None:
+                raise LookupError(f"no address for {target_user_id}")
+            ip_address, target_port = target
             self.netSystem.send_message(message, target_ip=ip_address, target_port=target_port)
             
             if self.netSystem.verbose:
@@ -689,60 +740,48 @@ class msgSystem:
             if self.netSystem.verbose:
                 print(f"{self.get_timestamp_str()} [ERROR] Failed to send message with ACK: {e}")
             # Remove from pending if send failed
-            if message_id in self.pending_acks:
-                del self.pending_acks[message_id]
+            self.cancel_ack(message_id)
 
-    def check_pending_acks(self):
-        """Check for pending ACKs that need retry or timeout."""
-        current_time = int(time.time())
-        to_retry = []
-        to_remove = []
+    def on_ack_timeout(self, message_id):
+        """Timer callback: the ACK for message_id is overdue, so resend it or give up."""
+        ack_info = self.pending_acks.get(message_id)
+        if not ack_info:
+            return  # ACKed in the meantime
+        
+        if ack_info['retries'] >= MAX_RETRIES:
+            # Give up after max retries
+            self.pending_acks.pop(message_id, None)
+            if self.netSystem.verbose:
+                print(f"{self.get_timestamp_str()} [ACK] Message {message_id} failed after {MAX_RETRIES} retries")
+            return
         
-        for message_id, ack_info in self.pending_acks.items():
-            time_elapsed = current_time - ack_info['timestamp']
-            
-            if time_elapsed > self.ack_timeout:
-                if ack_info['retries'] < MAX_RETRIES:
-                    # Retry the message
-                    to_retry.append((message_id, ack_info))
-                else:
-                    # Give up after max retries
-                    to_remove.append(message_id)
-                    if self.netSystem.verbose:
-                        print(f"{self.get_timestamp_str()} [ACK] Message {message_id} failed after {MAX_RETRIES} retries")
-        
-        # Retry messages
-        for message_id, ack_info in to_retry:
-            ack_info['retries'] += 1
-            ack_info['timestamp'] = current_time
-            
-            # Resend the exact same message (don't call send_message_with_ack again)
-            try:
-                # Resolve target IP from user ID
-                target_user_id = ack_info['target_user']
-                ip_address = target_user_id.rsplit('@', 1)[1] if '@' in target_user_id else "127.0.0.1"
-                target_port = 50999  # Default LSNP port
-                
-                # Check if we have a known port for this IP
-                for known_ip, known_port in self.netSystem.known_clients:
-                    if known_ip == ip_address:
-                        target_port = known_port
-                        break
-                
+        ack_info['retries'] += 1
+        ack_info['timestamp'] = int(time.time())
+        
+        # Resend the exact same message (don't call send_message_with_ack again)
+        try:
+            target_user_id = ack_info['target_user']
+            if ack_info['message'].get("BROADCAST"):
+                # Sent as a broadcast because the target had no address: retry the same way
+                self.netSystem.send_message(ack_info['message'])
+            else:
+                target = self.resolve_user_address(target_user_id)
+                if target is None:
+                    raise LookupError(f"no address for {target_user_id}")
+                ip_address, target_port = target
                 self.netSystem.send_message(ack_info['message'], target_ip=ip_address, target_port=target_port)
-                
-                if self.netSystem.verbose:
-                    print(f"{self.get_timestamp_str()} [RETRY] Resent message {message_id} to {target_user_id} (attempt {ack_info['retries']})")
-                    
-            except Exception as e:
-                if self.netSystem.verbose:
-                    print(f"{self.get_timestamp_str()} [ERROR] Failed to retry message {message_id}: {e}")
-                # Add to removal list if retry fails
-                to_remove.append(message_id)
             
-        # Remove failed messages
-        for message_id in to_remove:
-            del self.pending_acks[message_id]
+            if self.netSystem.verbose:
+                print(f"{self.get_timestamp_str()} [RETRY] Resent message {message_id} to {target_user_id} (attempt {ack_info['retries']})")
+                
+        except Exception as e:
+            if self.netSystem.verbose:
+                print(f"{self.get_timestamp_str()} [ERROR] Failed to retry message {message_id}: {e}")
+            self.pending_acks.pop(message_id, None)
+            return
+        
+        delay = backoff_delay(ack_info['retries'], base=ack_info['timeout'])
+        ack_info['timer'] = self.netSystem.call_later(delay, lambda: self.on_ack_timeout(message_id))
 
     def validate_basic_token(self, token):
         """Basic token validation - checks format and expiration."""
@@ -759,80 +798,50 @@ class msgSystem:
         except:
             return False
 
+    def token_belongs_to(self, token, user_id):
+        """Check that token is an unexpired, unrevoked token of user_id (any scope)."""
+        parsed = self.token_cache.get(token, self.revoked_tokens)
+        return (parsed.__class__ is not str and parsed.user_id == user_id
+                and parsed.expiry > time.time() and not parsed.revoked)
+
     def validate_enhanced_token(self, token, required_scope, sender_ip=None, message_type=None):
         """Enhanced token validation - checks format, expiration, scope, and revocation."""
         timestamp = int(time.time())
-        validation_result = {
-            'valid': False,
-            'reason': '',
+        
+        try:
+            # Format, expiry and scope are parsed once per distinct token
+            parsed = self.token_cache.get(token, self.revoked_tokens)
+            
+            if parsed.__class__ is str:
+                reason = parsed
+            elif parsed.expiry <= timestamp:
+                reason = 'Token expired'
+            elif parsed.scope != required_scope:
+                reason = f'Scope mismatch: got {parsed.scope}, required {required_scope}'
+            elif parsed.revoked:
+                reason = 'Token is revoked'
+            elif sender_ip and parsed.ip is not None and parsed.ip != sender_ip:
+                # Verify sender IP matches token user_id (if provided)
+                reason = f'IP mismatch: token IP {parsed.ip}, sender IP {sender_ip}'
+            else:
+                reason = None
+        except Exception as e:
+            reason = f'Validation error: {str(e)}'
+        
+        self.log_token_validation({
+            'valid': reason is None,
+            'reason': reason or 'Valid token',
             'timestamp': timestamp,
             'token': token,
             'required_scope': required_scope,
             'sender_ip': sender_ip,
             'message_type': message_type
-        }
-        
-        try:
-            # Check token format
-            parts = token.split('|')
-            if len(parts) != 3:
-                validation_result['reason'] = 'Invalid token format'
-                self.log_token_validation(validation_result)
-                return False
-            
-            user_id, expiry_str, token_scope = parts
-            
-            # Check expiration
-            try:
-                expiry = int(expiry_str)
-                current_time = int(time.time())
-                if expiry <= current_time:
-                    validation_result['reason'] = 'Token expired'
-                    self.log_token_validation(validation_result)
-                    return False
-            except ValueError:
-                validation_result['reason'] = 'Invalid expiry timestamp'
-                self.log_token_validation(validation_result)
-                return False
-            
-            # Check scope match
-            if token_scope != required_scope:
-                validation_result['reason'] = f'Scope mismatch: got {token_scope}, required {required_scope}'
-                self.log_token_validation(validation_result)
-                return False
-            
-            # Check revocation status
-            if token in self.revoked_tokens:
-                validation_result['reason'] = 'Token is revoked'
-                self.log_token_validation(validation_result)
-                return False
-            
-            # Verify sender IP matches token user_id (if provided)
-            if sender_ip and '@' in user_id:
-                token_ip = user_id.split('@')[1]
-                if token_ip != sender_ip:
-                    validation_result['reason'] = f'IP mismatch: token IP {token_ip}, sender IP {sender_ip}'
-                    self.log_token_validation(validation_result)
-                    return False
-            
-            # Token is valid
-            validation_result['valid'] = True
-            validation_result['reason'] = 'Valid token'
-            self.log_token_validation(validation_result)
-            return True
-            
-        except Exception as e:
-            validation_result['reason'] = f'Validation error: {str(e)}'
-            self.log_token_validation(validation_result)
-            return False
+        })
+        return reason is None
 
     def log_token_validation(self, validation_result):
         """Log token validation attempts for debugging and security auditing."""
-        self.token_validation_log.append(validation_result)
-        
-        # Keep only last 100 validation attempts to prevent memory bloat
-        if len(self.token_validation_log) > 100:
-            self.token_validation_log = self.token_validation_log[-100:]
+        self.token_validation_log.append(validation_result)  # The oldest attempt drops off (or spills to disk) once full
         
         if self.netSystem.verbose:
             status = "✓ VALID" if validation_result['valid'] else "✗ INVALID"
@@ -841,13 +850,30 @@ class msgSystem:
     def revoke_token(self, token, reason="Manual revocation"):
         """Revoke a token to prevent future use."""
         self.revoked_tokens.add(token)
+        self.token_cache.invalidate(token)
+        
+        # Once the token has expired on its own it is rejected anyway, so stop remembering it then
+        try:
+            expiry = int(token.split('|')[1])
+            self.netSystem.expiry.track("revoked_tokens", expiry, lambda: self.forget_revoked_token(token))
+        except (IndexError, ValueError):
+            pass  # Malformed tokens never validate; keep them revoked
+        
         if self.netSystem.verbose:
             print(f"{self.get_timestamp_str()} [TOKEN] Revoked token: {token[:20]}... (reason: {reason})")
 
+    def forget_revoked_token(self, token):
+        """Drop an expired token from the revocation list; returns True if it was there."""
+        if token in self.revoked_tokens:
+            self.revoked_tokens.discard(token)
+            self.token_cache.invalidate(token)
+            return True
+        return False
+
     def get_token_validation_stats(self):
         """Get statistics about token validation."""
         if not self.token_validation_log:
-            return {"total": 0, "valid": 0, "invalid": 0, "success_rate": 0}
+            return {"total": 0, "valid": 0, "invalid": 0, "success_rate": 0, "cache": self.token_cache.get_stats()}
         
         total = len(self.token_validation_log)
         valid = sum(1 for v in self.token_validation_log if v['valid'])
@@ -858,9 +884,18 @@ class msgSystem:
             "total": total,
             "valid": valid,
             "invalid": invalid,
-            "success_rate": round(success_rate, 2)
+            "success_rate": round(success_rate, 2),
+            "cache": self.token_cache.get_stats()
         }
 
+    def get_dedup_stats(self):
+        """Get size and hit/miss/eviction counters of the duplicate filter (and its pre-filter, if enabled)."""
+        stats = self.processed_messages.get_stats()
+        stats["prefilter"] = self.broadcast_prefilter.get_stats() if self.broadcast_prefilter else None
+        stats["prefilter_drops"] = self.prefilter_drops
+        stats["prefilter_unconfirmed"] = self.prefilter_unconfirmed
+        return stats
+
     def store_valid_message(self, message, validation_info=None):
         """Store messages with valid token structure for analysis."""
         stored_entry = {
@@ -868,11 +903,11 @@ class msgSystem:
             'timestamp': int(time.time()),
             'validation_info': validation_info
         }
-        self.valid_messages.append(stored_entry)
-        
-        # Keep only last 200 valid messages to prevent memory bloat
-        if len(self.valid_messages) > 200:
-            self.valid_messages = self.valid_messages[-200:]
+        self.valid_messages.append(stored_entry)  # The oldest entry drops off (or spills to disk) once full
+
+    def audit_spill_path(self, filename):
+        """Where a log spills rotated-out entries, or None when AUDIT_SPILL_DIR is not set."""
+        return os.path.join(AUDIT_SPILL_DIR, filename) if AUDIT_SPILL_DIR else None
 
     def get_valid_messages(self):
         """Get all stored messages with valid tokens."""
@@ -883,57 +918,46 @@ class msgSystem:
 
     def start_ping_broadcast(self):  # Every 5 minutes
         """Start periodic PROFILE broadcasting for presence."""
-        import threading
-        
-        def broadcast_profile():
-            while True:
-                time.sleep(BROADCAST_INTERVAL)  # 30 seconds from vars.py
-                if hasattr(self, 'user_id'):
-                    # Alternate between PING and PROFILE broadcasts
-                    import random
-                    if random.choice([True, False]):
-                        # Send PING message
-                        ping_message = {
-                            "TYPE": MSG_PING,
-                            "USER_ID": self.user_id,
-                            "BROADCAST": True
-                        }
-                        self.netSystem.send_message(ping_message)
-                        if self.netSystem.verbose:
-                            print(f"[BROADCAST] Sent PING")
-                    else:
-                        # Re-broadcast PROFILE for presence
-                        message = {
-                            "TYPE": MSG_PROFILE,
-                            "USER_ID": self.user_id,
-                            "DISPLAY_NAME": self.display_name,
-                            "STATUS": self.status,
-                            "LISTEN_PORT": self.netSystem.port,  # Include our listening port
-                            "BROADCAST": True
-                        }
-                        self.netSystem.send_message(message)
-                        if self.netSystem.verbose:
-                            print(f"[BROADCAST] Sent periodic PROFILE update")
-        
-        def ack_monitor():
-            """Monitor pending ACKs and retry failed messages."""
-            while True:
-                time.sleep(1)  # Check every second
-                self.check_pending_acks()
-        
-        # Start background thread for periodic broadcasting
-        thread = threading.Thread(target=broadcast_profile, daemon=True)
-        thread.start()
-        
-        # Start ACK monitoring thread
-        ack_thread = threading.Thread(target=ack_monitor, daemon=True)
-        ack_thread.start()
+        # Timers run on the network transport (threads, or the asyncio event loop)
+        self.netSystem.schedule_periodic(BROADCAST_INTERVAL, self.broadcast_presence)
+        # ACK retries need no monitor: each tracked message has its own timer (see track_ack)
+
+    def broadcast_presence(self):
+        """Broadcast a PING or PROFILE message to announce our presence."""
+        if not hasattr(self, 'user_id'):
+            return
+        
+        # Alternate between PING and PROFILE broadcasts
+        if random.choice([True, False]):
+            # Send PING message
+            ping_message = {
+                "TYPE": MSG_PING,
+                "USER_ID": self.user_id,
+                "BROADCAST": True
+            }
+            self.netSystem.send_message(ping_message)
+            if self.netSystem.verbose:
+                print(f"[BROADCAST] Sent PING")
+        else:
+            # Re-broadcast PROFILE for presence
+            message = {
+                "TYPE": MSG_PROFILE,
+                "USER_ID": self.user_id,
+                "DISPLAY_NAME": self.display_name,
+                "STATUS": self.status,
+                "LISTEN_PORT": self.netSystem.port,  # Include our listening port
+                "BROADCAST": True
+            }
+            self.netSystem.send_message(message)
+            if self.netSystem.verbose:
+                print(f"[BROADCAST] Sent periodic PROFILE update")
 
     def get_known_peers(self):
         pass
 
-    def get_user_posts(self, user_id):
-        pass
+    def get_user_posts(self, user_id, start=None, end=None):
+        """Get a user's live posts, oldest first, optionally within a TIMESTAMP range."""
+        return self.stored_posts.range(start, end, author=user_id)
 
     def is_following(self, user_id):
         pass
@@ -961,24 +985,21 @@ class msgSystem:
         return self.known_peers
 
     def get_all_posts(self):  # Show all valid posts
-        """Get all stored valid posts."""
-        return self.stored_posts
-    
-    def clear_duplicate_posts(self):
-        """Remove duplicate posts based on MESSAGE_ID."""
-        seen_ids = set()
-        unique_posts = []
-        
-        for post in self.stored_posts:
-            msg_id = post.get("MESSAGE_ID")
-            if msg_id and msg_id not in seen_ids:
-                seen_ids.add(msg_id)
-                unique_posts.append(post)
-            elif not msg_id:  # Keep posts without MESSAGE_ID (shouldn't happen but just in case)
-                unique_posts.append(post)
-                
-        self.stored_posts = unique_posts
-        return len(self.stored_posts)
+        """Get all stored valid posts, oldest first."""
+        return self.stored_posts.all()
+
+    def get_feed(self, page=0, page_size=POST_PAGE_SIZE, following_only=False):
+        """Get one page of posts, newest first."""
+        authors = self.get_following_list() + [self.user_id] if following_only else None
+        return self.stored_posts.page(page * page_size, page_size, authors=authors)
+
+    def get_post_likes(self, user_id, timestamp):
+        """Get (like count, likers) for a post in one lookup."""
+        with self.post_likes.lock:
+            likes = self.post_likes.get((user_id, timestamp))
+            if likes is None:
+                return 0, []
+            return likes['count'], list(likes['likers'])
 
     def get_like_count(self, user_id, timestamp):
         """Get the number of likes for a specific post."""
@@ -990,8 +1011,9 @@ class msgSystem:
     def get_post_likers(self, user_id, timestamp):
         """Get the list of users who liked a specific post."""
         post_key = (user_id, timestamp)
-        if post_key in self.post_likes:
-            return list(self.post_likes[post_key]['likers'])
+        with self.post_likes.lock:
+            if post_key in self.post_likes:
+                return list(self.post_likes[post_key]['likers'])
         return []
 
     def get_all_dms(self):  # Show all DMs
@@ -1037,7 +1059,8 @@ class msgSystem:
         pass
 
     def filter_posts_by_following(self):  # Only show posts from followed users
-        pass
+        """Get live posts by users we follow, oldest first."""
+        return self.stored_posts.page(0, len(self.stored_posts), authors=self.get_following_list(), newest_first=False)
 
     def get_peer_status(self, user_id):
         pass
@@ -1046,26 +1069,25 @@ class msgSystem:
     
     def create_group(self, group_id, group_name, members):
         """Create a new group and send GROUP_CREATE message to all members."""
-        # Validate group_id is unique locally
-        if group_id in self.groups:
-            print(f"❌ Group '{group_id}' already exists.")
-            return False
-        
         # Ensure creator is in members list
         if self.user_id not in members:
             members.append(self.user_id)
         
-        # Store group locally
+        # Validate group_id is unique locally and store the group in one step
         timestamp = int(time.time())
-        self.groups[group_id] = {
-            'name': group_name,
-            'members': members,
-            'creator': self.user_id,
-            'created_time': timestamp
-        }
-        
-        # Initialize message storage for this group
-        self.group_messages[group_id] = []
+        with self.groups.lock:
+            if group_id in self.groups:
+                print(f"❌ Group '{group_id}' already exists.")
+                return False
+            self.groups[group_id] = {
+                'name': group_name,
+                'members': members,
+                'creator': self.user_id,
+                'created_time': timestamp
+            }
+            
+            # Initialize message storage for this group
+            self.group_messages[group_id] = []
         
         # Create GROUP_CREATE message
         message_id = f"{random.getrandbits(64):016x}"
@@ -1090,31 +1112,31 @@ class msgSystem:
     
     def update_group(self, group_id, add_members=None, remove_members=None):
         """Update group membership and send GROUP_UPDATE message."""
-        if group_id not in self.groups:
+        group = self.groups.get(group_id)
+        if group is None:
             print(f"❌ Group '{group_id}' not found.")
             return False
         
-        group = self.groups[group_id]
-        
         # Check if user is the group creator (only creators can update groups)
         if self.user_id != group['creator']:
             print(f"❌ Only the group creator can update group '{group_id}'.")
             return False
         
-        # Store original member list before changes for notification
-        original_members = group['members'].copy()
-        
-        # Process additions
-        if add_members:
-            for member in add_members:
-                if member not in group['members']:
-                    group['members'].append(member)
-        
-        # Process removals
-        if remove_members:
-            for member in remove_members:
-                if member in group['members'] and member != group['creator']:
-                    group['members'].remove(member)
+        with self.groups.lock:
+            # Store original member list before changes for notification
+            original_members = group['members'].copy()
+            
+            # Process additions
+            if add_members:
+                for member in add_members:
+                    if member not in group['members']:
+                        group['members'].append(member)
+            
+            # Process removals
+            if remove_members:
+                for member in remove_members:
+                    if member in group['members'] and member != group['creator']:
+                        group['members'].remove(member)
         
         # Create GROUP_UPDATE message
         timestamp = int(time.time())
@@ -1165,12 +1187,11 @@ class msgSystem:
     
     def send_group_message(self, group_id, content):
         """Send a message to all members of a group."""
-        if group_id not in self.groups:
+        group = self.groups.get(group_id)
+        if group is None:
             print(f"❌ Group '{group_id}' not found.")
             return False
         
-        group = self.groups[group_id]
-        
         # Check if user is a member
         if self.user_id not in group['members']:
             print(f"❌ You are not a member of group '{group_id}'.")
@@ -1190,12 +1211,12 @@ class msgSystem:
         }
         
         # Send to all members except self
-        for member in group['members']:
+        for member in list(group['members']):
             if member != self.user_id:
                 self.send_message_to_user(message, member)
         
         # Store message locally for our own record
-        self.group_messages[group_id].append({
+        self.group_messages.setdefault(group_id, []).append({
             'from': self.user_id,
             'content': content,
             'timestamp': timestamp,
@@ -1270,12 +1291,11 @@ class msgSystem:
             return
         
         # Check if group exists  
-        if group_id not in self.groups:
+        group = self.groups.get(group_id)
+        if group is None:
             if self.netSystem.verbose:
                 print(f"[DEBUG] Unknown group {group_id}")
             return
-
-        group = self.groups[group_id]
         
         # Check if we're affected by this update (either current member or being added/removed)
         is_current_member = self.user_id in group['members']
@@ -1288,25 +1308,25 @@ class msgSystem:
             return
         
         # Process updates
-        if add_members_str:
-            add_members = [m.strip() for m in add_members_str.split(",") if m.strip()]
-            for member in add_members:
-                if member not in group['members']:
-                    group['members'].append(member)
-        
-        if remove_members_str:
-            remove_members = [m.strip() for m in remove_members_str.split(",") if m.strip()]
-            for member in remove_members:
-                if member in group['members'] and member != group['creator']:
-                    group['members'].remove(member)
-                    # If we were removed, clean up our local group data
-                    if member == self.user_id:
-                        print(f"❌ You have been removed from group \"{group['name']}\"")
-                        # Remove group from our local storage
-                        del self.groups[group_id]
-                        if group_id in self.group_messages:
-                            del self.group_messages[group_id]
-                        return  # Don't process further since we're no longer in the group
+        with self.groups.lock:
+            if add_members_str:
+                add_members = [m.strip() for m in add_members_str.split(",") if m.strip()]
+                for member in add_members:
+                    if member not in group['members']:
+                        group['members'].append(member)
+            
+            if remove_members_str:
+                remove_members = [m.strip() for m in remove_members_str.split(",") if m.strip()]
+                for member in remove_members:
+                    if member in group['members'] and member != group['creator']:
+                        group['members'].remove(member)
+                        # If we were removed, clean up our local group data
+                        if member == self.user_id:
+                            print(f"❌ You have been removed from group \"{group['name']}\"")
+                            # Remove group from our local storage
+                            self.groups.pop(group_id, None)
+                            self.group_messages.pop(group_id, None)
+                            return  # Don't process further since we're no longer in the group
         
         # Store valid message
         self.store_valid_message(message, {'token_valid': True, 'scope': SCOPE_GROUP})
@@ -1331,19 +1351,19 @@ class msgSystem:
             return
         
         # Check if group exists and we're a member
-        if group_id not in self.groups:
+        group = self.groups.get(group_id)
+        if group is None:
             if self.netSystem.verbose:
                 print(f"[DEBUG] Unknown group {group_id}")
             return
         
-        group = self.groups[group_id]
         if self.user_id not in group['members']:
             if self.netSystem.verbose:
                 print(f"[DEBUG] Not a member of group {group_id}")
             return
         
         # Store message
-        self.group_messages[group_id].append({
+        self.group_messages.setdefault(group_id, []).append({
             'from': from_user,
             'content': content,
             'timestamp': timestamp,
@@ -1365,7 +1385,7 @@ class msgSystem:
                 user_groups.append({
                     'group_id': group_id,
                     'name': group_data['name'],
-                    'members': group_data['members'],
+                    'members': list(group_data['members']),
                     'creator': group_data['creator'],
                     'member_count': len(group_data['members'])
                 })
@@ -1373,26 +1393,29 @@ class msgSystem:
     
     def get_group_members(self, group_id):
         """Get members of a specific group."""
-        if group_id not in self.groups:
+        group = self.groups.get(group_id)
+        if group is None:
             return None
-        return self.groups[group_id]['members']
+        return list(group['members'])
     
     def get_group_messages(self, group_id):
         """Get messages for a specific group."""
-        if group_id not in self.group_messages:
-            return []
-        return self.group_messages[group_id]
+        return list(self.group_messages.get(group_id, []))
     
     def send_message_to_user(self, message, target_user):
         """Send a message to a specific user via unicast."""
         try:
-            # Extract IP from user_id
-            target_ip = target_user.split('@')[-1] if '@' in target_user else "127.0.0.1"
+            target = self.resolve_user_address(target_user)
+            if target is None:
+                if self.netSystem.verbose:
+                    print(f"[WARN] No address for {target_user}, {message.get('TYPE')} not sent")
+                return
+            target_ip, target_port = target
             
             if self.netSystem.verbose:
-                print(f"[DEBUG] Sending {message.get('TYPE')} message to {target_user} at {target_ip}")
+                print(f"[DEBUG] Sending {message.get('TYPE')} message to {target_user} at {target_ip}:{target_port}")
             
-            self.netSystem.send_message(message, target_ip=target_ip, target_port=LSNP_PORT)
+            self.netSystem.send_message(message, target_ip=target_ip, target_port=target_port)
         except Exception as e:
             if self.netSystem.verbose:
                 print(f"[ERROR] Failed to send message to {target_user}: {e}")
@@ -1,21 +1,125 @@
 # Member 1
 import threading
+import asyncio
+import bisect
+import itertools
+import queue
 import time
 import socket
+import struct
+import sys
+import os
+from collections.abc import Mapping
+
+try:
+    import fcntl  # Not available on Windows
+except ImportError:
+    fcntl = None
 
 from vars import *
+from batch_io import batchSocketIO, bufferRing
+from lsnp_structs import timerScheduler, timerHandle, expiryEngine, peerDirectory
+import lsnp_codec
+
+SIOCGIFADDR = 0x8915  # Linux ioctl for an interface's IPv4 address
+IP_MTU = getattr(socket, "IP_MTU", 14 if sys.platform.startswith("linux") else None)  # Path MTU of a connected socket
+
+TRANSPORT_THREAD = "thread"
+TRANSPORT_ASYNCIO = "asyncio"
+
+class lsnpDatagramProtocol(asyncio.DatagramProtocol):
+    """asyncio protocol that hands received datagrams to the network system."""
+    def __init__(self, netSystem):
+        self.netSystem = netSystem
+
+    def connection_made(self, transport):
+        self.netSystem.async_transport = transport
+
+    def datagram_received(self, data, addr):
+        self.netSystem.handle_datagram(data, addr)
+
+    def error_received(self, exc):
+        # A failed sendto surfaces here, after the send was already counted
+        self.netSystem._record_sends(0, 1)
+        if self.netSystem.verbose:
+            print(f"{self.netSystem.get_timestamp_str()}[ERROR] Transport error: {exc}")
 
 class networkSystem: # NOTE: Should probs pass the ui class here to acomplish printing as well
-    def __init__(self, port, verbose=False):
+    def __init__(self, port, verbose=False, transport=TRANSPORT_THREAD, workers=INGRESS_WORKERS,
+                 rcvbuf=RECV_BUFFER_SIZE, sndbuf=SEND_BUFFER_SIZE):
         self.port = port
         self.verbose = verbose
         self.known_clients = set()
+        self.peers = peerDirectory()  # user_id/IP -> address and last-seen time, for unicast resolution
         self.msg_system = None  # Will be set by main.py
         
+        # Dispatch table: TYPE -> (handler, with_sender), filled by the subsystems via register_handler
+        self.handlers = {}
+        self.handler_stats = {}  # TYPE -> latency histogram
+        self.handler_stats_lock = threading.Lock()
+        self.prefilters = {}  # TYPE -> check(message), True drops the datagram before routing
+        self.register_handler("HELLO", self.handle_hello_message, with_sender=True)  # HELLO is not in specs, so keep as string
+        
+        # Listener transport: blocking thread (default) or asyncio event loop
+        self.transport_mode = transport
+        self.listener_thread = None
+        self.loop = None
+        self.loop_ready = threading.Event()
+        self.async_transport = None
+        self.serverSocket = None
+        self.recv_io = None  # Batched reader for the threaded transport
+        self.recv_ring = bufferRing()  # Receive buffers, lent out until the datagram is copied into its message
+        
+        # Kernel socket buffer sizes: requested and effective (read back after setting)
+        self.rcvbuf_requested = rcvbuf
+        self.sndbuf_requested = sndbuf
+        self.rcvbuf_effective = None
+        self.sndbuf_effective = None
+        
+        # Timers for the threaded transport; the asyncio transport uses its event loop,
+        # and falls back to these if the loop never starts (e.g. the port is taken)
+        self.timers = timerScheduler()
+        
+        # Expiry of timestamped state across the subsystems, swept periodically once the listener runs
+        self.expiry = expiryEngine()
+        
         # Add thread lock for clean logging
         self.log_lock = threading.Lock()
         
+        # Cache of our own interface addresses for self-detection
+        self.local_ips = frozenset(["127.0.0.1"])
+        self.local_ips_refreshed = 0
+        self.refresh_local_ips()
+        self.path_mtus = {}  # IP -> (path MTU, probed at)
+        
+        # Long-lived sender sockets shared by the listener, ACK monitor and UI threads,
+        # each with a batcher so fan-out and chunk bursts go out in one sendmmsg call
+        self.send_sockets = [self._create_send_socket() for _ in range(SEND_SOCKET_POOL_SIZE)]
+        self.send_ios = [batchSocketIO(send_socket) for send_socket in self.send_sockets]
+        self.send_io_cycle = itertools.cycle(self.send_ios)
+        self.send_stats_lock = threading.Lock()
+        self.send_started = time.monotonic()
+        self.sends_total = 0
+        self.send_errors = 0
+        self.send_window_start = self.send_started
+        self.send_window_count = 0
+        self.sends_per_second = 0.0
+        
+        # Bounded ingress queues between the socket reader and handler workers.
+        # Each sender IP always maps to the same worker so its messages stay in order.
+        self.ingress_queues = [queue.Queue(maxsize=INGRESS_QUEUE_SIZE) for _ in range(workers)]
+        self.ingress_lock = threading.Lock()
+        self.ingress_enqueued = 0
+        self.ingress_processed = 0
+        self.ingress_dropped = 0
+        self.ingress_backpressure_waits = 0
+        self.ingress_high_water = 0
+        self.start_ingress_workers()
+        
         self.start_listener()
+        self.schedule_periodic(EXPIRY_SWEEP_INTERVAL, self.expiry.sweep)
+        # Interface scans (and the hostname lookup) can block, so they stay off the receive path and the event loop
+        self.schedule_periodic(LOCAL_IP_REFRESH_INTERVAL, self.refresh_local_ips, blocking=True)
 
     def get_timestamp_str(self):
         """Get formatted timestamp string for logging."""
@@ -31,7 +135,7 @@ class networkSystem: # NOTE: Should probs pass the ui class here to acomplish pr
             return
             
         with self.log_lock:
-            if show_full and isinstance(message, dict):
+            if show_full and isinstance(message, Mapping):
                 # Build the entire message as one string for atomic printing
                 output_lines = []
                 output_lines.append(f"\n{self.get_timestamp_str()}{category}: {{")
@@ -46,140 +150,505 @@ class networkSystem: # NOTE: Should probs pass the ui class here to acomplish pr
             else:
                 print(f"{self.get_timestamp_str()}{category}: {message}")
 
-    def setup_socket(self):
+    def refresh_local_ips(self):
+        """Enumerate the IPv4 addresses of all local interfaces and cache them."""
+        addresses = {"127.0.0.1"}
+
+        # Linux: ask every interface for its address directly (works without a default route)
+        if fcntl and sys.platform.startswith("linux") and hasattr(socket, "if_nameindex"):
+            try:
+                with socket.socket(socket.AF_INET, socket.SOCK_DGRAM) as probe:
+                    for _, name in socket.if_nameindex():
+                        try:
+                            request = struct.pack("256s", name[:15].encode())
+                            reply = fcntl.ioctl(probe.fileno(), SIOCGIFADDR, request)
+                            addresses.add(socket.inet_ntoa(reply[20:24]))
+                        except OSError:
+                            continue  # Interface has no IPv4 address
+            except OSError:
+                pass
+
+        # Windows/macOS: addresses registered for our hostname
+        try:
+            for info in socket.getaddrinfo(socket.gethostname(), None, socket.AF_INET):
+                addresses.add(info[4][0])
+        except (socket.gaierror, OSError):
+            pass
+
+        # Address of the default route, if there is one (no packets are sent)
+        try:
+            with socket.socket(socket.AF_INET, socket.SOCK_DGRAM) as probe:
+                probe.connect(("8.8.8.8", 80))
+                addresses.add(probe.getsockname()[0])
+        except OSError:
+            pass
+
+        if self.verbose and addresses != self.local_ips:
+            print(f"{self.get_timestamp_str()}[NET] Local addresses: {', '.join(sorted(addresses))}")
+
+        self.local_ips = frozenset(addresses)
+        self.local_ips_refreshed = time.monotonic()
+        return self.local_ips
+
+    def get_local_ips(self):
+        """Get cached local addresses (re-enumerated every LOCAL_IP_REFRESH_INTERVAL seconds by a timer)."""
+        return self.local_ips
+
+    def is_local_address(self, ip, port):
+        """Check whether (ip, port) is this peer's own listening address."""
+        return port == self.port and ip in self.get_local_ips()
+
+    def get_path_mtu(self, ip):
+        """Get the path MTU towards ip as the kernel knows it (IP_MTU on Linux), else DEFAULT_PATH_MTU.
+
+        A connected UDP socket is enough to read it; nothing is sent. The kernel's answer
+        is the route's interface MTU, lowered by any ICMP "fragmentation needed" it has
+        seen for that destination, so it is re-read every PATH_MTU_TTL seconds.
+        """
+        now = time.monotonic()
+        cached = self.path_mtus.get(ip)
+        if cached and now - cached[1] < PATH_MTU_TTL:
+            return cached[0]
+
+        mtu = DEFAULT_PATH_MTU
+        if IP_MTU is not None:
+            try:
+                with socket.socket(socket.AF_INET, socket.SOCK_DGRAM) as probe:
+                    probe.connect((ip, LSNP_PORT))
+                    mtu = probe.getsockopt(socket.IPPROTO_IP, IP_MTU)
+            except OSError:
+                pass  # No route yet, or a broadcast address
+        self.path_mtus[ip] = (mtu, now)
+        return mtu
+
+    def get_max_payload(self, ip):
+        """Largest datagram that reaches ip in one IP packet and fits a receive buffer."""
+        return min(self.get_path_mtu(ip) - UDP_IP_HEADER_SIZE, MAX_DATAGRAM_SIZE)
+
+    def bind_server_socket(self):
+        """Create the listening socket and bind it on all interfaces. Returns False on failure."""
         self.serverSocket = socket.socket(socket.AF_INET, socket.SOCK_DGRAM) # SOCK_DGRAM -> UDP
         # Allow address reuse to avoid TIME_WAIT issues
         self.serverSocket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        # The asyncio transport also sends through this socket, broadcasts included
+        if self.transport_mode == TRANSPORT_ASYNCIO:
+            self.serverSocket.setsockopt(socket.SOL_SOCKET, socket.SO_BROADCAST, 1)
+        
+        # Larger receive buffer absorbs bursts of file chunks and follower fan-out
+        self.rcvbuf_effective = self._set_buffer_size(self.serverSocket, socket.SO_RCVBUF, self.rcvbuf_requested)
         
-        # Force binding to port 50999 on all interfaces to receive cross-device broadcasts
+        # Bind on all interfaces to receive cross-device broadcasts
         try:
-            self.serverSocket.bind(('0.0.0.0', 50999))
-            print(f"Ready to receive on port 50999...")
-            bound_successfully = True
+            self.serverSocket.bind(('0.0.0.0', self.port))
+            print(f"Ready to receive on port {self.port}...")
+            self.report_socket_buffers()
+            return True
         except OSError as e:
-            print(f"Failed to bind to port 50999: {e}")
-            print("ERROR: Port 50999 is required but not available. Please close other instances.")
-            bound_successfully = False
-            return
+            print(f"Failed to bind to port {self.port}: {e}")
+            print(f"ERROR: Port {self.port} is required but not available. Please close other instances.")
+            return False
 
-        # Only start listening if we successfully bound to port 50999
+    def setup_socket(self):
+        # Only start listening if we successfully bound to our port
+        bound_successfully = self.bind_server_socket()
+        if bound_successfully:
+            self.recv_io = batchSocketIO(self.serverSocket, ring=self.recv_ring)
         while bound_successfully:
             self.receive_message()
 
+    def setup_async_socket(self):
+        """Run the asyncio transport: receives, sends and timers all share this event loop."""
+        loop = None
+        started = False
+        try:
+            if not self.bind_server_socket():
+                return  # Timers fall back to threads
+
+            loop = self.loop = asyncio.new_event_loop()
+            asyncio.set_event_loop(loop)
+            self.serverSocket.setblocking(False)
+            loop.run_until_complete(
+                loop.create_datagram_endpoint(lambda: lsnpDatagramProtocol(self), sock=self.serverSocket)
+            )
+            started = True
+        except Exception as e:
+            print(f"{self.get_timestamp_str()}[ERROR] Could not start the asyncio transport: {e}")
+            if loop is not None:
+                self.loop = self.async_transport = None
+                loop.close()
+            return
+        finally:
+            if not started:
+                self.loop_ready.set()  # Set on every failed start, so waiters never hang
+
+        # Release waiters from inside the loop, so they always see it running
+        loop.call_soon(self.loop_ready.set)
+        loop.run_forever()
+
     def start_listener(self):
+        # Only one listener per network system
+        if self.listener_thread and self.listener_thread.is_alive():
+            return
+
         # Run it in the background
-        thread = threading.Thread(target=self.setup_socket, daemon=True)
-        thread.start()
+        if self.transport_mode == TRANSPORT_ASYNCIO:
+            self.listener_thread = threading.Thread(target=self.setup_async_socket, daemon=True)
+        else:
+            self.listener_thread = threading.Thread(target=self.setup_socket, daemon=True)
+        self.listener_thread.start()
+
+    def _get_event_loop(self):
+        """Get the running asyncio loop, or None when using the threaded transport.
+
+        Also None when the loop failed to start or has stopped, so timers fall back to threads.
+        """
+        if self.transport_mode != TRANSPORT_ASYNCIO:
+            return None
+        self.loop_ready.wait()
+        loop = self.loop
+        return loop if loop is not None and loop.is_running() else None
+
+    def call_later(self, delay, callback):
+        """Run callback once after delay seconds on the transport's timer context.
+
+        Returns a handle whose cancel() stops the callback if it hasn't run yet.
+        """
+        loop = self._get_event_loop()
+        if loop:
+            handle = timerHandle(None, callback)
+            loop.call_soon_threadsafe(loop.call_later, delay, self._run_timer_handle, handle)
+            return handle
+        return self.timers.call_later(delay, lambda: self._run_timer_callback(callback))
+
+    def schedule_periodic(self, interval, callback, blocking=False):
+        """Run callback every interval seconds on the transport's timer context.
+
+        A blocking callback (one making system calls that may stall) always runs on
+        the timer thread, never on the asyncio event loop.
+        """
+        schedule = self.timers.call_later if blocking else self.call_later
+        def tick():
+            self._run_timer_callback(callback)
+            schedule(interval, tick)
+        schedule(interval, tick)
+
+    def _run_timer_handle(self, handle):
+        if not handle.cancelled:
+            self._run_timer_callback(handle.callback)
+
+    def get_peer_stats(self):
+        """Get the peer directory's size and lookup counters."""
+        return self.peers.get_stats()
+
+    def get_expiry_stats(self):
+        """Get how many expiring items are tracked and how many each subsystem has reclaimed."""
+        return self.expiry.get_stats()
+
+    def get_timer_stats(self):
+        """Get timer scheduler counters (None while the asyncio loop runs, as it keeps its own timers)."""
+        return self.timers.get_stats() if self._get_event_loop() is None else None
+
+    def _run_timer_callback(self, callback):
+        try:
+            callback()
+        except Exception as e:
+            print(f"{self.get_timestamp_str()}[ERROR] Timer callback failed: {e}")
+
+    def _create_send_socket(self):
+        """Create a sender socket with broadcast and buffer size configured once up front."""
+        send_socket = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        send_socket.setsockopt(socket.SOL_SOCKET, socket.SO_BROADCAST, 1)
+        self.sndbuf_effective = self._set_buffer_size(send_socket, socket.SO_SNDBUF, self.sndbuf_requested)
+        return send_socket
+
+    def _set_buffer_size(self, sock, option, size):
+        """Request a kernel buffer size and return the size the kernel actually granted."""
+        if size:
+            try:
+                sock.setsockopt(socket.SOL_SOCKET, option, size)
+            except OSError as e:
+                print(f"[WARN] Could not set socket buffer size to {size}: {e}")
+        return sock.getsockopt(socket.SOL_SOCKET, option)
+
+    def report_socket_buffers(self):
+        """Print the requested and effective socket buffer sizes."""
+        print(f"Socket buffers: receive {self.rcvbuf_effective} bytes (requested {self.rcvbuf_requested}), "
+              f"send {self.sndbuf_effective} bytes (requested {self.sndbuf_requested})")
+        # Linux reports double the requested value, so anything below the request was capped
+        if self.rcvbuf_requested and self.rcvbuf_effective < self.rcvbuf_requested:
+            print("[WARN] Receive buffer was capped by the OS (on Linux raise net.core.rmem_max)")
+        if self.sndbuf_requested and self.sndbuf_effective < self.sndbuf_requested:
+            print("[WARN] Send buffer was capped by the OS (on Linux raise net.core.wmem_max)")
+
+    def get_kernel_socket_stats(self):
+        """Read the listening socket's kernel queue and drop counters from /proc/net/udp (Linux only)."""
+        stats = {
+            "rcvbuf": self.rcvbuf_effective,
+            "sndbuf": self.sndbuf_effective,
+            "rx_queue_bytes": None,
+            "kernel_drops": None
+        }
+        if not self.serverSocket or not os.path.exists("/proc/net/udp"):
+            return stats
+
+        try:
+            inode = str(os.fstat(self.serverSocket.fileno()).st_ino)
+            with open("/proc/net/udp") as f:
+                next(f)  # Header line
+                for line in f:
+                    fields = line.split()
+                    # sl local rem st tx_queue:rx_queue tr tm->when retrnsmt uid timeout inode ref pointer drops
+                    if len(fields) >= 13 and fields[9] == inode:
+                        stats["rx_queue_bytes"] = int(fields[4].split(':')[1], 16)
+                        stats["kernel_drops"] = int(fields[-1])
+                        break
+        except (OSError, ValueError, IndexError):
+            pass
+        return stats
+
+    def _send_datagram(self, data, addr):
+        """Send one datagram through the shared sender socket pool (or the asyncio transport)."""
+        if self.async_transport:
+            # Hand the datagram to the event loop so sends stay on the loop thread
+            clientSocket = self.serverSocket
+            self.loop.call_soon_threadsafe(self.async_transport.sendto, data, addr)
+        else:
+            clientSocket = next(self.send_io_cycle).sock
+            try:
+                clientSocket.sendto(data, addr)
+            except OSError:
+                self._record_sends(0, 1)
+                raise
+
+        self._record_sends(1)
+        return clientSocket
+
+    def _send_datagrams(self, datagrams):
+        """Send a list of (data, addr) datagrams in as few system calls as possible. Returns the number sent."""
+        if not datagrams:
+            return 0
+
+        if self.async_transport:
+            self.loop.call_soon_threadsafe(self._async_sendto_all, datagrams)
+            sent = len(datagrams)
+        else:
+            sent = next(self.send_io_cycle).send_batch(datagrams)
+
+        self._record_sends(sent, len(datagrams) - sent)
+        return sent
+
+    def _async_sendto_all(self, datagrams):
+        for data, addr in datagrams:
+            self.async_transport.sendto(data, addr)
+
+    def _record_sends(self, sent, errors=0):
+        with self.send_stats_lock:
+            self.send_errors += errors
+            self.sends_total += sent
+            self.send_window_count += sent
+            now = time.monotonic()
+            elapsed = now - self.send_window_start
+            if elapsed >= 1.0:
+                self.sends_per_second = self.send_window_count / elapsed
+                self.send_window_start = now
+                self.send_window_count = 0
+
+    def get_send_stats(self):
+        """Get sender socket pool statistics."""
+        with self.send_stats_lock:
+            now = time.monotonic()
+            window_elapsed = now - self.send_window_start
+            # Use the running window before the first full window or once the last one is stale
+            if window_elapsed >= 2.0 or (self.sends_per_second == 0.0 and window_elapsed > 0):
+                current_rate = self.send_window_count / window_elapsed
+            else:
+                current_rate = self.sends_per_second
+            uptime = max(now - self.send_started, 1e-9)
+            return {
+                "sockets": len(self.send_sockets),
+                "sends_total": self.sends_total,
+                "send_errors": self.send_errors,
+                "sends_per_second": round(current_rate, 2),
+                "average_sends_per_second": round(self.sends_total / uptime, 2)
+            }
+
+    def get_io_stats(self):
+        """Get system calls per datagram for the batched reader and the sender pool."""
+        recv = self.recv_io.get_stats() if self.recv_io else None
+        send_syscalls = sum(io.send_syscalls for io in self.send_ios)
+        datagrams_sent = sum(io.datagrams_sent for io in self.send_ios)
+        return {
+            "native": self.send_ios[0].native if self.send_ios else False,
+            "batch_size": IO_BATCH_SIZE,
+            "recv_syscalls": recv["recv_syscalls"] if recv else None,
+            "datagrams_received": recv["datagrams_received"] if recv else None,
+            "recv_syscalls_per_datagram": round(recv["recv_syscalls"] / recv["datagrams_received"], 3)
+                if recv and recv["datagrams_received"] else None,
+            "batched_send_syscalls": send_syscalls,
+            "batched_datagrams_sent": datagrams_sent,
+            "send_syscalls_per_datagram": round(send_syscalls / datagrams_sent, 3) if datagrams_sent else None,
+            "recv_ring": self.recv_ring.get_stats()
+        }
 
     def send_message(self, message, target_ip=None, target_port=LSNP_PORT):  # None for broadcast
         """Send an LSNP message via UDP to a target IP and port or everybody (if broadcast)."""
         try:
-            # Convert to LSNP format (key-value pairs with \n\n terminator)
-            lsnp_message = self._dict_to_lsnp(message)
+            # Convert to LSNP format (key-value pairs with \n\n terminator) and encode once
+            data = lsnp_codec.encode(message)
             
-            with socket.socket(socket.AF_INET, socket.SOCK_DGRAM) as clientSocket:
-                if message.get("BROADCAST", False):
-                    clientSocket.setsockopt(socket.SOL_SOCKET, socket.SO_BROADCAST, 1)
-
-                    # Send to known clients
-                    for ip, port in self.known_clients:
-                        # Get our local IP for better self-detection
-                        try:
-                            temp_socket = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
-                            temp_socket.connect(("8.8.8.8", 80))
-                            local_ip = temp_socket.getsockname()[0]
-                            temp_socket.close()
-                        except:
-                            local_ip = "127.0.0.1"
-                        
-                        # Don't send to self
-                        is_self = (ip == local_ip and port == self.port) or \
-                                 (ip == "127.0.0.1" and port == self.port)
-                        
-                        if not is_self:
-                            clientSocket.sendto(lsnp_message.encode(), (ip, port))
-                            if self.verbose:
-                                local_send_ip, local_send_port = clientSocket.getsockname()
-                                print(f"[SEND] From {local_send_ip}:{local_send_port} To {ip}:{port}")
-                    
-                    # Also send to broadcast address for device discovery
-                    try:
-                        broadcast_addr = "255.255.255.255"  # Limited broadcast
-                        clientSocket.sendto(lsnp_message.encode(), (broadcast_addr, LSNP_PORT))
-                        if self.verbose:
-                            self.log_message(f"[BROADCAST] To {broadcast_addr}:{LSNP_PORT}", message)
-                    except Exception as e:
-                        if self.verbose:
-                            print(f"{self.get_timestamp_str()}[WARN] Broadcast failed: {e}")
-                else:
-                    # Get our local IP for better self-detection
-                    try:
-                        temp_socket = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
-                        temp_socket.connect(("8.8.8.8", 80))
-                        local_ip = temp_socket.getsockname()[0]
-                        temp_socket.close()
-                    except:
-                        local_ip = "127.0.0.1"
-                    
-                    # Don't send to self when sending unicast
-                    is_self = (target_ip == local_ip and target_port == self.port) or \
-                             (target_ip == "127.0.0.1" and target_port == self.port)
-                    
-                    if not is_self:
-                        clientSocket.sendto(lsnp_message.encode(), (target_ip, target_port))
-                        if self.verbose:
-                            local_send_ip, local_send_port = clientSocket.getsockname()
-                            print(f"[SEND] From {local_send_ip}:{local_send_port} To {target_ip}:{target_port}")
-                            self.log_message(f"[SEND] To {target_ip}:{target_port}", message)
+            if message.get("BROADCAST", False):
+                # Send to known clients (except ourselves) in one batch
+                targets = [addr for addr in list(self.known_clients) if not self.is_local_address(*addr)]
+                self._send_datagrams([(data, addr) for addr in targets])
+                if self.verbose:
+                    for ip, port in targets:
+                        print(f"[SEND] To {ip}:{port}")
+                
+                # Also send to broadcast address for device discovery
+                try:
+                    broadcast_addr = "255.255.255.255"  # Limited broadcast
+                    self._send_datagram(data, (broadcast_addr, LSNP_PORT))
+                    if self.verbose:
+                        self.log_message(f"[BROADCAST] To {broadcast_addr}:{LSNP_PORT}", message)
+                except Exception as e:
+                    if self.verbose:
+                        print(f"{self.get_timestamp_str()}[WARN] Broadcast failed: {e}")
+            else:
+                # Don't send to self when sending unicast
+                if not self.is_local_address(target_ip, target_port):
+                    clientSocket = self._send_datagram(data, (target_ip, target_port))
+                    if self.verbose:
+                        local_send_ip, local_send_port = clientSocket.getsockname()
+                        print(f"[SEND] From {local_send_ip}:{local_send_port} To {target_ip}:{target_port}")
+                        self.log_message(f"[SEND] To {target_ip}:{target_port}", message)
         except Exception as e:
             if self.verbose:
                 print(f"{self.get_timestamp_str()}[ERROR] Failed to send message: {e}")
 
-    def _dict_to_lsnp(self, message_dict):
-        """Convert a dictionary to LSNP key-value format."""
-        lines = []
-        for key, value in message_dict.items():
-            if key != "BROADCAST":  # Don't include internal flags in LSNP message
-                # Ensure value is a string (convert if necessary)
-                str_value = str(value) if value is not None else ""
-                lines.append(f"{key}: {str_value}")
-        return "\n".join(lines) + "\n\n"
-
-    def _lsnp_to_dict(self, lsnp_message):
-        """Convert LSNP key-value format to dictionary."""
-        lines = lsnp_message.strip().split('\n')
-        message_dict = {}
-        for line in lines:
-            if ':' in line:
-                key, value = line.split(':', 1)
-                key = key.strip()
-                value = value.strip()
-                
-                # Try to convert numeric values back to int
-                if value.isdigit():
-                    value = int(value)
-                
-                message_dict[key] = value
-        return message_dict
+    def send_messages(self, messages):
+        """Send several unicast LSNP messages as one batch. Takes a list of (message, ip, port); returns the number sent."""
+        encoded = {}  # The same message dict fanned out to many peers is encoded once
+        datagrams = []
+        for message, ip, port in messages:
+            # Don't send to self
+            if self.is_local_address(ip, port):
+                continue
+            if id(message) not in encoded:
+                encoded[id(message)] = lsnp_codec.encode(message)
+            datagrams.append((encoded[id(message)], (ip, port)))
+
+        try:
+            sent = self._send_datagrams(datagrams)
+        except Exception as e:
+            if self.verbose:
+                print(f"{self.get_timestamp_str()}[ERROR] Failed to send batch: {e}")
+            return 0
+
+        if self.verbose:
+            for (message, ip, port) in messages:
+                self.log_message(f"[SEND] To {ip}:{port}", message, show_full=False)
+            if sent < len(datagrams):
+                print(f"{self.get_timestamp_str()}[WARN] {len(datagrams) - sent} of {len(datagrams)} datagrams failed to send")
+        return sent
 
     def receive_message(self):
         try:
-            data, addr = self.serverSocket.recvfrom(4096) # addr = ip, port
-            raw_message = data.decode()
-            message = self._lsnp_to_dict(raw_message)
+            # Everything already queued in the socket comes back from one call
+            datagrams = self.recv_io.recv_batch() # [(view, (ip, port))]
+        except Exception as e:
+            print(f"{self.get_timestamp_str()}[ERROR] Failed to receive message: {e}")
+            return
+        for view, addr in datagrams:
+            # The view's buffer stays lent out until process_datagram has copied it into a message
+            self.handle_datagram(view, addr)
+
+    def start_ingress_workers(self):
+        """Start one handler worker per ingress queue."""
+        for ingress_queue in self.ingress_queues:
+            thread = threading.Thread(target=self.ingress_worker, args=(ingress_queue,), daemon=True)
+            thread.start()
+
+    def ingress_worker(self, ingress_queue):
+        """Process queued datagrams for the senders assigned to this worker."""
+        while True:
+            data, addr = ingress_queue.get()
+            self.process_datagram(data, addr)
+            with self.ingress_lock:
+                self.ingress_processed += 1
+
+    def handle_datagram(self, data, addr):
+        """Queue a received datagram for the workers, or process it inline when there are none."""
+        if not self.ingress_queues:
+            self.process_datagram(data, addr)
+            return
 
-            # Get the correct listening port from the message
-            listening_port = message.get("LISTEN_PORT", LSNP_PORT)  # Use standard port as fallback
-            
-            # Get our local IP to avoid adding ourselves as a client
+        # Same sender IP -> same queue, so per-sender ordering is preserved
+        ingress_queue = self.ingress_queues[hash(addr[0]) % len(self.ingress_queues)]
+        try:
+            ingress_queue.put_nowait((data, addr))
+        except queue.Full:
             try:
-                # Get our actual IP address
-                temp_socket = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
-                temp_socket.connect(("8.8.8.8", 80))
-                local_ip = temp_socket.getsockname()[0]
-                temp_socket.close()
-            except:
-                local_ip = "127.0.0.1"  # fallback
+                if self.transport_mode == TRANSPORT_ASYNCIO:
+                    # This runs on the event loop, where waiting would stall every receive, send and timer
+                    raise
+                # Backpressure: give the workers a moment before dropping
+                with self.ingress_lock:
+                    self.ingress_backpressure_waits += 1
+                ingress_queue.put((data, addr), timeout=INGRESS_BLOCK_TIMEOUT)
+            except queue.Full:
+                with self.ingress_lock:
+                    self.ingress_dropped += 1
+                if self.verbose:
+                    print(f"{self.get_timestamp_str()}[WARN] Ingress queue full, dropped datagram from {addr[0]}")
+                self.release_buffer(data)
+                return
+
+        with self.ingress_lock:
+            self.ingress_enqueued += 1
+            depth = ingress_queue.qsize()
+            if depth > self.ingress_high_water:
+                self.ingress_high_water = depth
+
+    def get_ingress_stats(self):
+        """Get ingress queue and worker statistics."""
+        with self.ingress_lock:
+            return {
+                "workers": len(self.ingress_queues),
+                "queue_capacity": INGRESS_QUEUE_SIZE,
+                "queue_depths": [q.qsize() for q in self.ingress_queues],
+                "high_water": self.ingress_high_water,
+                "enqueued": self.ingress_enqueued,
+                "processed": self.ingress_processed,
+                "dropped": self.ingress_dropped,
+                "backpressure_waits": self.ingress_backpressure_waits
+            }
+
+    def release_buffer(self, data):
+        """Return a received datagram's buffer to the receive ring (no-op for plain bytes)."""
+        if self.recv_ring.owns(data):
+            self.recv_ring.release(data.obj)
+
+    def process_datagram(self, data, addr):
+        """Decode one received datagram, track its sender and route it."""
+        try:
+            # Fields are only split out here; handlers convert the values they actually read
+            message = lsnp_codec.LSNPMessage(data)
+        except Exception as e:
+            print(f"{self.get_timestamp_str()}[ERROR] Failed to receive message: {e}")
+            return
+        finally:
+            # The message holds its own copy of the datagram, so the receive buffer can be reused right away
+            self.release_buffer(data)
+
+        try:
+            if self.prefilters:
+                prefilter = self.prefilters.get(message.get("TYPE"))
+                if prefilter and prefilter(message):
+                    return
+            
+            # Get the correct listening port from the message
+            advertised_port = message.get("LISTEN_PORT")
+            listening_port = advertised_port if advertised_port is not None else LSNP_PORT  # Use standard port as fallback
             
             # Improved self-detection: use USER_ID if available, otherwise fall back to IP/port
             user_id = message.get("USER_ID")
@@ -191,8 +660,7 @@ class networkSystem: # NOTE: Should probs pass the ui class here to acomplish pr
                 is_self = (user_id == our_user_id)
             else:
                 # Fall back to IP/port detection for messages without USER_ID
-                is_self = (addr[0] == local_ip and int(listening_port) == self.port) or \
-                         (addr[0] == "127.0.0.1" and int(listening_port) == self.port)
+                is_self = self.is_local_address(addr[0], int(listening_port))
 
             # Only log received messages from OTHER users, not our own
             if self.verbose and not is_self:
@@ -205,117 +673,140 @@ class networkSystem: # NOTE: Should probs pass the ui class here to acomplish pr
                     self.known_clients.add(client_tuple)
                     if self.verbose:
                         print(f"{self.get_timestamp_str()}[NEW CLIENT] {addr[0]}:{listening_port}")
+                
+                # Keep the peer directory current (HELLO/PROFILE advertise a port, other types just the sender)
+                sender_user_id = user_id or message.get("FROM")
+                if sender_user_id == our_user_id:
+                    sender_user_id = None
+                # From an IP other than the user_id's, only a valid token of that user may (re)place it
+                verified = False
+                if sender_user_id and not sender_user_id.endswith('@' + addr[0]):
+                    token = message.get("TOKEN")
+                    verified = bool(token) and self.msg_system is not None and self.msg_system.token_belongs_to(token, sender_user_id)
+                self.peers.see(addr[0], int(advertised_port) if advertised_port is not None else None, sender_user_id, verified)
 
             self.parse_message(message, addr, is_self)
 
         except Exception as e:
             print(f"{self.get_timestamp_str()}[ERROR] Failed to receive message: {e}")
 
+    def register_handler(self, msg_type, handler, with_sender=False):
+        """Route received messages of msg_type to handler(message).
+
+        With with_sender, the handler is called as handler(message, sender_addr, is_self).
+        Registering a type again replaces its handler.
+        """
+        self.handlers[msg_type] = (handler, with_sender)
+        with self.handler_stats_lock:
+            if msg_type not in self.handler_stats:
+                self.handler_stats[msg_type] = {
+                    "count": 0,
+                    "total": 0.0,
+                    "max": 0.0,
+                    "buckets": [0] * (len(HANDLER_LATENCY_BUCKETS_MS) + 1)  # Last bucket: slower than all bounds
+                }
+
+    def register_prefilter(self, msg_type, check):
+        """Drop received messages of msg_type for which check(message) is True, before any routing."""
+        self.prefilters[msg_type] = check
+
     def parse_message(self, message, sender_addr, is_self=False):
         try:
             msg_type = message.get("TYPE")
 
-            # Route messages to appropriate systems
-            if msg_type in [MSG_PROFILE, MSG_POST, MSG_DM, MSG_PING, MSG_LIKE, MSG_FOLLOW, MSG_UNFOLLOW, MSG_ACK, MSG_REVOKE, MSG_GROUP_CREATE, MSG_GROUP_UPDATE, MSG_GROUP_MESSAGE]:
-                if self.msg_system:
-                    self.msg_system.process_incoming_message(message)
-                else:
-                    # Fallback if msg_system not set
-                    self.log_message(f"[{msg_type}]", message)
-            elif msg_type in [MSG_TICTACTOE_INVITE, MSG_TICTACTOE_ACCEPT, MSG_TICTACTOE_MOVE, MSG_TICTACTOE_RESULT]:
-                # Route to file_game_system for game handling
-                if hasattr(self, 'file_game_system') and self.file_game_system:
-                    if msg_type == MSG_TICTACTOE_INVITE:
-                        self.file_game_system.handle_game_invite(message)
-                    elif msg_type == MSG_TICTACTOE_ACCEPT:
-                        self.file_game_system.handle_game_accept(message)
-                    elif msg_type == MSG_TICTACTOE_MOVE:
-                        self.file_game_system.handle_game_move(message)
-                    elif msg_type == MSG_TICTACTOE_RESULT:
-                        self.file_game_system.handle_game_result(message)
-                else:
-                    self.log_message(f"[GAME]", message)
-            elif msg_type in [MSG_FILE_OFFER, MSG_FILE_CHUNK, MSG_FILE_RECEIVED, "FILE_ACCEPTED"]:
-                # File transfer messages - route to file_game_system
-                if msg_type == MSG_FILE_OFFER:
-                    if hasattr(self, 'file_game_system') and self.file_game_system:
-                        self.file_game_system.handle_file_offer(message)
-                    else:
-                        if self.verbose:
-                            print(f"[NETWORK] No file_game_system for FILE_OFFER")
-                elif msg_type == MSG_FILE_CHUNK:
-                    if hasattr(self, 'file_game_system') and self.file_game_system:
-                        self.file_game_system.handle_file_chunk(message)
-                    else:
-                        if self.verbose:
-                            print(f"[NETWORK] No file_game_system for FILE_CHUNK")
-                elif msg_type == MSG_FILE_RECEIVED:
-                    if hasattr(self, 'file_game_system') and self.file_game_system:
-                        self.file_game_system.handle_file_received(message)
-                    else:
-                        if self.verbose:
-                            print(f"[NETWORK] No file_game_system for FILE_RECEIVED")
-                elif msg_type == "FILE_ACCEPTED":
-                    if hasattr(self, 'file_game_system') and self.file_game_system:
-                        self.file_game_system.handle_file_accepted(message)
-                    else:
-                        if self.verbose:
-                            print(f"[NETWORK] No file_game_system for FILE_ACCEPTED")
-            elif msg_type == "HELLO":  # HELLO is not in specs, so keep as string
-                # Skip processing our own HELLO messages
-                if is_self:
-                    return
-                    
-                hello_data = message.get('DATA', 'Hello message')
-                listen_port = message.get('LISTEN_PORT', LSNP_PORT)
-                sender_ip = sender_addr[0]
-                sender_user_id = message.get('USER_ID')
-                sender_display_name = message.get('DISPLAY_NAME', 'Unknown User')
-                
-                # Add sender to known clients for peer discovery
-                client_tuple = (sender_ip, listen_port)
-                if client_tuple not in self.known_clients:
-                    self.known_clients.add(client_tuple)
-                    if self.verbose:
-                        print(f"[HELLO] Added {sender_ip}:{listen_port} to known clients")
-                
-                self.log_message(f"[HELLO]", message)
-                
-                # If we have user info, create a peer entry and send PROFILE response
-                if self.msg_system and sender_user_id and sender_display_name:
-                    # Create peer entry from HELLO info
-                    self.msg_system.known_peers[sender_user_id] = {
-                        'display_name': sender_display_name,
-                        'status': 'Online',
-                        'avatar_type': None,
-                        'avatar_data': None
-                    }
-                    if self.verbose:
-                        print(f"{self.get_timestamp_str()}[HELLO] Added peer: {sender_display_name} ({sender_user_id})")
-                    
-                    # Send PROFILE response if we have our own profile
-                    if hasattr(self.msg_system, 'user_id'):
-                        try:
-                            response_message = {
-                                "TYPE": MSG_PROFILE,
-                                "USER_ID": self.msg_system.user_id,
-                                "DISPLAY_NAME": self.msg_system.display_name,
-                                "STATUS": getattr(self.msg_system, 'status', 'Online'),
-                                "LISTEN_PORT": self.port,
-                                "BROADCAST": False  # Unicast response
-                            }
-                            self.send_message(response_message, target_ip=sender_ip, target_port=listen_port)
-                            if self.verbose:
-                                print(f"{self.get_timestamp_str()}[HELLO] Sent PROFILE response to {sender_ip}:{listen_port}")
-                        except Exception as e:
-                            if self.verbose:
-                                print(f"{self.get_timestamp_str()}[HELLO] Failed to send PROFILE response: {e}")
-            else:
+            entry = self.handlers.get(msg_type)
+            if entry is None:
                 print(f"{self.get_timestamp_str()}[WARN] Unknown message type: {msg_type}")
+                return
+
+            handler, with_sender = entry
+            started = time.perf_counter()
+            try:
+                if with_sender:
+                    handler(message, sender_addr, is_self)
+                else:
+                    handler(message)
+            finally:
+                self._record_handler_latency(msg_type, (time.perf_counter() - started) * 1000)
 
         except Exception as e:
             print(f"{self.get_timestamp_str()}[ERROR] Failed to parse message: {e}")
 
+    def _record_handler_latency(self, msg_type, elapsed_ms):
+        """Add one handler run to its type's latency histogram."""
+        bucket = bisect.bisect_left(HANDLER_LATENCY_BUCKETS_MS, elapsed_ms)
+        with self.handler_stats_lock:
+            stats = self.handler_stats[msg_type]
+            stats["count"] += 1
+            stats["total"] += elapsed_ms
+            stats["buckets"][bucket] += 1
+            if elapsed_ms > stats["max"]:
+                stats["max"] = elapsed_ms
+
+    def get_handler_stats(self):
+        """Get per-type handler latency (milliseconds) for every type that has been handled."""
+        labels = [f"<={bound}ms" for bound in HANDLER_LATENCY_BUCKETS_MS] + [f">{HANDLER_LATENCY_BUCKETS_MS[-1]}ms"]
+        with self.handler_stats_lock:
+            return {
+                msg_type: {
+                    "count": stats["count"],
+                    "mean_ms": round(stats["total"] / stats["count"], 3),
+                    "max_ms": round(stats["max"], 3),
+                    "histogram": dict(zip(labels, stats["buckets"]))
+                }
+                for msg_type, stats in self.handler_stats.items() if stats["count"]
+            }
+
+    def handle_hello_message(self, message, sender_addr, is_self):
+        """Handle incoming HELLO messages: remember the sender and answer with our PROFILE."""
+        # Skip processing our own HELLO messages
+        if is_self:
+            return
+            
+        listen_port = message.get('LISTEN_PORT', LSNP_PORT)
+        sender_ip = sender_addr[0]
+        sender_user_id = message.get('USER_ID')
+        sender_display_name = message.get('DISPLAY_NAME', 'Unknown User')
+        
+        # Add sender to known clients for peer discovery
+        client_tuple = (sender_ip, listen_port)
+        if client_tuple not in self.known_clients:
+            self.known_clients.add(client_tuple)
+            if self.verbose:
+                print(f"[HELLO] Added {sender_ip}:{listen_port} to known clients")
+        
+        self.log_message(f"[HELLO]", message)
+        
+        # If we have user info, create a peer entry and send PROFILE response
+        if self.msg_system and sender_user_id and sender_display_name:
+            # Create peer entry from HELLO info
+            self.msg_system.known_peers[sender_user_id] = {
+                'display_name': sender_display_name,
+                'status': 'Online',
+                'avatar_type': None,
+                'avatar_data': None
+            }
+            if self.verbose:
+                print(f"{self.get_timestamp_str()}[HELLO] Added peer: {sender_display_name} ({sender_user_id})")
+            
+            # Send PROFILE response if we have our own profile
+            if hasattr(self.msg_system, 'user_id'):
+                try:
+                    response_message = {
+                        "TYPE": MSG_PROFILE,
+                        "USER_ID": self.msg_system.user_id,
+                        "DISPLAY_NAME": self.msg_system.display_name,
+                        "STATUS": getattr(self.msg_system, 'status', 'Online'),
+                        "LISTEN_PORT": self.port,
+                        "BROADCAST": False  # Unicast response
+                    }
+                    self.send_message(response_message, target_ip=sender_ip, target_port=listen_port)
+                    if self.verbose:
+                        print(f"{self.get_timestamp_str()}[HELLO] Sent PROFILE response to {sender_ip}:{listen_port}")
+                except Exception as e:
+                    if self.verbose:
+                        print(f"{self.get_timestamp_str()}[HELLO] Failed to send PROFILE response: {e}")
+
     def set_msg_system(self, msg_system):
         """Set the message system for proper routing."""
         self.msg_system = msg_system
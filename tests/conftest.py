@@ -0,0 +1,5 @@
+# The client is a set of flat modules in the repository root (run as `python main.py`)
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
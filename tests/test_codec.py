@@ -0,0 +1,67 @@
+import lsnp_codec
+from lsnp_codec import LSNPMessage
+from vars import *
+
+
+def test_round_trip_converts_only_schema_numeric_fields():
+    message = {"TYPE": MSG_POST, "USER_ID": "alice@10.0.0.2", "CONTENT": "123", "TTL": 3600,
+               "MESSAGE_ID": "f83d2b1c", "TIMESTAMP": 1728938500}
+    data = lsnp_codec.encode(message)
+    assert data.endswith(b"\n\n")
+
+    decoded = lsnp_codec.decode(data)
+    assert decoded == message
+    assert decoded["CONTENT"] == "123"  # Not numeric for POST
+    assert LSNPMessage(data) == message
+
+
+def test_internal_fields_stay_off_the_wire():
+    data = lsnp_codec.encode({"TYPE": MSG_POST, "CONTENT": "hi", "BROADCAST": True})
+    assert b"BROADCAST" not in data
+
+
+def test_binary_payload_round_trip():
+    message = {"TYPE": MSG_FILE_CHUNK, "FILEID": "ab12cd34", "CHUNK_INDEX": 3, "TOTAL_CHUNKS": 9,
+               "CHUNK_SIZE": 4, "DATA": b"AAECAw==", "TOKEN": "alice@10.0.0.2|1728942100|file"}
+    data = lsnp_codec.encode(message)
+
+    decoded = lsnp_codec.decode(data)
+    assert decoded["DATA"] == b"AAECAw=="
+    assert decoded["CHUNK_INDEX"] == 3
+    view = LSNPMessage(data)
+    assert bytes(view["DATA"]) == b"AAECAw=="
+    assert view["TOTAL_CHUNKS"] == 9
+
+
+def test_first_key_wins_on_every_decode_path():
+    data = b"TYPE: DM\nFROM: alice@10.0.0.2\nCONTENT: first\nCONTENT: second\n\n"
+    assert lsnp_codec.decode(data)["CONTENT"] == "first"
+    assert LSNPMessage(data)["CONTENT"] == "first"  # Found by search
+    assert dict(LSNPMessage(data).items())["CONTENT"] == "first"  # Read from the line index
+
+    # A non-canonical layout is indexed up front
+    shuffled = b"FROM: alice@10.0.0.2\nTYPE: DM\nCONTENT: first\nCONTENT: second\n\n"
+    assert LSNPMessage(shuffled)["CONTENT"] == "first"
+    assert lsnp_codec.decode(shuffled)["CONTENT"] == "first"
+
+
+def test_message_owns_a_copy_of_the_receive_buffer():
+    buffer = bytearray(b"TYPE: DM\nCONTENT: hello\n\n")
+    message = LSNPMessage(memoryview(buffer))
+    decoded = lsnp_codec.decode(memoryview(buffer))
+    buffer[:] = b"X" * len(buffer)  # The ring reuses the buffer for the next datagram
+    assert message["CONTENT"] == "hello"
+    assert decoded["CONTENT"] == "hello"
+
+
+def test_message_view_behaves_like_a_dict():
+    message = LSNPMessage(b"TYPE: PING\nUSER_ID: bob@10.0.0.3\nLISTEN_PORT: 51000\n\n")
+    assert message["LISTEN_PORT"] == 51000
+    assert "USER_ID" in message and "CONTENT" not in message
+    assert message.get("CONTENT", "none") == "none"
+
+    message["CONTENT"] = "added"
+    assert message.pop("CONTENT") == "added"
+    del message["USER_ID"]
+    assert list(message) == ["TYPE", "LISTEN_PORT"]
+    assert message.copy() == {"TYPE": "PING", "LISTEN_PORT": 51000}
@@ -0,0 +1,181 @@
+import base64
+import os
+import queue
+import threading
+import time
+from types import SimpleNamespace
+
+import pytest
+
+import lsnp_codec
+from file_game import fileGameSystem
+from lsnp_structs import chunkBitmap, expiryEngine, peerDirectory, timerScheduler
+from vars import *
+
+
+class loopbackNet:
+    """Just enough of networkSystem for fileGameSystem, with an in-memory wire instead of sockets.
+
+    Every message is encoded, recorded in sent and, if connected, delivered to the other
+    end on its own thread (as the ingress workers do), unless drop(message) says to lose it.
+    The TYPE of every message handled here is recorded in handled.
+    """
+    def __init__(self, user_id, port):
+        self.port = port
+        self.verbose = False
+        self.msg_system = SimpleNamespace(user_id=user_id, get_display_name=lambda user_id: user_id)
+        self.peers = peerDirectory()
+        self.expiry = expiryEngine()
+        self.timers = timerScheduler()
+        self.handlers = {}
+        self.remote = None
+        self.drop = lambda message: False
+        self.sent = []
+        self.handled = []
+        self.inbox = queue.Queue()
+        threading.Thread(target=self.deliver, daemon=True).start()
+
+    def connect(self, remote):
+        self.remote, remote.remote = remote, self
+        self.peers.see("127.0.0.1", remote.port, remote.msg_system.user_id)
+        remote.peers.see("127.0.0.1", self.port, self.msg_system.user_id)
+
+    def register_handler(self, msg_type, handler, with_sender=False):
+        self.handlers[msg_type] = handler
+
+    def call_later(self, delay, callback):
+        return self.timers.call_later(delay, callback)
+
+    def get_max_payload(self, ip):
+        return DEFAULT_PATH_MTU - UDP_IP_HEADER_SIZE
+
+    def send_message(self, message, target_ip=None, target_port=LSNP_PORT):
+        data = lsnp_codec.encode(message)
+        self.sent.append(lsnp_codec.decode(data))
+        if self.remote is not None and not self.drop(message):
+            self.remote.inbox.put(data)
+
+    def send_messages(self, messages):
+        for message, ip, port in messages:
+            self.send_message(message, ip, port)
+        return len(messages)
+
+    def deliver(self):
+        while True:
+            message = lsnp_codec.LSNPMessage(self.inbox.get())
+            self.handlers[message["TYPE"]](message)
+            self.handled.append(message["TYPE"])
+
+    def sent_of(self, msg_type):
+        return [message for message in list(self.sent) if message["TYPE"] == msg_type]
+
+
+def wait_for(condition, timeout=5.0):
+    deadline = time.monotonic() + timeout
+    while not condition():
+        if time.monotonic() > deadline:
+            return False
+        time.sleep(0.005)
+    return True
+
+
+@pytest.fixture
+def pair(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)  # Received files go to downloads/
+    alice_net = loopbackNet("alice@127.0.0.1", 51001)
+    bob_net = loopbackNet("bob@127.0.0.1", 51002)
+    alice_net.connect(bob_net)
+    return fileGameSystem(alice_net), fileGameSystem(bob_net)
+
+
+def make_file(tmp_path, size):
+    path = tmp_path / "payload.bin"
+    path.write_bytes(os.urandom(size))
+    return str(path)
+
+
+def start_unanswered_transfer(tmp_path, size=100 * 1024):
+    """A sender whose receiver never answers: only the test's own reports reach it."""
+    net = loopbackNet("alice@127.0.0.1", 51001)
+    net.peers.see("127.0.0.1", 51002, "bob@127.0.0.1")
+    sender = fileGameSystem(net)
+    file_id = sender.send_file("bob@127.0.0.1", make_file(tmp_path, size))
+    assert sender.send_file_chunks(file_id)
+    file_info = sender.outgoing_files[file_id]
+    assert wait_for(lambda: len(file_info["in_flight"]) == FILE_WINDOW_INITIAL)
+    return sender, file_id, file_info
+
+
+def partial_report(file_id, total_chunks, received):
+    bitmap = chunkBitmap(total_chunks)
+    for index in received:
+        bitmap.add(index)
+    base, data = bitmap.encode(FILE_STATUS_MAX_CHUNKS)
+    return {"TYPE": MSG_FILE_RECEIVED, "FROM": "bob@127.0.0.1", "TO": "alice@127.0.0.1", "FILEID": file_id,
+            "STATUS": "PARTIAL", "BASE": base, "BITMAP": base64.b64encode(data), "RECEIVED": len(bitmap)}
+
+
+def test_partial_report_queues_the_gap_for_resending(tmp_path):
+    sender, file_id, file_info = start_unanswered_transfer(tmp_path)
+
+    sender.handle_file_received(partial_report(file_id, file_info["total_chunks"], [0, 1, 3]))
+    with file_info["lock"]:
+        assert [index for index in range(4) if index in file_info["acked"]] == [0, 1, 3]
+        assert file_info["lost"] == 1  # Chunk 2 was sent before chunk 3, which arrived
+        assert 2 not in file_info["in_flight"]
+        assert 2 in file_info["resend"] or 2 in file_info["resent"]
+        assert file_info["window"] == FILE_WINDOW_INITIAL / 2
+
+    # The gap goes out again (once the window has room, or on the retransmission timeout)
+    assert wait_for(lambda: len([m for m in sender.netSystem.sent_of(MSG_FILE_CHUNK) if m["CHUNK_INDEX"] == 2]) == 2)
+    assert file_info["retransmitted"] >= 1
+
+
+def test_karn_rule_takes_no_rtt_sample_from_resent_chunks(tmp_path):
+    sender, file_id, file_info = start_unanswered_transfer(tmp_path)
+    with file_info["lock"]:
+        file_info["resent"].add(0)  # As if chunk 0 had been sent twice
+
+    sender.handle_file_received(partial_report(file_id, file_info["total_chunks"], [0]))
+    assert file_info["rtt"].samples == 0
+    assert file_info["highest_acked_seq"] == -1
+
+    sender.handle_file_received(partial_report(file_id, file_info["total_chunks"], [0, 1]))
+    assert file_info["rtt"].samples == 1
+    assert file_info["highest_acked_seq"] == 1
+
+
+def test_transfer_recovers_dropped_chunks(pair, tmp_path):
+    alice, bob = pair
+    path = make_file(tmp_path, 300 * 1024)
+
+    # Lose the first copy of every fifth chunk
+    dropped = set()
+    def drop(message):
+        if message["TYPE"] != MSG_FILE_CHUNK or int(message["CHUNK_INDEX"]) % 5 or message["CHUNK_INDEX"] in dropped:
+            return False
+        dropped.add(message["CHUNK_INDEX"])
+        return True
+    alice.netSystem.drop = drop
+
+    file_id = alice.send_file("bob@127.0.0.1", path)
+    assert wait_for(lambda: file_id in bob.pending_file_offers)
+    assert bob.accept_file_offer(file_id)
+    assert wait_for(lambda: "FILE_ACCEPTED" in alice.netSystem.handled)  # With the agreed chunk size
+    assert alice.send_file_chunks(file_id)
+
+    file_info = alice.outgoing_files[file_id]
+    assert wait_for(lambda: file_info["status"] == "RECEIVED_COMPLETE", timeout=10)
+    assert dropped and file_info["retransmitted"] >= len(dropped)
+    assert bob.netSystem.sent_of(MSG_FILE_RECEIVED)[0]["STATUS"] == "PARTIAL"
+    with open(path, "rb") as original, open(os.path.join("downloads", "payload.bin"), "rb") as received:
+        assert received.read() == original.read()
+    assert not [name for name in os.listdir("downloads") if name.endswith(".part")]
+
+
+def test_unknown_peer_gets_no_offer(tmp_path):
+    net = loopbackNet("alice@127.0.0.1", 51001)
+    sender = fileGameSystem(net)
+    with pytest.raises(LookupError):
+        sender.send_file("carol", make_file(tmp_path, 10))
+    assert net.sent == [] and sender.outgoing_files == {}
@@ -0,0 +1,150 @@
+import time
+
+from lsnp_structs import chunkBitmap, expiringSet, parsedToken, peerDirectory, rttEstimator, tokenCache
+from vars import *
+
+
+# peerDirectory
+
+def test_peer_is_placed_at_the_ip_in_its_user_id():
+    peers = peerDirectory()
+    peers.see("10.0.0.2", 51000, "alice@10.0.0.2")
+    assert peers.resolve("alice@10.0.0.2") == ("10.0.0.2", 51000)
+    assert peers.resolve("alice") == ("10.0.0.2", 51000)  # Bare names resolve once seen
+
+
+def test_unknown_bare_name_does_not_resolve():
+    peers = peerDirectory()
+    assert peers.resolve("carol") is None
+    assert peers.resolve("carol@10.0.0.9") == ("10.0.0.9", LSNP_PORT)
+
+
+def test_forged_from_does_not_move_a_peer():
+    peers = peerDirectory()
+    peers.see("10.0.0.2", 51000, "alice@10.0.0.2")
+    peers.see("10.0.0.66", 6666, "alice@10.0.0.2")  # Unverified datagram from elsewhere
+    assert peers.resolve("alice@10.0.0.2") == ("10.0.0.2", 51000)
+    assert peers.users_at("10.0.0.66") == []
+
+
+def test_forged_from_does_not_place_an_unknown_peer():
+    peers = peerDirectory()
+    peers.see("10.0.0.66", 6666, "bob@10.0.0.3")
+    assert peers.resolve("bob@10.0.0.3") == ("10.0.0.3", LSNP_PORT)
+
+
+def test_verified_datagram_moves_a_peer():
+    peers = peerDirectory()
+    peers.see("10.0.0.2", 51000, "alice@10.0.0.2")
+    peers.see("10.0.0.7", 52000, "alice@10.0.0.2", verified=True)
+    assert peers.resolve("alice@10.0.0.2") == ("10.0.0.7", 52000)
+    assert peers.users_at("10.0.0.2") == []
+    assert peers.users_at("10.0.0.7") == ["alice@10.0.0.2"]
+
+
+def test_peers_sharing_a_host_keep_their_own_ports():
+    peers = peerDirectory()
+    peers.see("10.0.0.2", 51000, "alice@10.0.0.2")
+    peers.see("10.0.0.2", 51001, "bob@10.0.0.2")
+    peers.see("10.0.0.2", None, "alice@10.0.0.2")  # A DM from an ephemeral port advertises nothing
+    assert peers.resolve("alice@10.0.0.2") == ("10.0.0.2", 51000)
+    assert peers.resolve("bob@10.0.0.2") == ("10.0.0.2", 51001)
+    assert peers.resolve("carol@10.0.0.2") == ("10.0.0.2", LSNP_PORT)  # Not a neighbour's port
+
+
+# rttEstimator
+
+def test_first_rtt_sample_sets_srtt_and_variance():
+    rtt = rttEstimator(initial_rto=1.0, min_rto=0.0, max_rto=60)
+    assert rtt.rto == 1.0 and rtt.srtt is None
+    assert rtt.add_sample(0.1) == 0.1 + 4 * 0.05
+    assert rtt.srtt == 0.1 and rtt.rttvar == 0.05
+
+
+def test_rtt_samples_are_smoothed():
+    rtt = rttEstimator(min_rto=0.0)
+    rtt.add_sample(0.1)
+    rtt.add_sample(0.2)
+    assert abs(rtt.rttvar - (0.75 * 0.05 + 0.25 * 0.1)) < 1e-9
+    assert abs(rtt.srtt - (0.875 * 0.1 + 0.125 * 0.2)) < 1e-9
+    assert rtt.get_stats()["samples"] == 2
+
+
+def test_rto_is_clamped():
+    assert rttEstimator(min_rto=0.2, max_rto=30).add_sample(0.001) == 0.2
+    assert rttEstimator(min_rto=0.2, max_rto=30).add_sample(20) == 30
+
+
+# chunkBitmap
+
+def test_bitmap_tracks_the_first_missing_chunk():
+    bitmap = chunkBitmap(20)
+    for index in (0, 1, 3):
+        assert bitmap.add(index)
+    assert not bitmap.add(3) and not bitmap.add(20)
+    assert bitmap.first_missing == 2 and len(bitmap) == 3
+    assert bitmap.missing(0, 6) == [2, 4, 5]
+    bitmap.add(2)
+    assert bitmap.first_missing == 4
+
+
+def test_bitmap_encode_merge_round_trip():
+    received = chunkBitmap(40)
+    for index in list(range(10)) + [12, 13, 30]:
+        received.add(index)
+    base, data = received.encode(FILE_STATUS_MAX_CHUNKS)
+    assert base == 8  # Starts at the byte holding first_missing
+
+    acked = chunkBitmap(40)
+    acked.add(0)
+    assert sorted(acked.merge(base, data)) == list(range(1, 10)) + [12, 13, 30]
+    assert acked.merge(base, data) == []  # Nothing new the second time
+    assert acked.missing(0, 14) == [10, 11]
+
+
+# expiringSet
+
+def test_expiring_set_forgets_keys_after_ttl():
+    seen = expiringSet(ttl=0.1, generations=2, max_entries=100)
+    seen.add("m1")
+    assert "m1" in seen and "m2" not in seen
+    time.sleep(0.25)
+    assert "m1" not in seen
+    assert seen.get_stats()["evictions"] == 1
+
+
+def test_expiring_set_is_bounded():
+    seen = expiringSet(ttl=60, generations=2, max_entries=4)
+    for i in range(10):
+        seen.add(i)
+    assert len(seen) <= 4
+    assert 9 in seen
+    assert seen.get_stats()["early_rotations"] > 0
+
+
+# tokenCache
+
+def test_token_cache_parses_once():
+    cache = tokenCache(maxsize=2)
+    token = "alice@10.0.0.2|1728942100|chat"
+    parsed = cache.get(token)
+    assert isinstance(parsed, parsedToken)
+    assert (parsed.user_id, parsed.expiry, parsed.scope, parsed.ip) == ("alice@10.0.0.2", 1728942100, "chat", "10.0.0.2")
+    assert cache.get(token) is parsed
+    assert cache.get_stats()["hits"] == 1
+
+
+def test_token_cache_keeps_rejection_reasons_and_evicts():
+    cache = tokenCache(maxsize=2)
+    assert cache.get("not-a-token") == "Invalid token format"
+    assert cache.get("alice@10.0.0.2|soon|chat") == "Invalid expiry timestamp"
+    cache.get("alice@10.0.0.2|1728942100|chat")
+    assert cache.get_stats()["evictions"] == 1
+
+
+def test_revoked_token_is_reparsed_after_invalidate():
+    cache = tokenCache()
+    token = "alice@10.0.0.2|1728942100|chat"
+    assert not cache.get(token).revoked
+    cache.invalidate(token)
+    assert cache.get(token, revoked_tokens={token}).revoked
@@ -3,6 +3,54 @@ LSNP_PORT = 50999
 BROADCAST_INTERVAL = 300  # 5 minutes
 RETRY_TIMEOUT = 2  # seconds
 MAX_RETRIES = 3
+RETRY_BACKOFF_CAP = 30  # longest wait between retries (seconds)
+RETRY_JITTER = 0.25  # retry waits are randomly shortened by up to this fraction
+RTO_INITIAL = 1.0  # ACK timeout for peers without RTT samples yet (seconds)
+RTO_MIN = 0.2  # lower bound of the RTT-derived ACK timeout (seconds)
+RTO_MAX = 30  # upper bound of the RTT-derived ACK timeout (seconds)
+POST_DEFAULT_TTL = 3600  # seconds a stored post lives when it carries no TTL
+POST_PAGE_SIZE = 20  # posts per feed page
+EXPIRY_SWEEP_INTERVAL = 5  # seconds between expiry sweeps (posts, revoked tokens, invites, offers)
+GAME_INVITE_TTL = 600  # seconds an unanswered game invitation is kept
+FILE_OFFER_TTL = 600  # seconds an unanswered file offer is kept
+FILE_INCOMING_IDLE_TTL = 120  # seconds without a chunk before a started incoming transfer is dropped (and its .part file deleted)
+GAME_INACTIVITY_TIMEOUT = 900  # seconds without a move before a game times out
+TOKEN_CACHE_SIZE = 1024  # parsed tokens kept (LRU)
+TOKEN_LOG_SIZE = 100  # token validation attempts kept for auditing
+VALID_MESSAGES_LOG_SIZE = 200  # validated messages kept for analysis
+AUDIT_SPILL_DIR = None  # directory that receives entries rotated out of those logs as JSON lines (None = discard)
+LOCAL_IP_REFRESH_INTERVAL = 30  # seconds between local interface re-scans
+SEND_SOCKET_POOL_SIZE = 2  # long-lived UDP sockets used for sending
+INGRESS_WORKERS = 4  # handler worker threads (0 = handle on the listener thread)
+INGRESS_QUEUE_SIZE = 1024  # datagrams buffered per worker
+INGRESS_BLOCK_TIMEOUT = 0.05  # seconds the reader waits on a full queue before dropping
+RECV_BUFFER_SIZE = 4 * 1024 * 1024  # requested SO_RCVBUF (bytes, 0 = OS default)
+SEND_BUFFER_SIZE = 1024 * 1024  # requested SO_SNDBUF (bytes, 0 = OS default)
+IO_BATCH_SIZE = 32  # datagrams per recvmmsg/sendmmsg call
+MAX_DATAGRAM_SIZE = 9216  # bytes read per received datagram (a jumbo frame; also caps negotiated file chunks)
+DEFAULT_PATH_MTU = 1500  # assumed when the OS can't report the path MTU to a peer (Ethernet)
+UDP_IP_HEADER_SIZE = 28  # IPv4 + UDP header bytes in every packet
+PATH_MTU_TTL = 60  # seconds a probed path MTU is reused before asking the kernel again
+RECV_RING_SIZE = 256  # pooled receive buffers lent to handlers
+FILE_CHUNK_BURST = 8  # file chunks sent per batch before pausing
+FILE_TRANSFER_WORKERS = 2  # threads that read, encode and send the chunks of all outgoing transfers
+FILE_WINDOW_SIZE = 1024  # most file chunks in flight (sent, not yet reported received) per transfer
+FILE_WINDOW_INITIAL = 32  # chunks in flight when a transfer starts (the window grows from there)
+FILE_WINDOW_MIN = 4  # the window never shrinks below this
+FILE_STATUS_EVERY = 4  # chunks the receiver takes in between FILE_RECEIVED progress reports
+FILE_STATUS_GAP_EVERY = 2  # ... and in between reports while chunks arrive past a missing one
+FILE_STATUS_INTERVAL = 0.02  # seconds before a progress report is sent anyway while chunks are missing
+FILE_STATUS_MAX_CHUNKS = 2048  # chunks covered by the bitmap of one progress report
+FILE_RETRANSMIT_TIMEOUT = 1.0  # seconds without a report before the sender resends what is in flight (until the RTT is measured)
+FILE_MAX_STALLS = 10  # timeouts in a row without progress before a transfer fails
+FILE_LEGACY_BURST_GAP = 0.01  # pause between bursts to receivers that send no progress reports
+HANDLER_LATENCY_BUCKETS_MS = (0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 25, 50, 100)  # histogram upper bounds
+DEDUP_TTL = 3600  # seconds a processed MESSAGE_ID is remembered (the longest POST/token TTL in use)
+DEDUP_GENERATIONS = 4  # generations the duplicate filter rotates through
+DEDUP_MAX_ENTRIES = 200000  # memory ceiling for remembered MESSAGE_IDs
+DEDUP_BLOOM_PREFILTER = False  # check a Bloom filter before the exact duplicate set on the receive path
+BLOOM_CAPACITY = 50000  # MESSAGE_IDs per Bloom filter generation
+BLOOM_ERROR_RATE = 0.01  # target false-positive rate (positives are confirmed against the exact set)
 
 # Token Scopes
 SCOPE_CHAT = "chat"
@@ -42,5 +90,5 @@ WINNING_LINES = [
 ]
 
 # File Transfer
-MAX_CHUNK_SIZE = 1024  # bytes
+MAX_CHUNK_SIZE = 1024  # bytes per file chunk to receivers that don't negotiate a chunk size
 MAX_FILE_SIZE = 20 * 1024 * 1024  # 20MB
\ No newline at end of file